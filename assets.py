@@ -0,0 +1,43 @@
+import os
+
+import pygame
+
+import simulation as sim
+
+# Process-wide image cache for the pygame front end. Every file is loaded from disk once and
+# the surface is shared by all vehicles. Vehicle images also get every rotation frame a turn can
+# reach, precomputed once, so drawing a turning vehicle is a dictionary lookup. Paths such as
+# "images/intersection.png" are relative to this directory, whatever the working directory is.
+images = {}
+vehicleFrames = {}
+root = os.path.dirname(os.path.abspath(__file__))
+
+
+def image(path):
+    if path not in images:
+        surface = pygame.image.load(os.path.join(root, path))
+        # Match the display's pixel format once a window exists, which makes blitting much cheaper
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        images[path] = surface
+    return images[path]
+
+
+# Image of a vehicle rotated by angle degrees, one of the steps of sim.rotationAngle up to +/-90
+def vehicleFrame(path, angle):
+    frames = vehicleFrames.get(path)
+    if frames is None:
+        original = image(path)
+        frames = {0: original}
+        for step in range(sim.rotationAngle, 91, sim.rotationAngle):
+            frames[step] = pygame.transform.rotate(original, step)
+            frames[-step] = pygame.transform.rotate(original, -step)
+        vehicleFrames[path] = frames
+    return frames[angle]
+
+
+# Load every vehicle image and its rotation frames up front, so spawn bursts never touch the disk
+def preload():
+    for direction in sim.directionNumbers.values():
+        for vehicleClass in sim.vehicleTypes.values():
+            vehicleFrame("images/" + direction + "/" + vehicleClass + ".png", 0)
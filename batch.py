@@ -0,0 +1,259 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import demand
+import signal_policy
+import simulation as sim
+from engine import Engine
+from stats_sink import checkStatsFile
+
+# Batch runner: expands a sweep definition into scenarios and runs them in parallel on a pool of
+# worker processes. Every scenario gets its own Simulation with its own random stream, so the
+# workers stay warm (modules imported, image sizes read) and run scenario after scenario.
+
+# Parameters a sweep can vary, with the values used when the sweep does not mention them
+sweepDefaults = {
+    'simulation_time': [300],
+    'intelligent_mode': [True],
+    'signal_policy': ['greedy'],
+    'random_timer': [True],
+    'green_timers': [[10, 10, 10, 10]],
+    'vehicle_types': [['car', 'bus', 'truck', 'bike']],
+    'arrival_rate': [1.0],
+    'arrival_model': ['uniform'],
+    'seeds': [0],
+}
+
+# File extension of each stats format
+extensions = {'text': 'txt', 'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet'}
+
+
+# Every combination of the swept values, one scenario dict each, seeds varying fastest.
+# `seeds` may be a list of seeds or a number n meaning seeds 0..n-1. Green timers only apply
+# without the random green timer, so sweeping them turns it off.
+def expandSweep(sweep):
+    unknown = set(sweep) - set(sweepDefaults)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    values = dict(sweepDefaults)
+    values.update(sweep)
+    if isinstance(values['seeds'], int):
+        if values['seeds'] < 1:
+            raise ValueError(f"seeds needs a positive number of seeds, got {values['seeds']}")
+        values['seeds'] = list(range(values['seeds']))
+    if 'green_timers' in sweep:
+        if True in sweep.get('random_timer', []):
+            raise ValueError("green_timers cannot be swept together with random_timer true, "
+                             "the random green timer ignores them")
+        values['random_timer'] = [False]
+    for name, options in values.items():
+        if not isinstance(options, list) or not options:
+            raise ValueError(f"Sweep parameter {name} needs a non-empty list of values")
+
+    # Traditional mode always runs the fixed cycle, so its scenarios do not vary by policy
+    names = list(sweepDefaults)
+    scenarios = []
+    seen = set()
+    for combination in itertools.product(*(values[name] for name in names)):
+        scenario = dict(zip(names, combination))
+        if not scenario['intelligent_mode']:
+            scenario['signal_policy'] = 'fixed'
+        key = repr(list(scenario.values()))
+        if key in seen:
+            continue
+        seen.add(key)
+        scenario['seed'] = scenario.pop('seeds')
+        scenario['scenario'] = len(scenarios)
+        scenarios.append(scenario)
+    return scenarios
+
+
+def scenarioParameters(scenario):
+    params = sim.defaultParameters()
+    params['simulation_time'] = scenario['simulation_time']
+    params['intelligent_mode'] = scenario['intelligent_mode']
+    params['signal_policy'] = scenario['signal_policy']
+    params['random_timer'] = scenario['random_timer']
+    params['green_timers'] = list(scenario['green_timers'])
+    unknown = set(scenario['vehicle_types']) - set(params['vehicle_types'])
+    if unknown:
+        raise ValueError(f"Unknown vehicle types in the sweep: {', '.join(sorted(unknown))}")
+    params['vehicle_types'] = {vehicleType: vehicleType in scenario['vehicle_types']
+                               for vehicleType in params['vehicle_types']}
+    params['arrival_rate'] = scenario['arrival_rate']
+    params['arrival_model'] = scenario['arrival_model']
+    if not any(params['vehicle_types'].values()):
+        raise ValueError("Please select at least one vehicle type.")
+    if params['signal_policy'] not in signal_policy.policies:
+        raise ValueError(f"Unknown signal_policy {params['signal_policy']}")
+    demand.checkDemand(params)
+    return params
+
+
+# Run one scenario to completion in the calling process and return its row of the result table.
+# With statsDir set, the periodic stats of every scenario go to their own file.
+def runScenario(scenario, ticksPerSecond=60, statsDir=None, statsFormat='text'):
+    start = time.perf_counter()
+    engine = Engine(scenarioParameters(scenario), ticksPerSecond, seed=scenario['seed'])
+    simulation = engine.sim
+    simulation.statsRun = f"scenario-{scenario['scenario']}"
+    simulation.statsFormat = statsFormat
+    simulation.statsFile = None if statsDir is None else os.path.join(
+        statsDir, f"{simulation.statsRun}.{extensions[statsFormat]}")
+    summary = engine.run()
+
+    row = {
+        'scenario': scenario['scenario'],
+        'seed': scenario['seed'],
+        'simulation_time': scenario['simulation_time'],
+        'intelligent_mode': scenario['intelligent_mode'],
+        'signal_policy': scenario['signal_policy'],
+        'random_timer': scenario['random_timer'],
+        'green_timers': '/'.join(str(green) for green in scenario['green_timers']),
+        'vehicle_types': ','.join(scenario['vehicle_types']),
+        'arrival_rate': scenario['arrival_rate'],
+        'arrival_model': scenario['arrival_model'],
+        'crossed': sum(summary['crossed'].values()),
+    }
+    for direction in sim.directionNumbers.values():
+        row['crossed_' + direction] = summary['crossed'][direction]
+    for direction in sim.directionNumbers.values():
+        row['average_delay_' + direction] = round(summary['average_delay'][direction], 4)
+    for direction in sim.directionNumbers.values():
+        row['stopped_' + direction] = summary['stopped'][direction]
+    row['retired_vehicles'] = summary['retired_vehicles']
+    row['active_vehicles'] = summary['active_vehicles']
+    row['run_seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+# A scenario that cannot write its files fails on its own: its row only carries the error
+def runArgs(args):
+    try:
+        return runScenario(*args)
+    except OSError as e:
+        return {'scenario': args[0]['scenario'], 'error': str(e)}
+
+
+# Run all scenarios on `workers` processes (all cores by default) and return the rows in scenario order,
+# with an 'error' row for every scenario that failed
+def runBatch(scenarios, workers=None, ticksPerSecond=60, statsDir=None, statsFormat='text'):
+    if statsDir is not None:
+        os.makedirs(statsDir, exist_ok=True)
+    jobs = [(scenario, ticksPerSecond, statsDir, statsFormat) for scenario in scenarios]
+    if workers == 1:
+        return [runArgs(job) for job in jobs]
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(runArgs, jobs, chunksize=chunksize))
+
+
+def writeResults(rows, path):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# Mean crossings and delay per signal mode and policy, the comparison the sweeps are usually run for
+def printSummary(rows):
+    groups = [('Traditional', False, None)] + [(f"Intelligent ({policy})", True, policy)
+                                               for policy in signal_policy.policies if policy != 'fixed']
+    for name, mode, policy in groups:
+        selected = [row for row in rows if row['intelligent_mode'] == mode and (policy is None or
+                                                                              row['signal_policy'] == policy)]
+        if not selected:
+            continue
+        crossed = sum(row['crossed'] for row in selected) / len(selected)
+        delay = sum(row['average_delay_' + direction] for row in selected
+                    for direction in sim.directionNumbers.values()) / (4 * len(selected))
+        print(f"{name}: {len(selected)} runs, mean crossed {crossed:.1f}, mean average delay {delay:.2f} s")
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the traffic simulation in parallel.")
+    parser.add_argument('sweep', nargs='?',
+                        help="JSON file mapping sweep parameters to lists of values; flags below override it")
+    parser.add_argument('--time', type=int, nargs='+', help="simulation times in seconds")
+    parser.add_argument('--modes', nargs='+', choices=['intelligent', 'traditional'], help="signal modes")
+    parser.add_argument('--policies', nargs='+', choices=['greedy', 'predictive'], help="intelligent mode signal policies")
+    parser.add_argument('--green', type=int, nargs=4, metavar='SECONDS',
+                        help="fixed green times for the four directions (disables the random green timer)")
+    parser.add_argument('--vehicle-types', nargs='+', help="comma separated vehicle type sets, one per variant")
+    parser.add_argument('--arrival-rates', type=float, nargs='+', help="vehicles generated per simulated second")
+    parser.add_argument('--arrival-models', nargs='+', choices=[model for model in demand.models if model != 'file'],
+                        help="how vehicles arrive")
+    parser.add_argument('--seeds', type=int, help="number of seeds per combination, seeds 0..n-1")
+    parser.add_argument('--workers', type=int, help="worker processes (default: all cores)")
+    parser.add_argument('--ticks-per-second', type=int, default=60, help="fixed timesteps per simulated second")
+    parser.add_argument('--stats-dir', help="directory for the periodic stats of each scenario")
+    parser.add_argument('--stats-format', choices=list(extensions), default='text', help="format of those stats files")
+    parser.add_argument('--output', default='batch_results.csv', help="CSV file the result table is written to")
+    return parser
+
+
+def sweepFromArgs(args):
+    sweep = {}
+    if args.sweep:
+        with open(args.sweep) as file:
+            sweep = json.load(file)
+    if args.time:
+        sweep['simulation_time'] = args.time
+    if args.modes:
+        sweep['intelligent_mode'] = [mode == 'intelligent' for mode in args.modes]
+    if args.policies:
+        sweep['signal_policy'] = args.policies
+    if args.green:
+        sweep['random_timer'] = [False]
+        sweep['green_timers'] = [args.green]
+    if args.vehicle_types:
+        sweep['vehicle_types'] = [[vehicleType.strip() for vehicleType in variant.split(',')]
+                                  for variant in args.vehicle_types]
+    if args.arrival_rates:
+        sweep['arrival_rate'] = args.arrival_rates
+    if args.arrival_models:
+        sweep['arrival_model'] = args.arrival_models
+    if args.seeds is not None:
+        sweep['seeds'] = args.seeds
+    return sweep
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    try:
+        scenarios = expandSweep(sweepFromArgs(args))
+        for scenario in scenarios:
+            scenarioParameters(scenario)
+        if args.stats_dir:
+            checkStatsFile(args.stats_dir, args.stats_format)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    rows = runBatch(scenarios, args.workers, args.ticks_per_second, args.stats_dir, args.stats_format)
+    failed = [row for row in rows if 'error' in row]
+    rows = [row for row in rows if 'error' not in row]
+    for row in failed:
+        print(f"Error: scenario {row['scenario']}: {row['error']}", file=sys.stderr)
+    if not rows:
+        return 2
+    try:
+        writeResults(rows, args.output)
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    print(f"Ran {len(rows)} scenarios in {time.perf_counter() - start:.1f} s, results in {args.output}")
+    printSummary(rows)
+    return 2 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import json
+import os
+
+import signal_policy
+import simulation as sim
+from demand import checkDemand
+
+# Simulation parameters from a TOML or JSON file, for scripted runs that skip the setup dialog.
+# The file uses the keys of simulation.defaultParameters(); anything left out keeps its default:
+#
+#   simulation_time = 600
+#   intelligent_mode = false
+#   random_timer = false
+#   green_timers = [15, 10, 15, 10]
+#   vehicle_types = ["car", "bike"]
+
+
+def readFile(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Reading TOML config files needs Python 3.11 or the tomli package.")
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    if extension == '.json':
+        with open(path) as file:
+            return json.load(file)
+    raise ValueError(f"Config file {path} must be .toml or .json")
+
+
+# Complete, validated parameters from the values read from `source` (a file name, for messages)
+def checkParameters(values, source):
+    params = sim.defaultParameters()
+    vehicleTypes = list(params['vehicle_types'])
+    unknown = set(values) - set(params)
+    if unknown:
+        raise ValueError(f"Unknown config keys in {source}: {', '.join(sorted(unknown))}")
+    params.update(values)
+
+    # vehicle_types may list the allowed types instead of mapping types to flags; either way every
+    # type ends up with a flag, in the default order
+    selected = params['vehicle_types']
+    unknown = set(selected) - set(vehicleTypes)
+    if unknown:
+        raise ValueError(f"Unknown vehicle types in {source}: {', '.join(sorted(unknown))}")
+    if isinstance(selected, dict):
+        selected = [vehicleType for vehicleType, allowed in selected.items() if allowed]
+    params['vehicle_types'] = {vehicleType: vehicleType in selected for vehicleType in vehicleTypes}
+    if len(params['green_timers']) != sim.noOfSignals:
+        raise ValueError(f"green_timers needs {sim.noOfSignals} values")
+    if not any(params['vehicle_types'].values()):
+        raise ValueError("Please select at least one vehicle type.")
+    if params['signal_policy'] not in signal_policy.policies:
+        raise ValueError(f"Unknown signal_policy {params['signal_policy']} in {source}")
+    try:
+        checkDemand(params)
+    except ValueError as e:
+        raise ValueError(f"{e} in {source}")
+    return params
+
+
+def loadConfig(path):
+    return checkParameters(readFile(path), path)
@@ -0,0 +1,350 @@
+import csv
+import datetime
+import os
+
+import numpy as np
+
+import simulation as sim
+from vehicle_store import TURN_HEADING
+
+# Demand models: when vehicles arrive, on which approach, in which lane, whether they turn, and of
+# which class. The original generator ('uniform' below) spawns arrival_rate vehicles every simulated
+# second, on a random approach, turning 40% of the time, and stays in simulation.py. The models here
+# draw a whole minute of arrivals at a time with numpy and hand them out tick by tick:
+#
+#   poisson  each approach is a Poisson process with its own rate
+#   bursty   vehicles arrive in platoons: platoon starts are a Poisson process and each platoon holds a
+#            geometrically distributed number of vehicles (platoon_size on average), platoon_headway apart
+#
+# Parameters (simulation.defaultParameters, config files):
+#   approach_rates   vehicles per second on each approach (right, down, left, up);
+#                    arrival_rate split evenly when not given
+#   od_matrix        4 x 4 vehicles per hour from each approach (rows, by direction of travel) to each exit
+#                    heading (columns, same order); sets both the approach rates and where vehicles go
+#   demand_profile   multiplier of all rates over time: [[seconds, multiplier], ...] interpolated linearly,
+#                    or a preset stretched over the simulation time ('am_peak', 'pm_peak')
+#
+# Without an OD matrix vehicles keep the original routing: either lane, 40% of them turning.
+#
+# The 'file' model replays a demand file instead, such as detector counts from the field (see DemandFile).
+
+models = ('uniform', 'poisson', 'bursty', 'file')
+
+# Profiles as (fraction of the simulation time, multiplier)
+profilePresets = {
+    'flat': [[0, 1.0], [1, 1.0]],
+    'am_peak': [[0, 0.5], [0.3, 1.6], [0.5, 1.0], [1, 0.7]],
+    'pm_peak': [[0, 0.7], [0.5, 1.0], [0.7, 1.6], [1, 0.5]],
+}
+
+chunkSeconds = 60  # arrivals drawn at a time
+
+
+# (lane, will turn) of every way through the junction, by [direction of travel][exit heading]
+def routeTable():
+    table = [[[] for _ in range(sim.noOfSignals)] for _ in range(sim.noOfSignals)]
+    for direction in range(sim.noOfSignals):
+        for lane in (1, 2):
+            table[direction][direction].append((lane, 0))
+            heading = TURN_HEADING[direction, lane]
+            if heading != direction:
+                table[direction][heading].append((lane, 1))
+    return table
+
+
+routes = routeTable()
+
+
+# Raise ValueError when the demand parameters do not describe a valid model
+def checkDemand(params):
+    if params['arrival_model'] not in models:
+        raise ValueError(f"arrival_model must be one of {', '.join(models)}")
+    rates = params.get('approach_rates')
+    if rates is not None and (len(rates) != sim.noOfSignals or min(rates) < 0):
+        raise ValueError(f"approach_rates needs {sim.noOfSignals} rates of at least 0")
+    matrix = params.get('od_matrix')
+    if matrix is not None:
+        if len(matrix) != sim.noOfSignals or any(len(row) != sim.noOfSignals for row in matrix):
+            raise ValueError(f"od_matrix needs {sim.noOfSignals} rows of {sim.noOfSignals} flows")
+        for origin, row in enumerate(matrix):
+            for heading, flow in enumerate(row):
+                if flow < 0 or (flow > 0 and not routes[origin][heading]):
+                    raise ValueError(f"od_matrix: vehicles driving {sim.directionNumbers[origin]} cannot leave "
+                                     f"heading {sim.directionNumbers[heading]}")
+    profile = params.get('demand_profile')
+    if isinstance(profile, str):
+        if profile not in profilePresets:
+            raise ValueError(f"demand_profile must be a list of [seconds, multiplier] or one of "
+                             f"{', '.join(profilePresets)}")
+    elif profile is not None:
+        if not profile or any(len(point) != 2 or point[1] < 0 for point in profile):
+            raise ValueError("demand_profile needs [seconds, multiplier] points with multipliers of at least 0")
+    if params.get('platoon_size', 1) < 1:
+        raise ValueError("platoon_size must be at least 1")
+    if params['arrival_model'] == 'file':
+        if not params.get('demand_file'):
+            raise ValueError("arrival_model file needs a demand_file")
+        missing = set(fileColumns) - set(fileColumnNames(params['demand_file']))
+        if missing:
+            raise ValueError(f"Demand file {params['demand_file']} lacks the columns {', '.join(sorted(missing))}")
+
+
+class ArrivalModel:
+    # The rngs are numpy Generators, one each for arrival times and approaches, lanes and turns, and
+    # vehicle classes, like the streams of a seeded Simulation; classes are the allowed keys of
+    # simulation.vehicleTypes
+    def __init__(self, params, simulationTime, ticksPerSecond, classes, arrivalRng, routeRng, classRng):
+        self.model = params['arrival_model']
+        self.ticksPerSecond = ticksPerSecond
+        self.classes = np.asarray(classes)
+        self.arrivalRng = arrivalRng
+        self.routeRng = routeRng
+        self.classRng = classRng
+        self.platoonSize = params.get('platoon_size', 3)
+        self.platoonHeadway = int(params.get('platoon_headway', 1) * ticksPerSecond)
+
+        # Arrival rate of each approach, and the routes of each with their probabilities
+        matrix = params.get('od_matrix')
+        self.routes = []
+        self.routeProbabilities = []
+        if matrix is not None:
+            flows = np.asarray(matrix, dtype=float)
+            self.rates = flows.sum(axis=1) / 3600
+            for direction in range(sim.noOfSignals):
+                options = []
+                weights = []
+                for heading, flow in enumerate(flows[direction]):
+                    for route in routes[direction][heading]:
+                        options.append(route)
+                        weights.append(flow / len(routes[direction][heading]))
+                self.addRoutes(options, weights)
+        else:
+            rates = params.get('approach_rates')
+            if rates is None:
+                rates = [params.get('arrival_rate', 1.0) / sim.noOfSignals] * sim.noOfSignals
+            self.rates = np.asarray(rates, dtype=float)
+            for direction in range(sim.noOfSignals):
+                self.addRoutes([(1, 0), (1, 1), (2, 0), (2, 1)], [0.3, 0.2, 0.3, 0.2])
+
+        profile = params.get('demand_profile')
+        if profile is None:
+            profile = profilePresets['flat']
+            scale = 1
+        elif isinstance(profile, str):
+            profile = profilePresets[profile]
+            scale = simulationTime
+        else:
+            scale = 1
+        profile = sorted(profile)
+        self.profileTimes = np.array([point[0] * scale for point in profile], dtype=float)
+        self.profileValues = np.array([point[1] for point in profile], dtype=float)
+
+        self.generatedUntil = 0  # ticks drawn so far
+        self.carried = np.zeros(0, dtype=np.int64)  # platoon vehicles due after the last chunk, per field below
+        self.carriedDirections = np.zeros(0, dtype=np.int64)
+        self.ticks = np.zeros(0, dtype=np.int64)
+        self.position = 0
+
+    def addRoutes(self, options, weights):
+        weights = np.asarray(weights, dtype=float)
+        total = weights.sum()
+        self.routes.append(np.array(options if options else [(1, 0)], dtype=np.int64))
+        self.routeProbabilities.append(np.cumsum(weights / total) if total > 0 else np.ones(1))
+
+    # Expected arrivals per tick of every approach over the given ticks, shape (ticks, approaches)
+    def expected(self, start, count):
+        seconds = (start + np.arange(count)) / self.ticksPerSecond
+        multiplier = np.interp(seconds, self.profileTimes, self.profileValues)
+        return multiplier[:, None] * self.rates[None, :] / self.ticksPerSecond
+
+    # Draw the arrivals of the next chunk of ticks
+    def generate(self):
+        start = self.generatedUntil
+        count = chunkSeconds * self.ticksPerSecond
+        end = start + count
+        expected = self.expected(start, count)
+        if self.model == 'bursty':
+            platoons = self.arrivalRng.poisson(expected / self.platoonSize)
+            offsets, directions = np.nonzero(platoons)
+            starts = np.repeat(start + offsets, platoons[offsets, directions])
+            directions = np.repeat(directions, platoons[offsets, directions])
+            sizes = self.arrivalRng.geometric(1 / self.platoonSize, len(starts))
+            member = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            ticks = np.repeat(starts, sizes) + member * self.platoonHeadway
+            directions = np.repeat(directions, sizes)
+        else:
+            counts = self.arrivalRng.poisson(expected)
+            offsets, directions = np.nonzero(counts)
+            ticks = np.repeat(start + offsets, counts[offsets, directions])
+            directions = np.repeat(directions, counts[offsets, directions])
+
+        ticks = np.concatenate([self.carried, ticks])
+        directions = np.concatenate([self.carriedDirections, directions])
+        order = np.argsort(ticks, kind='stable')
+        ticks = ticks[order]
+        directions = directions[order]
+        due = ticks < end
+        self.carried = ticks[~due]
+        self.carriedDirections = directions[~due]
+        ticks = ticks[due]
+        directions = directions[due]
+
+        lanes = np.empty(len(ticks), dtype=np.int64)
+        turns = np.empty(len(ticks), dtype=np.int64)
+        draws = self.routeRng.random(len(ticks))
+        for direction in range(sim.noOfSignals):
+            rows = np.flatnonzero(directions == direction)
+            choice = np.searchsorted(self.routeProbabilities[direction], draws[rows], side='right')
+            choice = np.minimum(choice, len(self.routes[direction]) - 1)
+            lanes[rows] = self.routes[direction][choice, 0]
+            turns[rows] = self.routes[direction][choice, 1]
+
+        self.ticks = ticks
+        self.directions = directions
+        self.lanes = lanes
+        self.turns = turns
+        self.vehicleClasses = self.classRng.choice(self.classes, len(ticks))
+        self.position = 0
+        self.generatedUntil = end
+
+    # (direction, lane, will turn, vehicle class) of every vehicle arriving in the given tick
+    def arrivals(self, tick):
+        while tick >= self.generatedUntil:
+            self.generate()
+        first = self.position
+        last = first
+        ticks = self.ticks
+        while last < len(ticks) and ticks[last] <= tick:
+            last += 1
+        self.position = last
+        return zip(self.directions[first:last].tolist(), self.lanes[first:last].tolist(),
+                   self.turns[first:last].tolist(), self.vehicleClasses[first:last].tolist())
+
+
+# Demand files: one row per vehicle, in order of arrival, as CSV or Parquet with the columns
+#
+#   timestamp      seconds from the start of the file, or a date and time (ISO 8601 in CSV files),
+#                  counted from the first row
+#   approach       direction of travel: right, down, left or up (or 0-3)
+#   lane           1 or 2
+#   vehicle_class  car, bus, truck or bike
+#   turn           1 (or true) for a vehicle turning off, as lane 1 turns left and lane 2 right; 0 otherwise
+#
+# Rows are read as the simulation reaches them, so files of several days never need to fit in memory.
+# demand_start skips to that many seconds into the file, to replay one day of a longer recording.
+fileColumns = ('timestamp', 'approach', 'lane', 'vehicle_class', 'turn')
+
+batchRows = 65536  # Parquet rows read at a time
+
+
+def fileFormat(path):
+    return 'parquet' if os.path.splitext(path)[1].lower() == '.parquet' else 'csv'
+
+
+def importParquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Reading Parquet demand files needs the pyarrow package.")
+    return pyarrow.parquet
+
+
+def fileColumnNames(path):
+    if fileFormat(path) == 'parquet':
+        return importParquet().read_schema(path).names
+    with open(path, newline='') as file:
+        return next(csv.reader(file), [])
+
+
+# Every row of a demand file as a dict, read lazily
+def readRows(path):
+    if fileFormat(path) == 'parquet':
+        with importParquet().ParquetFile(path) as parquetFile:
+            for batch in parquetFile.iter_batches(batch_size=batchRows, columns=list(fileColumns)):
+                yield from batch.to_pylist()
+    else:
+        with open(path, newline='') as file:
+            yield from csv.DictReader(file)
+
+
+def parseTime(value):
+    if isinstance(value, (int, float, datetime.datetime)):
+        return value
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value)
+
+
+def parseTurn(value):
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('1', 'true', 'yes'):
+            return 1
+        if value in ('', '0', 'false', 'no'):
+            return 0
+        raise ValueError(f"turn must be 0 or 1, not {value}")
+    return int(bool(value))
+
+
+# Arrivals replayed from a demand file; classes are the allowed keys of simulation.vehicleTypes, and
+# vehicles of the other classes are left out as the random generators leave them out
+class DemandFile:
+    def __init__(self, params, ticksPerSecond, classes):
+        self.path = params['demand_file']
+        self.ticksPerSecond = ticksPerSecond
+        self.start = params.get('demand_start', 0)
+        self.classes = {sim.vehicleTypes[vehicleClass]: vehicleClass for vehicleClass in classes}
+        self.rows = self.read()
+        self.next = next(self.rows, None)
+
+    # (tick, direction, lane, will turn, vehicle class) of every vehicle in the file, in order
+    def read(self):
+        directions = {name: number for number, name in sim.directionNumbers.items()}
+        classNames = set(sim.vehicleTypes.values())
+        first = None
+        lastTick = None
+        rows = readRows(self.path)
+        try:
+            for number, row in enumerate(rows, 1):
+                try:
+                    time = parseTime(row['timestamp'])
+                    if first is None:
+                        first = time if isinstance(time, datetime.datetime) else 0
+                    seconds = (time - first).total_seconds() if isinstance(time, datetime.datetime) else time - first
+                    tick = round((seconds - self.start) * self.ticksPerSecond)
+                    if lastTick is not None and tick < lastTick:
+                        raise ValueError("timestamps must not decrease")
+                    lastTick = tick
+
+                    approach = str(row['approach']).strip().lower()
+                    direction = int(approach) if approach.isdigit() else directions.get(approach)
+                    if direction not in sim.directionNumbers:
+                        raise ValueError(f"unknown approach {row['approach']}")
+                    lane = int(row['lane'])
+                    if lane not in (1, 2):
+                        raise ValueError(f"lane must be 1 or 2, not {lane}")
+                    willTurn = parseTurn(row['turn'])
+                    vehicleClass = str(row['vehicle_class']).strip().lower()
+                    if vehicleClass not in classNames:
+                        raise ValueError(f"unknown vehicle_class {row['vehicle_class']}")
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"Demand file {self.path} row {number}: {e}")
+                if tick >= 0 and vehicleClass in self.classes:
+                    yield tick, direction, lane, willTurn, self.classes[vehicleClass]
+        finally:
+            rows.close()
+
+    # (direction, lane, will turn, vehicle class) of every vehicle arriving in the given tick
+    def arrivals(self, tick):
+        arrived = []
+        while self.next is not None and self.next[0] <= tick:
+            arrived.append(self.next[1:])
+            self.next = next(self.rows, None)
+        return arrived
+
+    # Close the file, also when the run ends before the last row
+    def close(self):
+        self.rows.close()
+        self.next = None
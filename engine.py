@@ -0,0 +1,264 @@
+import argparse
+import sys
+import time
+
+import simulation as sim
+from config import loadConfig
+from demand import checkDemand
+from logging_setup import configureLogging
+from stats_sink import checkStatsFile
+
+
+# Simulation engine driven by a single fixed-timestep clock. Signals, vehicle generation,
+# delay accounting and vehicle movement all advance in lock-step ticks, so a run is independent
+# of thread scheduling and frame rate. Runs headless, or paced to real time by the front end.
+class Engine:
+    # The engine owns its Simulation (self.sim), so any number of engines can run in one process.
+    # A seed gives the simulation its own random streams, as engines stepped side by side and
+    # reproducible runs need (see sim.Simulation).
+    # With publish=True a sim.Snapshot of the state is published in self.snapshot at the end of every
+    # advanceTo() and step() call (not after each of its ticks, which nobody would read), for readers
+    # that must not look at the model while it changes
+    def __init__(self, params, ticksPerSecond=60, publish=False, seed=None):
+        self.sim = sim.Simulation(seed)
+        self.sim.configure(params)
+        self.sim.initialize(ticksPerSecond)
+        self.ticksPerSecond = ticksPerSecond
+        self.ticks = 0
+        self.pendingTime = 0.0
+        self.publish = publish
+        self.snapshot = sim.Snapshot(self.sim, self.ticks) if publish else None
+        # Outputs every tick is written to, as output.publish(simulation, tick): the shared state
+        # ring (shareState) and the trajectory recorder (record). They are closed by finish().
+        self.outputs = []
+
+    # One fixed timestep. Due signal events fire first, the per-second logic runs at the start
+    # of every simulated second, vehicles of a demand model arrive, and vehicles move on every tick.
+    def tick(self):
+        self.sim.signalController.update(self.ticks)
+        if self.ticks % self.ticksPerSecond == 0:
+            self.second()
+        if self.sim.demand is not None:
+            self.sim.spawnArrivals(self.ticks)
+        self.sim.moveVehicles()
+        self.ticks += 1
+        for output in self.outputs:
+            output.publish(self.sim, self.ticks)
+
+    # One simulated second of vehicle generation and delay accounting,
+    # followed by retiring the vehicles that have left the canvas
+    def second(self):
+        self.sim.generateVehicles()
+        self.sim.simTick()
+        self.sim.retireVehicles()
+
+    # Advance the simulation by dt simulated seconds, as whole ticks; any remainder carries over
+    def step(self, dt):
+        self.pendingTime += dt
+        ticks = int(self.pendingTime * self.ticksPerSecond + 1e-9)
+        self.pendingTime -= ticks / self.ticksPerSecond
+        for _ in range(ticks):
+            self.tick()
+        if self.publish:
+            self.snapshot = sim.Snapshot(self.sim, self.ticks)
+        return ticks
+
+    # Run the ticks due by simulated time `seconds`, at most maxTicks of them so a slow
+    # front end falls behind real time instead of stalling, and never past the simulation time
+    def advanceTo(self, seconds, maxTicks=None):
+        due = min(int(seconds * self.ticksPerSecond), self.sim.simulationTime * self.ticksPerSecond) - self.ticks
+        if maxTicks is not None:
+            due = min(due, maxTicks)
+        for _ in range(max(due, 0)):
+            self.tick()
+        if self.publish:
+            self.snapshot = sim.Snapshot(self.sim, self.ticks)
+
+    def simulatedTime(self):
+        return self.ticks / self.ticksPerSecond
+
+    def finished(self):
+        return self.ticks >= self.sim.simulationTime * self.ticksPerSecond
+
+    # Run until the configured simulation time is reached and write the final stats.
+    # With realtime=True one simulated second takes one wall-clock second.
+    def run(self, realtime=False):
+        start = time.perf_counter()
+        while not self.finished():
+            self.tick()
+            if realtime:
+                delay = start + self.simulatedTime() - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        return self.finish()
+
+    # Write the final stats, close the stats and demand files and return the summary of the run.
+    # A run that ends on a write period has written its last stats already.
+    def finish(self):
+        if self.sim.lastWriteTime != self.sim.timeElapsed:
+            self.sim.writeStatsToFile()
+        self.sim.closeStats()
+        close = getattr(self.sim.demand, 'close', None)  # a demand file is read as the run goes
+        if close is not None:
+            close()
+        for output in self.outputs:
+            output.close()
+        self.outputs = []
+        return self.summary()
+
+    # Write the state of every tick into a shared-memory ring that viewers in other processes
+    # attach to by name (viewer.py); the name is generated when none is given
+    def shareState(self, name=None):
+        from shared_state import StateRing
+        ring = StateRing(name)
+        ring.publish(self.sim, self.ticks)
+        self.outputs.append(ring)
+        return ring.name
+
+    # Record spawns, signal phase changes and the state of every tick into a trajectory log,
+    # which recording.py plays back from any point in the run
+    def record(self, path):
+        from recording import Recorder
+        recorder = Recorder(path, self.sim, self.ticksPerSecond)
+        recorder.publish(self.sim, self.ticks)
+        self.outputs.append(recorder)
+
+    def summary(self):
+        return {
+            'time': self.sim.timeElapsed,
+            'ticks': self.ticks,
+            'crossed': {direction: self.sim.vehicles[direction]['crossed']
+                        for direction in sim.directionNumbers.values()},
+            'average_delay': dict(self.sim.avgDelay),
+            'stopped': dict(self.sim.stoppedVehicles),
+            'active_vehicles': len(self.sim.spawned),
+            'retired_vehicles': self.sim.retiredVehicles,
+        }
+
+
+# Run several engines to completion in this process, one tick of each in turn, and return their
+# summaries in the order given. Engines with different simulation times simply drop out earlier.
+def runAll(engines):
+    active = [engine for engine in engines if not engine.finished()]
+    while active:
+        for engine in active:
+            engine.tick()
+        active = [engine for engine in active if not engine.finished()]
+    return [engine.finish() for engine in engines]
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Run the traffic simulation without a display.")
+    parser.add_argument('--config', help="TOML or JSON file with the simulation parameters; flags override it")
+    parser.add_argument('--time', type=int, help="simulation time in seconds (default 300)")
+    parser.add_argument('--write-period', type=int, help="stats write period in seconds (default 30)")
+    parser.add_argument('--traditional', action='store_true', help="use fixed-time signals instead of intelligent mode")
+    parser.add_argument('--signal-policy', choices=['greedy', 'predictive'],
+                        help="intelligent mode signal policy (default greedy, see signal_policy.py)")
+    parser.add_argument('--green', type=int, nargs=4, metavar='SECONDS',
+                        help="fixed green times for the four directions (disables the random green timer)")
+    parser.add_argument('--vehicle-types', help="comma separated list of allowed vehicle types (default all)")
+    parser.add_argument('--arrival-rate', type=float, help="vehicles generated per simulated second (default 1)")
+    parser.add_argument('--arrival-model', choices=['uniform', 'poisson', 'bursty'],
+                        help="how vehicles arrive (default uniform, see demand.py)")
+    parser.add_argument('--approach-rates', type=float, nargs=4, metavar='RATE',
+                        help="vehicles per second on each approach, for the poisson and bursty models")
+    parser.add_argument('--demand-profile', choices=['flat', 'am_peak', 'pm_peak'],
+                        help="demand over the simulation time, for the poisson and bursty models")
+    parser.add_argument('--demand-file', help="CSV or Parquet file of vehicle arrivals to replay (see demand.py)")
+    parser.add_argument('--demand-start', type=float, help="seconds into the demand file the run starts at")
+    parser.add_argument('--seed', help="seed of the random streams; the same seed gives the same vehicles in every mode")
+    parser.add_argument('--ticks-per-second', type=int, default=60, help="fixed timesteps per simulated second")
+    parser.add_argument('--realtime', action='store_true', help="pace the run to the wall clock")
+    parser.add_argument('--stats-file', default='simulation_stats.txt',
+                        help="file the periodic stats are written to; {run} and {pid} are replaced per run")
+    parser.add_argument('--stats-format', choices=['text', 'csv', 'jsonl', 'parquet'],
+                        help="stats file format (default: from the file extension, text otherwise)")
+    parser.add_argument('--stats-flush-every', type=int, default=1,
+                        help="write periods between flushes of the stats file, 0 to flush only at the end")
+    parser.add_argument('--run-name', help="run name recorded in the stats (default: start timestamp)")
+    parser.add_argument('--share-state', metavar='NAME',
+                        help="publish every tick into shared memory under this name for viewer.py")
+    parser.add_argument('--record', metavar='FILE', help="record the run into a trajectory log for recording.py")
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG logs every crossing and the per-second status, INFO the signal decisions")
+    parser.add_argument('--log-rate', type=float, default=20,
+                        help="most log records per second of any one kind, 0 for no limit")
+    return parser
+
+
+def parametersFromArgs(args):
+    params = loadConfig(args.config) if args.config else sim.defaultParameters()
+    if args.time is not None:
+        params['simulation_time'] = args.time
+    if args.write_period is not None:
+        params['write_period'] = args.write_period
+    if args.traditional:
+        params['intelligent_mode'] = False
+    if args.signal_policy:
+        params['signal_policy'] = args.signal_policy
+    if args.arrival_rate is not None:
+        params['arrival_rate'] = args.arrival_rate
+    if args.arrival_model:
+        params['arrival_model'] = args.arrival_model
+    if args.approach_rates:
+        params['approach_rates'] = args.approach_rates
+    if args.demand_profile:
+        params['demand_profile'] = args.demand_profile
+    if args.demand_file:
+        params['arrival_model'] = 'file'
+        params['demand_file'] = args.demand_file
+    if args.demand_start is not None:
+        params['demand_start'] = args.demand_start
+    if args.green:
+        params['random_timer'] = False
+        params['green_timers'] = args.green
+    if args.vehicle_types:
+        allowed = [vehicleType.strip() for vehicleType in args.vehicle_types.split(',')]
+        unknown = set(allowed) - set(params['vehicle_types'])
+        if unknown:
+            raise ValueError(f"Unknown vehicle types in --vehicle-types: {', '.join(sorted(unknown))}")
+        params['vehicle_types'] = {vehicleType: vehicleType in allowed for vehicleType in params['vehicle_types']}
+    if not any(params['vehicle_types'].values()):
+        raise ValueError("Please select at least one vehicle type.")
+    checkDemand(params)
+    return params
+
+
+def applyStatsArgs(simulation, args):
+    simulation.statsFile = args.stats_file
+    simulation.statsFormat = args.stats_format
+    simulation.statsFlushEvery = args.stats_flush_every
+    simulation.statsRun = args.run_name
+
+
+def applyOutputArgs(engine, args):
+    if args.share_state:
+        engine.shareState(args.share_state)
+    if args.record:
+        engine.record(args.record)
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    try:
+        params = parametersFromArgs(args)
+        checkStatsFile(args.stats_file, args.stats_format)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    configureLogging(args.log_level, args.log_rate)
+    try:
+        engine = Engine(params, args.ticks_per_second, seed=args.seed)
+        applyStatsArgs(engine.sim, args)
+        applyOutputArgs(engine, args)
+        summary = engine.run(args.realtime)
+    except (OSError, ValueError) as e:  # also a malformed row of a demand file, read as the run goes
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    print('Simulation finished:', summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+# Logging for the simulation. Every module logs to a child of the "traffic" logger; records are
+# rate limited and handed to a queue, and a background listener thread does the actual writing,
+# so logging never blocks the simulation loop. Below the configured level a call costs one
+# level check. Levels used:
+#   DEBUG    per-vehicle and per-second diagnostics (crossings, turns, queue and delay status)
+#   INFO     signal decisions
+#   WARNING  and above: problems
+
+logger = logging.getLogger('traffic')
+listener = None
+
+
+# Token bucket per message template: at most `rate` records per second of each kind (with bursts of
+# the same size), the rest are dropped and counted. A rate of 0 disables the limit.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.buckets = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        tokens, last = self.buckets.get(key, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            self.dropped += 1
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+
+def configureLogging(level='WARNING', rate=20, stream=None):
+    global listener
+    stopLogging()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    queueHandler = logging.handlers.QueueHandler(records)
+    queueHandler.addFilter(RateLimitFilter(rate))
+
+    logger.handlers[:] = [queueHandler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+
+
+# Write out everything still queued and stop the listener thread
+def stopLogging():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stopLogging)
@@ -1,16 +1,25 @@
-import random
+import logging
 import time
-import threading
 
-import pandas as pd
 import pygame
 import sys
-import tkinter as tk
-from tkinter import messagebox
-from matplotlib import pyplot as plt
-from tkinter import ttk
+
+import assets
+import simulation as sim
+from engine import Engine, applyOutputArgs, applyStatsArgs, buildParser, parametersFromArgs
+from logging_setup import configureLogging
+from renderer import Renderer
+from stats_sink import checkStatsFile
+
+log = logging.getLogger('traffic.main')
+
+# pandas, matplotlib and tkinter are slow to import, so they are only imported by the
+# dialogs and plots that use them
 
 def get_simulation_parameters():
+    import tkinter as tk
+    from tkinter import messagebox, ttk
+
     # Create the main dialog window
     dialog = tk.Tk()
     dialog.title("Traffic Simulation Setup")
@@ -145,86 +154,13 @@ def get_simulation_parameters():
     
     return result
 
-# Replace the existing parameter collection code with:
-params = get_simulation_parameters()
-
-# Update global variables with the collected parameters
-simulationTime = params['simulation_time']
-timePeriod = params['write_period']
-intelligentMode = params['intelligent_mode']
-randomGreenSignalTimer = params['random_timer']
-defaultGreenQ = params['green_timers']
-allowedVehicleTypes = params['vehicle_types']
-
-# Default values of signal timers
-defaultGreen = {0: defaultGreenQ[0], 1: defaultGreenQ[1], 2: defaultGreenQ[2], 3: defaultGreenQ[3]}
-defaultRed = 150
-defaultYellow = 5
-noOfSignals = 4
-signals = []
-signalTexts = [None] * noOfSignals
-
-currentGreen = 0  # Indicates which signal is green currently
-nextGreen = (currentGreen + 1) % noOfSignals  # Indicates which signal will turn green next
-currentYellow = 0  # Indicates whether yellow signal is on or off
-avgDelay = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
-speeds = {'car': 2.25, 'bus': 1.8, 'truck': 1.8, 'bike': 2.5}  # average speeds of vehicles
-
-# Coordinates of vehicles' start
-x = {'right': [0, 0, 0], 'down': [755, 727, 697], 'left': [1400, 1400, 1400], 'up': [602, 627, 657]}
-y = {'right': [348, 370, 398], 'down': [0, 0, 0], 'left': [498, 466, 436], 'up': [800, 800, 800]}
-
-vehicles = {'right': {0: [], 1: [], 2: [], 'crossed': 0}, 'down': {0: [], 1: [], 2: [], 'crossed': 0},
-            'left': {0: [], 1: [], 2: [], 'crossed': 0}, 'up': {0: [], 1: [], 2: [], 'crossed': 0}}
-vehicleTypes = {0: 'car', 1: 'bus', 2: 'truck', 3: 'bike'}
-directionNumbers = {0: 'right', 1: 'down', 2: 'left', 3: 'up'}
-
 # Coordinates of signal image, timer, and vehicle count
 signalCoods = [(530, 230), (810, 230), (810, 570), (530, 570)]
 signalTimerCoods = [(530, 210), (810, 210), (810, 550), (530, 550)]
 
-# Coordinates of stop lines
-stopLines = {'right': 590, 'down': 330, 'left': 800, 'up': 535}
-defaultStop = {'right': 580, 'down': 320, 'left': 810, 'up': 545}
-
-# Gap between vehicles
-stoppingGap = 25  # stopping gap
-movingGap = 25  # moving gap
-
-# set allowed vehicle types here
-
-allowedVehicleTypesList = []
-vehiclesTurned = {'right': {1: [], 2: []}, 'down': {1: [], 2: []}, 'left': {1: [], 2: []}, 'up': {1: [], 2: []}}
-vehiclesNotTurned = {'right': {1: [], 2: []}, 'down': {1: [], 2: []}, 'left': {1: [], 2: []}, 'up': {1: [], 2: []}}
-rotationAngle = 3
-mid = {'right': {'x': 705, 'y': 445}, 'down': {'x': 695, 'y': 450}, 'left': {'x': 695, 'y': 425},
-       'up': {'x': 695, 'y': 400}}
-
-# set random green signal time range
-randomGreenSignalTimerRange = [10, 20]
-
-timeElapsed = 0
-# simulationTime = 300
 timeElapsedCoods = (1100, 50)
-vehicleCountTexts = ["0", "0", "0", "0"]
 vehicleCountCoods = [(480, 210), (880, 210), (880, 550), (480, 550)]
 
-# for vehicle stats
-directionLeft = {'straight': 0, 'left': 0, 'right': 0}
-directionRight = {'straight': 0, 'left': 0, 'right': 0}
-directionUp = {'straight': 0, 'left': 0, 'right': 0}
-directionDown = {'straight': 0, 'left': 0, 'right': 0}
-
-# Stopped vehicles count
-stoppedVehiclesInJunction = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
-stoppedVehicles = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
-delayTimeForStoppedVehicles = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
-isVehicleStopped = {0: True, 1: True, 2: True, 3: True}
-
-# Initialize pygame
-pygame.init()
-simulation = pygame.sprite.Group()
-
 # Add these to your global variables
 SCREEN_WIDTH = 1400
 SCREEN_HEIGHT = 800
@@ -238,9 +174,6 @@ BUTTON_HOVER = (86, 156, 214)
 TEXT_COLOR = (255, 255, 255)
 SLIDER_COLOR = (152, 195, 121)
 
-# Add this global variable at the top of the file with other globals
-speed_multiplier = 100  # default speed multiplier (100%)
-
 class Button:
     def __init__(self, x, y, width, height, text, callback):
         self.rect = pygame.Rect(x, y, width, height)
@@ -300,7 +233,8 @@ class Slider:
             self.callback(self.value)
 
 class ControlPanel:
-    def __init__(self, x, y, width, height):
+    def __init__(self, simulation, x, y, width, height):
+        self.simulation = simulation
         self.rect = pygame.Rect(x, y, width, height)
         self.font = pygame.font.Font(None, 28)
         
@@ -320,7 +254,7 @@ class ControlPanel:
             y + y_pos, 
             width - (PADDING * 2), 
             BUTTON_HEIGHT,
-            "Mode: Intelligent" if intelligentMode else "Mode: Traditional",
+            "Mode: Intelligent" if self.simulation.intelligentMode else "Mode: Traditional",
             self.toggle_mode
         )
         
@@ -335,7 +269,7 @@ class ControlPanel:
                     y + y_pos, 
                     width - (PADDING * 3), 
                     SLIDER_HEIGHT,
-                    5, 60, defaultGreen[i],
+                    5, 60, self.simulation.defaultGreen[i],
                     lambda v, i=i: self.update_green_time(i, v)
                 )
             )
@@ -349,7 +283,7 @@ class ControlPanel:
             y + y_pos, 
             width - (PADDING * 3), 
             SLIDER_HEIGHT,
-            1, 10, defaultYellow, 
+            1, 10, self.simulation.defaultYellow, 
             self.update_yellow_time
         )
         
@@ -373,7 +307,7 @@ class ControlPanel:
             y + y_pos, 
             width - (PADDING * 3), 
             SLIDER_HEIGHT,
-            60, 600, simulationTime, 
+            60, 600, self.simulation.simulationTime, 
             self.update_simulation_time
         )
         
@@ -389,6 +323,7 @@ class ControlPanel:
         
         # Stats overlay properties
         self.show_stats = False
+        self.stats_lines = None  # lines currently rendered on the overlay
         self.stats_surface = pygame.Surface((800, 650))
         self.stats_surface.set_alpha(230)  # Semi-transparent
         self.stats_rect = self.stats_surface.get_rect(center=(SCREEN_WIDTH/2, SCREEN_HEIGHT/2))
@@ -423,7 +358,7 @@ class ControlPanel:
         # Draw green time sliders with labels
         for i, direction in enumerate(["Right", "Down", "Left", "Up"]):
             # Draw label above slider
-            text = self.font.render(f"{direction} Green:", True, TEXT_COLOR)
+            text = self.font.render(f"{direction} Green (next cycle):", True, TEXT_COLOR)
             text_rect = text.get_rect(x=self.rect.x + 20, y=self.rect.y + y_pos)
             screen.blit(text, text_rect)
             
@@ -463,10 +398,12 @@ class ControlPanel:
         
         # Draw stats button at bottom
         self.stats_button.draw(screen)
-        
-        # Draw stats overlay if enabled
-        if self.show_stats:
-            self.draw_stats(screen)
+
+    # Everything the panel shows, so it is only redrawn when something changed
+    def state(self):
+        return (self.mode_button.text, self.mode_button.is_hovered, self.stats_button.is_hovered,
+                tuple(slider.value for slider in self.sliders), self.yellow_slider.value, self.speed_slider.value,
+                self.time_slider.value)
         
     def handle_event(self, event):
         self.mode_button.handle_event(event)
@@ -487,66 +424,76 @@ class ControlPanel:
                     self.close_button.handle_event(event)
         
     def toggle_mode(self):
-        global intelligentMode
-        intelligentMode = not intelligentMode
-        self.mode_button.text = "Mode: Intelligent" if intelligentMode else "Mode: Traditional"
-        print(f"Traffic control mode changed to: {'Intelligent' if intelligentMode else 'Traditional'}")  # Debug print
+        self.simulation.setIntelligentMode(not self.simulation.intelligentMode)
+        self.mode_button.text = "Mode: Intelligent" if self.simulation.intelligentMode else "Mode: Traditional"
+        log.info("Traffic control mode changed to: %s", 'Intelligent' if self.simulation.intelligentMode else 'Traditional')
         
     def update_green_time(self, signal_index, value):
-        global defaultGreen
-        defaultGreen[signal_index] = int(value)
-        # Update the current signal's green time
-        signals[signal_index].green = int(value)
+        self.simulation.defaultGreen[signal_index] = int(value)
+        # Takes effect the next time this signal turns green; a running green keeps its length
+        self.simulation.signals[signal_index].green = int(value)
         
     def update_yellow_time(self, value):
-        global defaultYellow
-        defaultYellow = int(value)
+        self.simulation.defaultYellow = int(value)
         # Update all signals' yellow time
-        for signal in signals:
-            signal.yellow = defaultYellow
+        for signal in self.simulation.signals:
+            signal.yellow = self.simulation.defaultYellow
         
     def update_speed(self, value):
-        global speed_multiplier
-        speed_multiplier = value
+        self.simulation.speed_multiplier = value
         
     def update_simulation_time(self, value):
-        global simulationTime
-        simulationTime = value
+        self.simulation.simulationTime = value
         
     def toggle_stats(self):
         self.show_stats = not self.show_stats
+        self.stats_lines = None
             
-    def draw_stats(self, screen):
-        # Fill stats surface with dark background
-        self.stats_surface.fill((40, 44, 52))
-        
-        font = pygame.font.Font(None, 24)
-        y_offset = 50  # Start below close button
-        padding = 20
-        
-        # Prepare stats text
+    def draw_stats(self, screen, state):
+        # Prepare stats text from the published snapshot
+        crossed = state.crossed
+        turns = state.turns
         stats_lines = [
             f"Direction-wise Vehicle Counts:",
-            f"Right: Total={vehicles['right']['crossed']} (Straight={directionRight['straight']}, Left={directionRight['left']}, Right={directionRight['right']})",
-            f"Down:  Total={vehicles['down']['crossed']} (Straight={directionDown['straight']}, Left={directionDown['left']}, Right={directionDown['right']})",
-            f"Left:  Total={vehicles['left']['crossed']} (Straight={directionLeft['straight']}, Left={directionLeft['left']}, Right={directionLeft['right']})",
-            f"Up:    Total={vehicles['up']['crossed']} (Straight={directionUp['straight']}, Left={directionUp['left']}, Right={directionUp['right']})",
+            f"Right: Total={crossed['right']} (Straight={turns['right']['straight']}, Left={turns['right']['left']}, Right={turns['right']['right']})",
+            f"Down:  Total={crossed['down']} (Straight={turns['down']['straight']}, Left={turns['down']['left']}, Right={turns['down']['right']})",
+            f"Left:  Total={crossed['left']} (Straight={turns['left']['straight']}, Left={turns['left']['left']}, Right={turns['left']['right']})",
+            f"Up:    Total={crossed['up']} (Straight={turns['up']['straight']}, Left={turns['up']['left']}, Right={turns['up']['right']})",
             "",
             f"Average Delays:",
-            f"Right: {avgDelay['right']:.2f}",
-            f"Down:  {avgDelay['down']:.2f}",
-            f"Left:  {avgDelay['left']:.2f}",
-            f"Up:    {avgDelay['up']:.2f}",
+            f"Right: {state.avgDelay['right']:.2f}",
+            f"Down:  {state.avgDelay['down']:.2f}",
+            f"Left:  {state.avgDelay['left']:.2f}",
+            f"Up:    {state.avgDelay['up']:.2f}",
             "",
             f"Stopped Vehicles:",
-            f"Right: {stoppedVehiclesInJunction['right']}",
-            f"Down:  {stoppedVehiclesInJunction['down']}",
-            f"Left:  {stoppedVehiclesInJunction['left']}",
-            f"Up:    {stoppedVehiclesInJunction['up']}",
+            f"Right: {state.queueLength['right']}",
+            f"Down:  {state.queueLength['down']}",
+            f"Left:  {state.queueLength['left']}",
+            f"Up:    {state.queueLength['up']}",
             "",
-            f"Time Elapsed: {timeElapsed}s"
+            f"Time Elapsed: {state.timeElapsed}s"
         ]
-        
+        if stats_lines != self.stats_lines:
+            self.render_stats(stats_lines)
+
+        # Blit stats surface to main screen
+        screen.blit(self.stats_surface, self.stats_rect)
+
+        # Draw close button
+        self.close_button.draw(screen)
+
+    # Render the overlay again, only done when one of the numbers on it changed
+    def render_stats(self, stats_lines):
+        self.stats_lines = stats_lines
+
+        # Fill stats surface with dark background
+        self.stats_surface.fill((40, 44, 52))
+
+        font = pygame.font.Font(None, 24)
+        y_offset = 50  # Start below close button
+        padding = 20
+
         # Draw title
         title = pygame.font.Font(None, 36).render("Simulation Statistics", True, (255, 255, 255))
         title_rect = title.get_rect(centerx=self.stats_surface.get_width()/2, top=10)
@@ -560,541 +507,40 @@ class ControlPanel:
         
         # Draw border around stats window
         pygame.draw.rect(self.stats_surface, (100, 100, 100), self.stats_surface.get_rect(), 2)
-        
-        # Blit stats surface to main screen
-        screen.blit(self.stats_surface, self.stats_rect)
-        
-        # Draw close button
-        self.close_button.draw(screen)
-        
-class TrafficSignal:
-    def __init__(self, red, yellow, green):
-        self.red = red
-        self.yellow = yellow
-        self.green = green
-        self.signalText = ""
-
-
-class Vehicle(pygame.sprite.Sprite):
-    def __init__(self, lane, vehicleClass, direction_number, direction, will_turn):
-        pygame.sprite.Sprite.__init__(self)
-        self.lane = lane
-        self.vehicleClass = vehicleClass
-        self.speed = speeds[vehicleClass]
-        self.direction_number = direction_number
-        self.direction = direction
-        self.x = x[direction][lane]
-        self.y = y[direction][lane]
-        self.crossed = 0
-        self.willTurn = will_turn
-        self.turned = 0
-        self.rotateAngle = 0
-        vehicles[direction][lane].append(self)
-        self.index = len(vehicles[direction][lane]) - 1
-        self.crossedIndex = 0
-        path = "images/" + direction + "/" + vehicleClass + ".png"
-        self.originalImage = pygame.image.load(path)
-        self.image = pygame.image.load(path)
-
-        if len(vehicles[direction][lane]) > 1 and vehicles[direction][lane][self.index - 1].crossed == 0:
-            if direction == 'right':
-                self.stop = vehicles[direction][lane][self.index - 1].stop - vehicles[direction][lane][
-                    self.index - 1].image.get_rect().width - stoppingGap
-                stoppedVehicles[direction] += 1  # increment stopped vehicles count
-            elif direction == 'left':
-                self.stop = vehicles[direction][lane][self.index - 1].stop + vehicles[direction][lane][
-                    self.index - 1].image.get_rect().width + stoppingGap
-                stoppedVehicles[direction] += 1  # increment stopped vehicles count
-            elif direction == 'down':
-                self.stop = vehicles[direction][lane][self.index - 1].stop - vehicles[direction][lane][
-                    self.index - 1].image.get_rect().height - stoppingGap
-                stoppedVehicles[direction] += 1  # increment stopped vehicles count
-            elif direction == 'up':
-                self.stop = vehicles[direction][lane][self.index - 1].stop + vehicles[direction][lane][
-                    self.index - 1].image.get_rect().height + stoppingGap
-                stoppedVehicles[direction] += 1  # increment stopped vehicles count
-        else:
-            self.stop = defaultStop[direction]
 
-        # Set new starting and stopping coordinate
-        if direction == 'right':
-            temp = self.image.get_rect().width + stoppingGap
-            x[direction][lane] -= temp
-        elif direction == 'left':
-            temp = self.image.get_rect().width + stoppingGap
-            x[direction][lane] += temp
-        elif direction == 'down':
-            temp = self.image.get_rect().height + stoppingGap
-            y[direction][lane] -= temp
-        elif direction == 'up':
-            temp = self.image.get_rect().height + stoppingGap
-            y[direction][lane] += temp
-        simulation.add(self)
+def showStats(simulation):
+    import pandas as pd
+    from matplotlib import pyplot as plt
 
-    def render(self, screen):
-        screen.blit(self.image, (self.x, self.y))
-
-    def move(self):
-        global speed_multiplier
-        actual_speed = self.speed * (speed_multiplier / 100)  # Adjust speed based on multiplier
-        
-        if self.direction == 'right':
-            if self.crossed == 0 and self.x + self.image.get_rect().width > stopLines[self.direction]:
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-                if self.willTurn == 0:
-                    vehiclesNotTurned[self.direction][self.lane].append(self)
-                    self.crossedIndex = len(vehiclesNotTurned[self.direction][self.lane]) - 1
-                    directionRight['straight'] += 1
-                    print('no turn right')
-            if self.willTurn == 1:
-                if self.lane == 1:
-                    if self.crossed == 0 or self.x + self.image.get_rect().width < stopLines[self.direction] + 40:
-                        if ((self.x + self.image.get_rect().width <= self.stop or (
-                                currentGreen == 0 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.x + self.image.get_rect().width < (
-                                vehicles[self.direction][self.lane][self.index - 1].x - movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.x += actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, self.rotateAngle)
-                            self.x += 2.4
-                            self.y -= 2.8
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('turn right to up')
-                                directionRight['left'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or (self.y > (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].y +
-                                    vehiclesTurned[self.direction][self.lane][
-                                        self.crossedIndex - 1].image.get_rect().height + movingGap))):
-                                self.y -= actual_speed
-
-                elif self.lane == 2:
-                    if self.crossed == 0 or self.x + self.image.get_rect().width < mid[self.direction]['x']:
-                        if ((self.x + self.image.get_rect().width <= self.stop or (
-                                currentGreen == 0 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.x + self.image.get_rect().width < (
-                                vehicles[self.direction][self.lane][self.index - 1].x - movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.x += actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                            self.x += 2
-                            self.y += 1.8
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('turn right to down')
-                                directionRight['right'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or ((self.y + self.image.get_rect().height) < (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].y - movingGap))):
-                                self.y += actual_speed
-            else:
-                if self.crossed == 0:
-                    if ((self.x + self.image.get_rect().width <= self.stop or (
-                            currentGreen == 0 and currentYellow == 0)) and (
-                            self.index == 0 or self.x + self.image.get_rect().width < (
-                            vehicles[self.direction][self.lane][self.index - 1].x - movingGap))):
-                        self.x += actual_speed
-                else:
-                    if ((self.crossedIndex == 0) or (self.x + self.image.get_rect().width < (
-                            vehiclesNotTurned[self.direction][self.lane][self.crossedIndex - 1].x - movingGap))):
-                        self.x += actual_speed
-
-        elif self.direction == 'down':
-            if self.crossed == 0 and self.y + self.image.get_rect().height > stopLines[self.direction]:
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-                if self.willTurn == 0:
-                    vehiclesNotTurned[self.direction][self.lane].append(self)
-                    self.crossedIndex = len(vehiclesNotTurned[self.direction][self.lane]) - 1
-                    print('no turn down')
-                    directionDown['straight'] += 1
-            if self.willTurn == 1:
-                if self.lane == 1:
-                    if self.crossed == 0 or self.y + self.image.get_rect().height < stopLines[self.direction] + 50:
-                        if ((self.y + self.image.get_rect().height <= self.stop or (
-                                currentGreen == 1 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.y + self.image.get_rect().height < (
-                                vehicles[self.direction][self.lane][self.index - 1].y - movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.y += actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, self.rotateAngle)
-                            self.x += 1.2
-                            self.y += 1.8
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('turn down to right')
-                                directionDown['left'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or ((self.x + self.image.get_rect().width) < (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].x - movingGap))):
-                                self.x += actual_speed
-                elif self.lane == 2:
-                    if self.crossed == 0 or self.y + self.image.get_rect().height < mid[self.direction]['y']:
-                        if ((self.y + self.image.get_rect().height <= self.stop or (
-                                currentGreen == 1 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.y + self.image.get_rect().height < (
-                                vehicles[self.direction][self.lane][self.index - 1].y - movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.y += actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                            self.x -= 2.5
-                            self.y += 2
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('down to left')
-                                directionDown['right'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or (self.x > (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].x +
-                                    vehiclesTurned[self.direction][self.lane][
-                                        self.crossedIndex - 1].image.get_rect().width + movingGap))):
-                                self.x -= actual_speed
-            else:
-                if self.crossed == 0:
-                    if ((self.y + self.image.get_rect().height <= self.stop or (
-                            currentGreen == 1 and currentYellow == 0)) and (
-                            self.index == 0 or self.y + self.image.get_rect().height < (
-                            vehicles[self.direction][self.lane][self.index - 1].y - movingGap))):
-                        self.y += actual_speed
-                else:
-                    if ((self.crossedIndex == 0) or (self.y + self.image.get_rect().height < (
-                            vehiclesNotTurned[self.direction][self.lane][self.crossedIndex - 1].y - movingGap))):
-                        self.y += actual_speed
-        elif self.direction == 'left':
-            if self.crossed == 0 and self.x < stopLines[self.direction]:
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-                if self.willTurn == 0:
-                    vehiclesNotTurned[self.direction][self.lane].append(self)
-                    self.crossedIndex = len(vehiclesNotTurned[self.direction][self.lane]) - 1
-                    print('no turn left')
-                    directionLeft['straight'] += 1
-            if self.willTurn == 1:
-                if self.lane == 1:
-                    if self.crossed == 0 or self.x > stopLines[self.direction] - 70:
-                        if ((self.x >= self.stop or (
-                                currentGreen == 2 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.x > (vehicles[self.direction][self.lane][self.index - 1].x +
-                                                             vehicles[self.direction][self.lane][
-                                                                 self.index - 1].image.get_rect().width + movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.x -= actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, self.rotateAngle)
-                            self.x -= 1
-                            self.y += 1.2
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('left to down')
-                                directionLeft['left'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or ((self.y + self.image.get_rect().height) < (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].y - movingGap))):
-                                self.y += actual_speed
-                elif self.lane == 2:
-                    if self.crossed == 0 or self.x > mid[self.direction]['x']:
-                        if ((self.x >= self.stop or (
-                                currentGreen == 2 and currentYellow == 0) or self.crossed == 1) and (
-                                self.index == 0 or self.x > (vehicles[self.direction][self.lane][self.index - 1].x +
-                                                             vehicles[self.direction][self.lane][
-                                                                 self.index - 1].image.get_rect().width + movingGap) or
-                                vehicles[self.direction][self.lane][self.index - 1].turned == 1)):
-                            self.x -= actual_speed
-                    else:
-                        if self.turned == 0:
-                            self.rotateAngle += rotationAngle
-                            self.image = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                            self.x -= 1.8
-                            self.y -= 2.5
-                            if self.rotateAngle == 90:
-                                self.turned = 1
-                                vehiclesTurned[self.direction][self.lane].append(self)
-                                self.crossedIndex = len(vehiclesTurned[self.direction][self.lane]) - 1
-                                print('left to up')
-                                directionLeft['right'] += 1
-                        else:
-                            if (self.crossedIndex == 0 or (self.y > (
-                                    vehiclesTurned[self.direction][self.lane][self.crossedIndex - 1].y +
-                                    vehiclesTurned[self.direction][self.lane][
-                                        self.crossedIndex - 1].image.get_rect().height + movingGap))):
-                                self.y -= actual_speed
-            else:
-                if self.crossed == 0:
-                    if ((self.x >= self.stop or (currentGreen == 2 and currentYellow == 0)) and (
-                            self.index == 0 or self.x > (
-                            vehicles[self.direction][self.lane][self.index - 1].x + vehicles[self.direction][self.lane][
-                        self.index - 1].image.get_rect().width + movingGap))):
-                        self.x -= actual_speed
-                else:
-                    if ((self.crossedIndex == 0) or (self.x > (
-                            vehiclesNotTurned[self.direction][self.lane][self.crossedIndex - 1].x +
-                            vehiclesNotTurned[self.direction][self.lane][
-                                self.crossedIndex - 1].image.get_rect().width + movingGap))):
-                        self.x -= actual_speed
-        elif self.direction == 'up':
-            if self.crossed == 0 and self.y < stopLines[self.direction]:
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-                if self.willTurn == 0:
-                    vehiclesNotTurned[self.direction][self.lane].append(self)
-                    self.crossedIndex = len(vehiclesNotTurned[self.direction][self.lane]) - 1
-                    directionUp['straight'] += 1
-            
-            if ((self.crossed == 0 and (self.y >= self.stop or (currentGreen == 3 and currentYellow == 0))) or 
-                self.crossed == 1):
-                if (self.index == 0 or 
-                    self.y > (vehicles[self.direction][self.lane][self.index - 1].y + 
-                             vehicles[self.direction][self.lane][self.index - 1].image.get_rect().height + movingGap)):
-                    self.y -= actual_speed
-
-# Initialization of signals with default values
-def initialize():
-    minTime = randomGreenSignalTimerRange[0]
-    maxTime = randomGreenSignalTimerRange[1]
-    if randomGreenSignalTimer:
-        ts1 = TrafficSignal(0, defaultYellow, random.randint(minTime, maxTime))
-        signals.append(ts1)
-        ts2 = TrafficSignal(ts1.red + ts1.yellow + ts1.green, defaultYellow, random.randint(minTime, maxTime))
-        signals.append(ts2)
-        ts3 = TrafficSignal(defaultRed, defaultYellow, random.randint(minTime, maxTime))
-        signals.append(ts3)
-        ts4 = TrafficSignal(defaultRed, defaultYellow, random.randint(minTime, maxTime))
-        signals.append(ts4)
-    else:
-        ts1 = TrafficSignal(0, defaultYellow, defaultGreen[0])
-        signals.append(ts1)
-        ts2 = TrafficSignal(ts1.yellow + ts1.green, defaultYellow, defaultGreen[1])
-        signals.append(ts2)
-        ts3 = TrafficSignal(defaultRed, defaultYellow, defaultGreen[2])
-        signals.append(ts3)
-        ts4 = TrafficSignal(defaultRed, defaultYellow, defaultGreen[3])
-        signals.append(ts4)
-    repeat()
-
-
-# Print the signal timers on cmd
-def printStatus():
-    stoppedVehiclesInJunction = countStoppedVehicles()
-    print('Stopped Vehicles in Junction:', stoppedVehiclesInJunction)
-    
-
-
-def repeat():
-    global currentGreen, currentYellow, nextGreen
-
-    while signals[currentGreen].green > 0:
-        printStatus()
-        updateValues()
-        isVehicleStopped[currentGreen] = False
-        
-        # Check if current direction has any vehicles waiting
-        if intelligentMode:
-            current_direction = directionNumbers[currentGreen]
-            has_vehicles = False
-            
-            # Check all lanes in current direction for waiting vehicles
-            for lane in [0, 1, 2]:
-                if vehicles[current_direction][lane]:  # If there are vehicles in this lane
-                    for vehicle in vehicles[current_direction][lane]:
-                        # Check if vehicle hasn't crossed and is approaching the signal
-                        if (vehicle.crossed == 0 and 
-                            ((current_direction == 'right' and vehicle.x < stopLines[current_direction]) or
-                             (current_direction == 'down' and vehicle.y < stopLines[current_direction]) or
-                             (current_direction == 'left' and vehicle.x > stopLines[current_direction]) or
-                             (current_direction == 'up' and vehicle.y > stopLines[current_direction]))):
-                            has_vehicles = True
-                            break
-                if has_vehicles:
-                    break
-            
-            # If no vehicles are waiting, end green signal early
-            if not has_vehicles:
-                print(f"No vehicles detected in direction {current_direction}, switching signal...")
-                signals[currentGreen].green = 0
-                break
-        
-        time.sleep(1)
-    
-    currentYellow = 1  # set yellow signal on
-    
-    # reset stop coordinates of lanes and vehicles
-    for i in range(0, 3):
-        for vehicle in vehicles[directionNumbers[currentGreen]][i]:
-            vehicle.stop = defaultStop[directionNumbers[currentGreen]]
-    
-    while signals[currentGreen].yellow > 0:
-        printStatus()
-        updateValues()
-        time.sleep(1)
-    currentYellow = 0
-    isVehicleStopped[currentGreen] = True
-
-    # Reset signal times
-    if randomGreenSignalTimer:
-        signals[currentGreen].green = random.randint(randomGreenSignalTimerRange[0], randomGreenSignalTimerRange[1])
-    else:
-        signals[currentGreen].green = defaultGreen[currentGreen]
-    signals[currentGreen].yellow = defaultYellow
-    signals[currentGreen].red = defaultRed
-
-    if intelligentMode:
-        # Get current stopped vehicle counts
-        stopped_counts = countStoppedVehicles()
-        
-        # Create a list of directions excluding the current green
-        available_directions = []
-        for i in range(noOfSignals):
-            if i != currentGreen:
-                direction = directionNumbers[i]
-                # Check both stopped vehicles and approaching vehicles
-                count = stopped_counts[direction]
-                # Add approaching vehicles check
-                for lane in [0, 1, 2]:
-                    for vehicle in vehicles[direction][lane]:
-                        if (vehicle.crossed == 0 and 
-                            ((direction == 'right' and vehicle.x < stopLines[direction]) or
-                             (direction == 'down' and vehicle.y < stopLines[direction]) or
-                             (direction == 'left' and vehicle.x > stopLines[direction]) or
-                             (direction == 'up' and vehicle.y > stopLines[direction]))):
-                            count += 1
-                available_directions.append((i, count))
-        
-        if available_directions:
-            # Sort by number of vehicles (highest to lowest)
-            available_directions.sort(key=lambda x: x[1], reverse=True)
-            
-            # Select the direction with the most vehicles
-            if available_directions[0][1] > 0:  # Only switch if there are actually vehicles waiting
-                nextGreen = available_directions[0][0]
-                print(f"Intelligent mode: Switching to direction {nextGreen} with {available_directions[0][1]} vehicles")
-            else:
-                # If no vehicles in any direction, move to next signal
-                nextGreen = (currentGreen + 1) % noOfSignals
-                print("No vehicles detected in any direction, cycling signals normally")
-        else:
-            # Fallback to next signal if no data available
-            nextGreen = (currentGreen + 1) % noOfSignals
-    else:
-        # Traditional mode - cycle through signals
-        nextGreen = (currentGreen + 1) % noOfSignals
-    
-    currentGreen = nextGreen
-    # Update red time for other signals
-    signals[nextGreen].red = signals[currentGreen].yellow + signals[currentGreen].green
-    repeat()
-
-
-
-# Update values of the signal timers after every second
-def updateValues():
-    for i in range(0, noOfSignals):
-        if i == currentGreen:
-            if currentYellow == 0:
-                signals[i].green -= 1
-            else:
-                signals[i].yellow -= 1
-        else:
-            signals[i].red -= 1
-
-
-# For Update the time for Stopped Vehicles
-def updateStoppedVehiclesTime():
-    if isVehicleStopped[0]:
-        delayTimeForStoppedVehicles['right'] += 1
-    if isVehicleStopped[1]:
-        delayTimeForStoppedVehicles['down'] += 1
-    if isVehicleStopped[2]:
-        delayTimeForStoppedVehicles['left'] += 1
-    if isVehicleStopped[3]:
-        delayTimeForStoppedVehicles['up'] += 1
-
-
-# Generating vehicles in the simulation
-def generateVehicles():
-    while True:
-        vehicle_type = random.choice(allowedVehicleTypesList)
-        lane_number = random.randint(1, 2)
-        will_turn = 0
-        if lane_number == 1:
-            temp = random.randint(0, 99)
-            if temp < 40:
-                will_turn = 1
-        elif lane_number == 2:
-            temp = random.randint(0, 99)
-            if temp < 40:
-                will_turn = 1
-        temp = random.randint(0, 99)
-        direction_number = 0
-        dist = [25, 50, 75, 100]
-        if temp < dist[0]:
-            direction_number = 0
-        elif temp < dist[1]:
-            direction_number = 1
-        elif temp < dist[2]:
-            direction_number = 2
-        elif temp < dist[3]:
-            direction_number = 3
-        Vehicle(lane_number, vehicleTypes[vehicle_type], direction_number, directionNumbers[direction_number],
-                will_turn)
-        time.sleep(1)
-
-
-def showStats():
     totalVehicles = 0
     print('Direction-wise Vehicle Counts')
     for i in range(0, 4):
-        if signals[i] is not None:
-            print('Direction', i + 1, ':', vehicles[directionNumbers[i]]['crossed'])
-            totalVehicles += vehicles[directionNumbers[i]]['crossed']
-    print('Direction right:', directionRight)
-    print('Direction down:', directionDown)
-    print('Direction left:', directionLeft)
-    print('Direction up:', directionUp)
+        if simulation.signals[i] is not None:
+            print('Direction', i + 1, ':', simulation.vehicles[sim.directionNumbers[i]]['crossed'])
+            totalVehicles += simulation.vehicles[sim.directionNumbers[i]]['crossed']
+    print('Direction right:', simulation.directionRight)
+    print('Direction down:', simulation.directionDown)
+    print('Direction left:', simulation.directionLeft)
+    print('Direction up:', simulation.directionUp)
     print('Total vehicles passed:', totalVehicles)
-    print('Total time:', timeElapsed)
-    print('delay For Stopped Vehicle:', delayTimeForStoppedVehicles)
+    print('Total time:', simulation.timeElapsed)
+    print('delay For Stopped Vehicle:', simulation.delayTimeForStoppedVehicles)
     print('Average delay direction wise:', {
-        'Direction 1': avgDelay['right'],
-        'Direction 2': avgDelay['down'],
-        'Direction 3': avgDelay['left'],
-        'Direction 4': avgDelay['up']})
+        'Direction 1': simulation.avgDelay['right'],
+        'Direction 2': simulation.avgDelay['down'],
+        'Direction 3': simulation.avgDelay['left'],
+        'Direction 4': simulation.avgDelay['up']})
 
     df = pd.DataFrame({'Direction': ['Direction 1', 'Direction 2', 'Direction 3', 'Direction 4'],
-                       'Total': [vehicles[directionNumbers[0]]['crossed'], vehicles[directionNumbers[1]]['crossed'],
-                                 vehicles[directionNumbers[2]]['crossed'], vehicles[directionNumbers[3]]['crossed']]
+                       'Total': [simulation.vehicles[sim.directionNumbers[0]]['crossed'], simulation.vehicles[sim.directionNumbers[1]]['crossed'],
+                                 simulation.vehicles[sim.directionNumbers[2]]['crossed'], simulation.vehicles[sim.directionNumbers[3]]['crossed']]
                           ,
-                       'Straight': [directionRight['straight'], directionDown['straight'], directionLeft['straight'],
-                                    directionUp['straight']],
-                       'Left': [directionRight['left'], directionDown['left'], directionLeft['left'],
-                                directionUp['left']],
-                       'Right': [directionRight['right'], directionDown['right'], directionLeft['right'],
-                                 directionUp['right']]})
+                       'Straight': [simulation.directionRight['straight'], simulation.directionDown['straight'], simulation.directionLeft['straight'],
+                                    simulation.directionUp['straight']],
+                       'Left': [simulation.directionRight['left'], simulation.directionDown['left'], simulation.directionLeft['left'],
+                                simulation.directionUp['left']],
+                       'Right': [simulation.directionRight['right'], simulation.directionDown['right'], simulation.directionLeft['right'],
+                                 simulation.directionUp['right']]})
 
     df.plot(x='Direction', y=['Total', 'Straight', 'Left', 'Right'], kind='bar')
 
@@ -1103,190 +549,62 @@ def showStats():
     return totalVehicles
 
 
-def showStatsDialog():
-    totalVehicles = showStats()
+def showStatsDialog(simulation):
+    from tkinter import messagebox
+
+    totalVehicles = showStats(simulation)
     msg = "Direction-wise Vehicle Counts\n\nDirection 1 Vehicle Behavior \nTotal: " + str(
-        vehicles[directionNumbers[0]]['crossed']) + "\nStraight: " + str(directionRight['straight']) + "\nLeft: " + str(
-        directionRight['left']) + "\nRight: " + str(
-        directionRight['right']) + "\n\nDirection 2 Vehicle Behavior \nTotal: " + str(
-        vehicles[directionNumbers[1]]['crossed']) + "\nStraight: " + str(directionDown['straight']) + "\nLeft: " + str(
-        directionDown['left']) + "\nRight: " + str(
-        directionDown['right']) + "\n\nDirection 3 Vehicle Behavior \nTotal: " + str(
-        vehicles[directionNumbers[2]]['crossed']) + "\nStraight: " + str(directionLeft['straight']) + "\nLeft: " + str(
-        directionLeft['left']) + "\nRight: " + str(
-        directionLeft['right']) + "\n\nDirection 4 Vehicle Behavior \nTotal: " + str(
-        vehicles[directionNumbers[3]]['crossed']) + "\nStraight: " + str(directionUp['straight']) + "\nLeft: " + str(
-        directionUp['left']) + "\nRight: " + str(directionUp['right']) + "\n\nTotal vehicles passed: " + str(
+        simulation.vehicles[sim.directionNumbers[0]]['crossed']) + "\nStraight: " + str(simulation.directionRight['straight']) + "\nLeft: " + str(
+        simulation.directionRight['left']) + "\nRight: " + str(
+        simulation.directionRight['right']) + "\n\nDirection 2 Vehicle Behavior \nTotal: " + str(
+        simulation.vehicles[sim.directionNumbers[1]]['crossed']) + "\nStraight: " + str(simulation.directionDown['straight']) + "\nLeft: " + str(
+        simulation.directionDown['left']) + "\nRight: " + str(
+        simulation.directionDown['right']) + "\n\nDirection 3 Vehicle Behavior \nTotal: " + str(
+        simulation.vehicles[sim.directionNumbers[2]]['crossed']) + "\nStraight: " + str(simulation.directionLeft['straight']) + "\nLeft: " + str(
+        simulation.directionLeft['left']) + "\nRight: " + str(
+        simulation.directionLeft['right']) + "\n\nDirection 4 Vehicle Behavior \nTotal: " + str(
+        simulation.vehicles[sim.directionNumbers[3]]['crossed']) + "\nStraight: " + str(simulation.directionUp['straight']) + "\nLeft: " + str(
+        simulation.directionUp['left']) + "\nRight: " + str(simulation.directionUp['right']) + "\n\nTotal vehicles passed: " + str(
         totalVehicles) + "\nTotal time: " + str(
-        timeElapsed) + "\n\nAverage delay direction wise: \nDirection 1: " + str(
-        avgDelay['right']) + "\nDirection 2: " + str(
-        avgDelay['down']) + "\nDirection 3: " + str(avgDelay['left']) + "\nDirection 4: " + str(
-        avgDelay['up'])
+        simulation.timeElapsed) + "\n\nAverage delay direction wise: \nDirection 1: " + str(
+        simulation.avgDelay['right']) + "\nDirection 2: " + str(
+        simulation.avgDelay['down']) + "\nDirection 3: " + str(simulation.avgDelay['left']) + "\nDirection 4: " + str(
+        simulation.avgDelay['up'])
 
-    tk.messagebox.showinfo("Simulation Ended", msg)
+    messagebox.showinfo("Simulation Ended", msg)
 
-def countStoppedVehicles():
-    # Reset the counts first
-    for direction in stoppedVehiclesInJunction:
-        stoppedVehiclesInJunction[direction] = 0
-        
-    try:
-        # Count all stopped vehicles in each direction
-        for direction in vehicles:
-            for lane in [0, 1, 2]:
-                prev_vehicle = None
-                for vehicle in vehicles[direction][lane]:
-                    if not hasattr(vehicle, 'crossed') or not hasattr(vehicle, 'stop'):
-                        continue
-                        
-                    if vehicle.crossed == 0:  # Only check vehicles that haven't crossed yet
-                        is_stopped = False
-                        
-                        try:
-                            # Get vehicle dimensions
-                            vehicle_width = vehicle.image.get_rect().width
-                            vehicle_height = vehicle.image.get_rect().height
-                            
-                            # Check if vehicle is stopped at signal
-                            if direction == 'right':
-                                # Vehicle moving right is stopped if its front reaches the stop line
-                                if vehicle.x + vehicle_width >= vehicle.stop:
-                                    is_stopped = True
-                            elif direction == 'left':
-                                # Vehicle moving left is stopped if its front reaches the stop line
-                                if vehicle.x <= vehicle.stop:
-                                    is_stopped = True
-                            elif direction == 'down':
-                                # Vehicle moving down is stopped if its front reaches the stop line
-                                if vehicle.y + vehicle_height >= vehicle.stop:
-                                    is_stopped = True
-                            elif direction == 'up':
-                                # Vehicle moving up is stopped if its front reaches the stop line
-                                if vehicle.y <= vehicle.stop:
-                                    is_stopped = True
-                            
-                            # Check if vehicle is stopped due to vehicle in front
-                            if prev_vehicle and prev_vehicle.crossed == 0:
-                                if direction == 'right':
-                                    # Check if too close to vehicle in front
-                                    if (vehicle.x + vehicle_width) >= (prev_vehicle.x - movingGap):
-                                        is_stopped = True
-                                elif direction == 'left':
-                                    if vehicle.x <= (prev_vehicle.x + prev_vehicle.image.get_rect().width + movingGap):
-                                        is_stopped = True
-                                elif direction == 'down':
-                                    if (vehicle.y + vehicle_height) >= (prev_vehicle.y - movingGap):
-                                        is_stopped = True
-                                elif direction == 'up':
-                                    if vehicle.y <= (prev_vehicle.y + prev_vehicle.image.get_rect().height + movingGap):
-                                        is_stopped = True
-                            
-                            # Additional check: Ensure vehicle is actually in the junction area
-                            if is_stopped:
-                                if direction == 'right' and vehicle.x < stopLines[direction]:
-                                    stoppedVehiclesInJunction[direction] += 1
-                                elif direction == 'left' and vehicle.x > stopLines[direction]:
-                                    stoppedVehiclesInJunction[direction] += 1
-                                elif direction == 'down' and vehicle.y < stopLines[direction]:
-                                    stoppedVehiclesInJunction[direction] += 1
-                                elif direction == 'up' and vehicle.y > stopLines[direction]:
-                                    stoppedVehiclesInJunction[direction] += 1
-                        
-                        except AttributeError as e:
-                            print(f"Warning: Vehicle missing required attribute - {e}")
-                            continue
-                    
-                    prev_vehicle = vehicle
-                    
-    except Exception as e:
-        print(f"Error in countStoppedVehicles: {e}")
-        
-    return stoppedVehiclesInJunction
+# Draw the signals, timers, counters and vehicles of a published state through the renderer. The state is
+# a sim.Snapshot, or a frame of a shared state ring when another process runs the simulation (viewer.py).
+def drawJunction(renderer, state, signalImages, font):
+    black = Main.black
+    white = Main.white
 
+    # simulation drawing code
+    for i in range(0, sim.noOfSignals):
+        renderer.place(('signal', i), signalImages[state.signalColours[i]], signalCoods[i])
 
-# Write the stats to a file
-def writeStatsToFile():
-    try:
-        current_time = timeElapsed
-        stats = f"""
-Time: {current_time}s
-Direction-wise Vehicle Counts:
-Right: Total={vehicles['right']['crossed']} (Straight={directionRight['straight']}, Left={directionRight['left']}, Right={directionRight['right']})
-Down:  Total={vehicles['down']['crossed']} (Straight={directionDown['straight']}, Left={directionDown['left']}, Right={directionDown['right']})
-Left:  Total={vehicles['left']['crossed']} (Straight={directionLeft['straight']}, Left={directionLeft['left']}, Right={directionLeft['right']})
-Up:    Total={vehicles['up']['crossed']} (Straight={directionUp['straight']}, Left={directionUp['left']}, Right={directionUp['right']})
-
-Average Delays:
-Right: {avgDelay['right']:.2f}
-Down:  {avgDelay['down']:.2f}
-Left:  {avgDelay['left']:.2f}
-Up:    {avgDelay['up']:.2f}
-
-Stopped Vehicles:
-Right: {stoppedVehicles['right']}
-Down:  {stoppedVehicles['down']}
-Left:  {stoppedVehicles['left']}
-Up:    {stoppedVehicles['up']}
-----------------------------------------
-"""
-        with open("simulation_stats.txt", "a") as file:
-            file.write(stats)
-            
-    except Exception as e:
-        print(f"Error writing to file: {e}")
+    # Display signal timer
+    for i in range(0, sim.noOfSignals):
+        signalText = renderer.text(('timer', i), state.signalTexts[i], font, white, black)
+        renderer.place(('timer', i), signalText, signalTimerCoods[i])
 
+    # Display vehicle count
+    for i in range(0, sim.noOfSignals):
+        displayText = state.crossed[sim.directionNumbers[i]]
+        vehicleCountText = renderer.text(('count', i), displayText, font, black, white)
+        renderer.place(('count', i), vehicleCountText, vehicleCountCoods[i])
 
-def simTime():
-    global timeElapsed, simulationTime
-    last_write_time = 0
-    
-    while True:
-        updateStoppedVehiclesTime()
-        avgDelayCal()
-        timeElapsed += 1
-        
-        # Write stats every 'timePeriod' seconds
-        if timeElapsed - last_write_time >= timePeriod:
-            writeStatsToFile()
-            last_write_time = timeElapsed
-            
-        time.sleep(1)
-        if timeElapsed == simulationTime:
-            writeStatsToFile()  # Write final stats
-            showStats()
-
+    # Display time elapsed
+    timeElapsedText = renderer.text('time', "Time Elapsed: " + str(state.timeElapsed), font, black, white)
+    renderer.place('time', timeElapsedText, timeElapsedCoods)
 
-# calculate avg delay
-def avgDelayCal():
-    directions = ['right', 'down', 'left', 'up']
+    # Display vehicles
+    renderer.drawSprites((assets.vehicleFrame(path, angle), (x, y)) for path, angle, x, y in state.vehicles())
 
-    for direction in directions:
-        total_vehicles = vehicles[direction]['crossed'] + stoppedVehicles[direction]
-        if total_vehicles > 0:  # Prevent division by zero
-            # Average delay = Total delay time / Total number of vehicles
-            # This includes both stopped and non-stopped vehicles
-            avgDelay[direction] = delayTimeForStoppedVehicles[direction] / total_vehicles
-        else:
-            avgDelay[direction] = 0
-            
-        print(f'Direction: {direction}')
-        print(f'  Total vehicles: {total_vehicles}')
-        print(f'  Stopped vehicles: {stoppedVehicles[direction]}')
-        print(f'  Total delay time: {delayTimeForStoppedVehicles[direction]}')
-        print(f'  Average delay: {avgDelay[direction]:.2f} seconds')
 
-# Main class for the simulation
+# Main class for the simulation. Creating it opens the window for an engine; run() drives the
+# engine paced to real time until the run ends or the window is closed.
 class Main:
-    global allowedVehicleTypesList
-    i = 0
-    for vehicleType in allowedVehicleTypes:
-        if allowedVehicleTypes[vehicleType]:
-            allowedVehicleTypesList.append(i)
-        i += 1
-    thread1 = threading.Thread(name="initialization", target=initialize, args=())  # initialization
-    thread1.daemon = True
-    thread1.start()
-
     # Colours
     black = (0, 0, 0)
     white = (255, 255, 255)
@@ -1297,95 +615,128 @@ class Main:
     PANEL_WIDTH = 300
     TOTAL_WIDTH = screenWidth + PANEL_WIDTH
     screenSize = (TOTAL_WIDTH, screenHeight)
-    
-    # Initialize screen with total width including panel
-    screen = pygame.display.set_mode(screenSize)
-    pygame.display.set_caption("SIMULATION")
 
-    # Create control panel
-    control_panel = ControlPanel(screenWidth, 0, PANEL_WIDTH, screenHeight)
+    def __init__(self, engine):
+        # Signals, vehicle generation and delay accounting all run on the engine's fixed-timestep clock
+        self.engine = engine
+        self.simulation = engine.sim
 
-    # Setting background image i.e. image of intersection
-    background = pygame.image.load('images/intersection.png')
+        # Initialize screen with total width including panel
+        self.screen = pygame.display.set_mode(self.screenSize)
+        pygame.display.set_caption("SIMULATION")
 
-    # Loading signal images and font
-    redSignal = pygame.image.load('images/signals/red.png')
-    yellowSignal = pygame.image.load('images/signals/yellow.png')
-    greenSignal = pygame.image.load('images/signals/green.png')
-    font = pygame.font.Font(None, 30)
+        # Create control panel
+        self.control_panel = ControlPanel(self.simulation, self.screenWidth, 0, self.PANEL_WIDTH, self.screenHeight)
 
-    thread2 = threading.Thread(name="generateVehicles", target=generateVehicles, args=())  # Generating vehicles
-    thread2.daemon = True
-    thread2.start()
+        # Setting background image i.e. image of intersection
+        self.background = assets.image('images/intersection.png')
 
-    thread3 = threading.Thread(name="simTime", target=simTime, args=())
-    thread3.daemon = True
-    thread3.start()
-
-    clock = pygame.time.Clock()
-    time_interval = 500  
-    timer_event = pygame.USEREVENT + 1
-    pygame.time.set_timer(timer_event, time_interval)
-    speed_multiplier = 100
-    currentTime = 0
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                showStatsDialog()
-                sys.exit()
-                file.close()
-            elif simulationTime == timeElapsed:
-                showStatsDialog()
-                sys.exit()
-                file.close()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    showStatsDialog()
-                    sys.exit()
-                    file.close()
-            # Handle control panel events
-            control_panel.handle_event(event)
-
-        screen.fill(black)
-        screen.blit(background, (0, 0))  # display background in simulation
-
-        # simulation drawing code
-        for i in range(0, noOfSignals):
-            if i == currentGreen:
-                if currentYellow == 1:
-                    signals[i].signalText = signals[i].yellow
-                    screen.blit(yellowSignal, signalCoods[i])
-                else:
-                    signals[i].signalText = signals[i].green
-                    screen.blit(greenSignal, signalCoods[i])
-            else:
-                if signals[i].red <= 10:
-                    signals[i].signalText = signals[i].red
-                else:
-                    signals[i].signalText = "---"
-                screen.blit(redSignal, signalCoods[i])
+        # Loading signal images and font
+        self.redSignal = assets.image('images/signals/red.png')
+        self.yellowSignal = assets.image('images/signals/yellow.png')
+        self.greenSignal = assets.image('images/signals/green.png')
+        assets.preload()
+        self.font = pygame.font.Font(None, 30)
 
-        # Display signal timer
-        for i in range(0, noOfSignals):
-            signalTexts[i] = font.render(str(signals[i].signalText), True, white, black)
-            screen.blit(signalTexts[i], signalTimerCoods[i])
+        # Only the parts of the window that change are redrawn and updated each frame
+        self.renderer = Renderer(self.screen, self.background, (0, 0, self.screenWidth, self.screenHeight))
 
-        # Display vehicle count
-        for i in range(0, noOfSignals):
-            displayText = vehicles[directionNumbers[i]]['crossed']
-            vehicleCountTexts[i] = font.render(str(displayText), True, black, white)
-            screen.blit(vehicleCountTexts[i], vehicleCountCoods[i])
-
-        # Display time elapsed
-        timeElapsedText = font.render(("Time Elapsed: " + str(timeElapsed)), True, black, white)
-        screen.blit(timeElapsedText, timeElapsedCoods)
-
-        # Display vehicles
-        for vehicle in simulation:
-            screen.blit(vehicle.image, [vehicle.x, vehicle.y])
-            vehicle.move()
+    # Final stats are written however the run ends: at the simulation time, or with the window
+    # closed or Escape pressed early
+    def run(self):
+        try:
+            self.loop()
+        finally:
+            self.engine.finish()
+        showStatsDialog(self.simulation)
+
+    def loop(self):
+        engine = self.engine
+        screen = self.screen
+        control_panel = self.control_panel
+        renderer = self.renderer
+        font = self.font
+        signalImages = {'green': self.greenSignal, 'yellow': self.yellowSignal, 'red': self.redSignal}
+        panelState = None
+        showingStats = False
+
+        clock = pygame.time.Clock()
+        time_interval = 500
+        timer_event = pygame.USEREVENT + 1
+        pygame.time.set_timer(timer_event, time_interval)
+        startTime = time.perf_counter()
+        while True:
+            # Catch the simulation clock up with real time, at most one simulated second per frame
+            engine.advanceTo(time.perf_counter() - startTime, engine.ticksPerSecond)
+            if engine.finished():
+                return
 
-        # Draw control panel
-        control_panel.draw(screen)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return
+                # Handle control panel events
+                control_panel.handle_event(event)
+
+            if control_panel.show_stats != showingStats:
+                showingStats = control_panel.show_stats
+                renderer.invalidate()  # the overlay covered or uncovered part of the intersection
+            fullRepaint = renderer.begin()
+
+            # Everything drawn in this frame comes from the snapshot published after the last tick
+            state = engine.snapshot
+            drawJunction(renderer, state, signalImages, font)
+
+            # Draw control panel when something on it changed
+            if fullRepaint or control_panel.state() != panelState:
+                panelState = control_panel.state()
+                control_panel.draw(screen)
+                renderer.markDirty(control_panel.rect)
+            if control_panel.show_stats:
+                control_panel.draw_stats(screen, state)
+                renderer.markDirty(control_panel.stats_rect)
+
+            renderer.flip()
+            clock.tick(60)
+
+
+# Any command-line option (see engine.py --help, e.g. --config sim.toml) skips the setup dialog
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = None
+    ticksPerSecond = 60
+    seed = None
+    if argv:
+        args = buildParser().parse_args(argv)
+        try:
+            params = parametersFromArgs(args)
+            checkStatsFile(args.stats_file, args.stats_format)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        configureLogging(args.log_level, args.log_rate)
+        ticksPerSecond = args.ticks_per_second
+        seed = args.seed
+    else:
+        configureLogging()
+        params = get_simulation_parameters()
 
-        pygame.display.update()
\ No newline at end of file
+    try:
+        engine = Engine(params, ticksPerSecond, publish=True, seed=seed)
+        if args is not None:
+            applyStatsArgs(engine.sim, args)
+            applyOutputArgs(engine, args)
+
+        # Initialize pygame
+        pygame.init()
+        Main(engine).run()
+    except (OSError, ValueError) as e:  # also a malformed row of a demand file, read as the run goes
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import argparse
+import collections
+import sys
+
+import simulation as sim
+from config import checkParameters, readFile
+from engine import Engine
+from logging_setup import configureLogging
+from stats_sink import checkStatsFile
+
+# Road network of several junctions joined by road links, for corridor studies such as green-wave
+# coordination. Every junction is a complete Simulation with its own signals and lane layout, and
+# all of them advance on one shared fixed-timestep clock. A vehicle that drives off a junction on a
+# side with a link enters the next junction after the link's travel time, on the approach with the
+# same heading (leaving A to the right means arriving at B from its left edge, driving right). On
+# sides without a link it leaves the network. Approaches fed by a link get no outside arrivals.
+#
+# A network file (TOML or JSON) holds the parameters shared by all junctions, the junctions with
+# their own overrides and the links. signal_offset starts a junction's signal cycle that many
+# seconds ahead, which is how a green wave is set up:
+#
+#   {
+#     "simulation_time": 600, "intelligent_mode": false, "random_timer": false,
+#     "junctions": {"A": {}, "B": {"signal_offset": 12}, "C": {"signal_offset": 24}},
+#     "links": [
+#       {"from": "A", "to": "B", "direction": "right", "travel_time": 12},
+#       {"from": "B", "to": "C", "direction": "right", "travel_time": 12},
+#       {"from": "C", "to": "B", "direction": "left", "travel_time": 12},
+#       {"from": "B", "to": "A", "direction": "left", "travel_time": 12}
+#     ]
+#   }
+
+
+# One-way road from a side of one junction to the approach with the same heading at another
+class Link:
+    def __init__(self, index, source, target, direction, travelTime):
+        self.index = index
+        self.source = source
+        self.target = target
+        self.direction = direction
+        self.travelTime = travelTime
+        self.inTransit = collections.deque()  # (arrival tick, vehicle class), in order of arrival
+        self.carried = 0
+
+
+class Network:
+    # junctions maps names to simulation parameters, links is a list of dicts with the keys
+    # from, to, direction and travel_time (seconds). A seed gives every junction its own stream.
+    # With `local` set, only those junctions are simulated here (one partition of a network run
+    # by partition.py): vehicles for other junctions collect in self.outbox, and vehicles from
+    # them are handed over with receive().
+    def __init__(self, junctions, links, ticksPerSecond=60, seed=None, local=None):
+        if not junctions:
+            raise ValueError("A network needs at least one junction")
+        self.ticksPerSecond = ticksPerSecond
+        self.ticks = 0
+        self.local = set(junctions) if local is None else set(local)
+        self.engines = {name: Engine(params, ticksPerSecond, seed=None if seed is None else f"{seed}:{name}")
+                        for name, params in junctions.items() if name in self.local}
+
+        self.links = {}  # (source junction, exit direction) -> Link
+        for link in links:
+            source, target, direction = link['from'], link['to'], link['direction']
+            for name in (source, target):
+                if name not in junctions:
+                    raise ValueError(f"Link refers to unknown junction {name}")
+            if direction not in sim.directionIndexes:
+                raise ValueError(f"Unknown link direction {direction}")
+            if (source, direction) in self.links:
+                raise ValueError(f"Junction {source} has more than one link to the {direction}")
+            self.links[source, direction] = Link(len(self.links), source, target, direction,
+                                                 link.get('travel_time', 0))
+            if target in self.local:
+                self.engines[target].sim.linkedApproaches.add(direction)
+        self.linkList = list(self.links.values())
+        self.incoming = [link for link in self.linkList if link.target in self.local]
+        self.outbox = []  # (link index, arrival tick, vehicle class) bound for other partitions
+
+        for name, engine in self.engines.items():
+            engine.sim.departureHooks.append(lambda vehicle, name=name: self.depart(name, vehicle))
+
+    # Periodic stats of every junction go to statsFile, with {run} replaced by the junction name
+    def setStats(self, statsFile, statsFormat=None):
+        for name, engine in self.engines.items():
+            engine.sim.statsFile = statsFile
+            engine.sim.statsFormat = statsFormat
+            engine.sim.statsRun = name
+
+    def depart(self, name, vehicle):
+        link = self.links.get((name, vehicle.exitDirection))
+        if link is not None:
+            arrival = self.ticks + int(link.travelTime * self.ticksPerSecond)
+            if link.target in self.local:
+                link.inTransit.append((arrival, vehicle.vehicleClass))
+            else:
+                self.outbox.append((link.index, arrival, vehicle.vehicleClass))
+
+    # A vehicle from another partition on its way down a link into this one
+    def receive(self, linkIndex, arrival, vehicleClass):
+        self.linkList[linkIndex].inTransit.append((arrival, vehicleClass))
+
+    # One tick of every junction, then the vehicles due at the end of their links enter the next junction
+    def tick(self):
+        self.advance()
+        self.deliver()
+
+    # Junctions that reached their simulation time stand still while the others run on
+    def advance(self):
+        for engine in self.engines.values():
+            if not engine.finished():
+                engine.tick()
+        self.ticks += 1
+
+    def deliver(self):
+        for link in self.incoming:
+            inTransit = link.inTransit
+            if self.engines[link.target].finished():
+                continue
+            while inTransit and inTransit[0][0] <= self.ticks:
+                _, vehicleClass = inTransit.popleft()
+                self.engines[link.target].sim.enterVehicle(vehicleClass, link.direction)
+                link.carried += 1
+
+    def finished(self):
+        return all(engine.finished() for engine in self.engines.values())
+
+    def run(self):
+        while not self.finished():
+            self.tick()
+        return self.finish()
+
+    # Write the final stats of every junction and return the summary of the network
+    def finish(self):
+        return {
+            'junctions': {name: engine.finish() for name, engine in self.engines.items()},
+            'links': [{'from': link.source, 'to': link.target, 'direction': link.direction,
+                       'carried': link.carried, 'in_transit': len(link.inTransit)}
+                      for link in self.incoming],
+        }
+
+
+# Junction parameters and links of a network file
+def loadNetwork(path):
+    values = readFile(path)
+    junctions = values.pop('junctions', None)
+    links = values.pop('links', [])
+    if not junctions:
+        raise ValueError(f"{path} defines no junctions")
+    for link in links:
+        missing = {'from', 'to', 'direction'} - set(link)
+        if missing:
+            raise ValueError(f"Link in {path} is missing {', '.join(sorted(missing))}")
+    params = {name: checkParameters(dict(values, **overrides), path) for name, overrides in junctions.items()}
+    return params, links
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Run a network of junctions joined by road links, headless.")
+    parser.add_argument('network', help="TOML or JSON network file")
+    parser.add_argument('--time', type=int, help="simulation time in seconds, overrides the file")
+    parser.add_argument('--seed', type=int, help="seed of the random streams of the junctions")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes the junctions are partitioned across (needs --seed to match a serial run)")
+    parser.add_argument('--ticks-per-second', type=int, default=60, help="fixed timesteps per simulated second")
+    parser.add_argument('--stats-file',
+                        help="file the periodic stats of each junction are written to, {run} is the junction name")
+    parser.add_argument('--stats-format', choices=['text', 'csv', 'jsonl', 'parquet'],
+                        help="stats file format (default: from the file extension, text otherwise)")
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG logs every crossing and the per-second status, INFO the signal decisions")
+    parser.add_argument('--log-rate', type=float, default=20,
+                        help="most log records per second of any one kind, 0 for no limit")
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    try:
+        junctions, links = loadNetwork(args.network)
+        for params in junctions.values():
+            if args.time is not None:
+                params['simulation_time'] = args.time
+        network = Network(junctions, links, args.ticks_per_second, args.seed, local=() if args.workers > 1 else None)
+        if args.stats_file:
+            checkStatsFile(args.stats_file, args.stats_format)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    configureLogging(args.log_level, args.log_rate)
+
+    if args.workers > 1:
+        from partition import runPartitioned
+        summary = runPartitioned(junctions, links, args.workers, args.ticks_per_second, args.seed,
+                                 args.stats_file, args.stats_format)
+    else:
+        network.setStats(args.stats_file, args.stats_format)
+        summary = network.run()
+    for name, junction in summary['junctions'].items():
+        print(f"{name}: crossed {sum(junction['crossed'].values())} {junction['crossed']}, "
+              f"average delay {junction['average_delay']}")
+    for link in summary['links']:
+        print(f"{link['from']} -> {link['to']} ({link['direction']}): carried {link['carried']}, "
+              f"in transit {link['in_transit']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
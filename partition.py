@@ -0,0 +1,165 @@
+import math
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import simulation as sim
+from network import Network
+
+# Runs a road network split across worker processes. The junctions are partitioned into connected
+# groups, every worker simulates one group, and the only thing the workers exchange is the
+# vehicles driving down links between groups. They go through one shared memory block: each worker
+# owns an outbox of fixed-size records there and reads the outboxes of the others.
+#
+# Workers step in lock-step windows instead of exchanging every tick. A vehicle that leaves a
+# junction at tick t cannot arrive before t plus the travel time of its link, so a window as long as
+# the shortest link between groups never needs a vehicle that is still in another worker's window.
+# With a seed, a partitioned run gives exactly the results of the serial Network.
+
+# One vehicle on its way down a link to another partition
+recordType = np.dtype([('link', np.int32), ('arrival', np.int64), ('vehicleClass', np.int8)])
+
+
+# Split the junctions into `workers` groups of neighbours: the junctions are ordered by a breadth-first
+# walk along the links and the order is cut into runs of about equal size
+def partition(junctions, links, workers):
+    neighbours = {name: [] for name in junctions}
+    for link in links:
+        neighbours[link['from']].append(link['to'])
+        neighbours[link['to']].append(link['from'])
+    order = []
+    seen = set()
+    for start in junctions:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = [start]
+        while queue:
+            name = queue.pop(0)
+            order.append(name)
+            for neighbour in neighbours[name]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    workers = max(1, min(workers, len(order)))
+    size = len(order) / workers
+    return [order[round(i * size):round((i + 1) * size)] for i in range(workers)]
+
+
+# Ticks between exchanges: the shortest travel time of a link between two groups, at least one tick
+def windowTicks(links, groups, ticksPerSecond):
+    groupOf = {name: number for number, group in enumerate(groups) for name in group}
+    crossing = [int(link.get('travel_time', 0) * ticksPerSecond) for link in links
+                if groupOf[link['from']] != groupOf[link['to']]]
+    return max(1, min(crossing, default=ticksPerSecond))
+
+
+# Records one worker may write per window: a generous bound on the vehicles leaving its junctions
+def outboxCapacity(links, window, ticksPerSecond):
+    return 1024 + 32 * len(links) * (math.ceil(window / ticksPerSecond) + 1)
+
+
+class Exchange:
+    def __init__(self, shm, workers, capacity):
+        self.counts = np.ndarray((workers,), dtype=np.int64, buffer=shm.buf)
+        offset = self.counts.nbytes
+        self.outboxes = [np.ndarray((capacity,), dtype=recordType, buffer=shm.buf,
+                                    offset=offset + worker * capacity * recordType.itemsize)
+                         for worker in range(workers)]
+
+    @staticmethod
+    def size(workers, capacity):
+        return workers * np.dtype(np.int64).itemsize + workers * capacity * recordType.itemsize
+
+
+# Body of one worker: simulate the group `number`, swapping boundary vehicles with the other workers
+# at the end of every window, and put the summary of the group on the result queue
+def runWorker(number, groups, junctions, links, ticksPerSecond, seed, statsFile, statsFormat, shmName, capacity,
+              window, barrier, results):
+    shm = None
+    try:
+        shm = shared_memory.SharedMemory(name=shmName)
+        exchange = Exchange(shm, len(groups), capacity)
+        network = Network(junctions, links, ticksPerSecond, seed, local=groups[number])
+        network.setStats(statsFile, statsFormat)
+        totalTicks = max(params['simulation_time'] for params in junctions.values()) * ticksPerSecond
+
+        while network.ticks < totalTicks:
+            end = min(network.ticks + window, totalTicks)
+            while network.ticks < end:
+                network.advance()
+                if network.ticks == end:
+                    swap(network, exchange, number, barrier)
+                network.deliver()
+        results.put((number, network.finish(), None))
+    except Exception:
+        barrier.abort()
+        results.put((number, None, traceback.format_exc()))
+    finally:
+        if shm is not None:
+            shm.close()
+
+
+def swap(network, exchange, number, barrier):
+    outbox = network.outbox
+    if len(outbox) > len(exchange.outboxes[number]):
+        raise RuntimeError(f"{len(outbox)} vehicles leave partition {number} in one window, "
+                           f"more than its outbox holds")
+    records = exchange.outboxes[number]
+    for i, (link, arrival, vehicleClass) in enumerate(outbox):
+        records[i] = (link, arrival, sim.vehicleClassIndexes[vehicleClass])
+    exchange.counts[number] = len(outbox)
+    outbox.clear()
+    barrier.wait()
+
+    for other, records in enumerate(exchange.outboxes):
+        if other == number:
+            continue
+        for link, arrival, vehicleClass in records[:exchange.counts[other]].tolist():
+            if network.linkList[link].target in network.local:
+                network.receive(link, arrival, sim.vehicleTypes[vehicleClass])
+    barrier.wait()  # every worker has read the outboxes before they are written again
+
+
+# Run the network on `workers` processes and return the same summary as Network.run()
+def runPartitioned(junctions, links, workers, ticksPerSecond=60, seed=None, statsFile=None, statsFormat=None):
+    groups = partition(junctions, links, workers)
+    window = windowTicks(links, groups, ticksPerSecond)
+    capacity = outboxCapacity(links, window, ticksPerSecond)
+    shm = shared_memory.SharedMemory(create=True, size=Exchange.size(len(groups), capacity))
+    barrier = multiprocessing.Barrier(len(groups))
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=runWorker,
+                                         args=(number, groups, junctions, links, ticksPerSecond, seed, statsFile,
+                                               statsFormat, shm.name, capacity, window, barrier, results))
+                 for number in range(len(groups))]
+    try:
+        for process in processes:
+            process.start()
+        summaries = {}
+        errors = []
+        for _ in processes:
+            number, summary, error = results.get()
+            if error is not None:
+                errors.append(f"partition {number}:\n{error}")
+            summaries[number] = summary
+        for process in processes:
+            process.join()
+    finally:
+        shm.close()
+        shm.unlink()
+    if errors:
+        raise RuntimeError("Network worker failed: " + "\n".join(errors))
+
+    junctionSummaries = {}
+    linkSummaries = {}
+    for summary in summaries.values():
+        junctionSummaries.update(summary['junctions'])
+        for link in summary['links']:
+            linkSummaries[link['from'], link['direction']] = link
+    return {
+        'junctions': {name: junctionSummaries[name] for name in junctions},
+        'links': [linkSummaries[link['from'], link['direction']] for link in links],
+    }
@@ -0,0 +1,128 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import simulation as sim
+from config import loadConfig
+from engine import Engine, runAll
+from signal_policy import PolicyControl, loadPolicy, observationType
+
+# Benchmark of signal policies on many junctions. Every policy drives one junction per seed, with the
+# same seeds for every policy, so all of them see the same vehicles (see simulation.Simulation).
+# The junctions of an observation policy (signal_policy.observationType) step in lockstep in this
+# process. Whenever a green is about to run out, every junction whose green runs out within the
+# decision window is observed and decided in the same call, and the decisions are handed in ahead of
+# time, so a learned controller runs one batched forward pass instead of one per junction. Such an
+# observation has the queues as they are when it is taken and the times as they will be when the
+# green runs out. The built-in callback policies run as ordinary engines.
+
+# Policies configured through the simulation parameters rather than an observation policy
+parameterPolicies = {
+    'traditional': {'intelligent_mode': False},
+    'greedy': {'intelligent_mode': True, 'signal_policy': 'greedy'},
+    'predictive': {'intelligent_mode': True, 'signal_policy': 'predictive'},
+}
+
+
+# Run one junction per seed under an observation policy, all in lockstep, deciding for greens that
+# run out within `window` seconds together (0 batches only greens running out in the same tick).
+# Returns the summaries in seed order, the number of decisions and the number of calls of the policy
+# they took.
+def runLockstep(policy, params, seeds, ticksPerSecond=60, window=1.0):
+    engines = [Engine(params, ticksPerSecond, seed=seed) for seed in seeds]
+    controls = []
+    for engine in engines:
+        control = PolicyControl(engine.sim, policy)
+        engine.sim.setPolicy(control)
+        engine.sim.statsFile = None
+        controls.append(control)
+
+    observations = np.zeros(len(engines), dtype=observationType)
+    windowTicks = int(window * ticksPerSecond)
+    decisions = 0
+    calls = 0
+    active = list(range(len(engines)))
+    while active:
+        # A call is made once some green runs out in this tick, for it and the greens close behind it
+        if any(controls[i].dueWithin(engines[i].ticks, 0) for i in active):
+            due = [i for i in active if controls[i].dueWithin(engines[i].ticks, windowTicks)]
+        else:
+            due = []
+        if due:
+            for row, i in enumerate(due):
+                greenEnd = engines[i].sim.signalController.phaseEnd
+                controls[i].observe(observations[row], max(engines[i].ticks, greenEnd))
+            signals, durations = policy.decide(observations[:len(due)])
+            for row, i in enumerate(due):
+                controls[i].pending = (int(signals[row]), float(durations[row]))
+            decisions += len(due)
+            calls += 1
+        for i in active:
+            engines[i].tick()
+        active = [i for i in active if not engines[i].finished()]
+    return [engine.finish() for engine in engines], decisions, calls
+
+
+def runParameterPolicy(name, params, seeds, ticksPerSecond=60):
+    params = dict(params, **parameterPolicies[name])
+    engines = [Engine(params, ticksPerSecond, seed=seed) for seed in seeds]
+    for engine in engines:
+        engine.sim.statsFile = None
+    return runAll(engines)
+
+
+# Mean results of one policy over its runs
+def summarize(name, summaries, seconds):
+    crossed = [sum(summary['crossed'].values()) for summary in summaries]
+    delay = [sum(summary['average_delay'].values()) / sim.noOfSignals for summary in summaries]
+    return {'policy': name, 'runs': len(summaries), 'crossed': float(np.mean(crossed)),
+            'crossed_std': float(np.std(crossed)), 'average_delay': float(np.mean(delay)), 'seconds': seconds}
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(description="Benchmark signal policies against each other on many junctions.")
+    parser.add_argument('--policies', nargs='+', default=['traditional', 'greedy', 'fixed_time', 'actuated'],
+                        help="traditional, greedy, predictive, fixed_time, actuated, or module:name of an "
+                             "observation policy (a class is instantiated without arguments)")
+    parser.add_argument('--config', help="TOML or JSON file with the simulation parameters")
+    parser.add_argument('--time', type=int, default=600, help="simulation time in seconds")
+    parser.add_argument('--arrival-rate', type=float, help="vehicles generated per simulated second")
+    parser.add_argument('--seeds', type=int, default=20, help="junctions per policy, seeds 0..n-1")
+    parser.add_argument('--ticks-per-second', type=int, default=60, help="fixed timesteps per simulated second")
+    parser.add_argument('--decision-window', type=float, default=1.0,
+                        help="seconds within which greens running out are decided in one call (0: same tick only)")
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    try:
+        params = loadConfig(args.config) if args.config else sim.defaultParameters()
+        params['simulation_time'] = args.time
+        if args.arrival_rate is not None:
+            params['arrival_rate'] = args.arrival_rate
+        policies = {name: None if name in parameterPolicies else loadPolicy(name) for name in args.policies}
+    except (OSError, ValueError, ImportError, AttributeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    seeds = list(range(args.seeds))
+    print(f"{'policy':<24}{'runs':>6}{'crossed':>10}{'std':>8}{'avg delay':>11}{'seconds':>9}")
+    for name, policy in policies.items():
+        start = time.perf_counter()
+        if policy is None:
+            summaries = runParameterPolicy(name, params, seeds, args.ticks_per_second)
+            batching = ""
+        else:
+            summaries, decisions, calls = runLockstep(policy, params, seeds, args.ticks_per_second, args.decision_window)
+            batching = f"  ({decisions} decisions in {calls} calls)"
+        result = summarize(name, summaries, time.perf_counter() - start)
+        print(f"{name:<24}{result['runs']:>6}{result['crossed']:>10.1f}{result['crossed_std']:>8.1f}"
+              f"{result['average_delay']:>11.2f}{result['seconds']:>9.1f}{batching}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+import argparse
+import atexit
+import mmap
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+import simulation as sim
+from shared_state import Frame, phaseCodes, phaseNames
+from signal_controller import ALL_RED, GREEN, YELLOW
+
+# Trajectory log of a run and its player. The recorder writes, for every tick, the state the front
+# end draws (signals, timers, counters and every vehicle's position, rotation, direction and class),
+# plus the events that explain it: vehicle spawns and signal phase changes. Ticks are grouped into
+# chunks that are compressed on their own, and an index of the chunks closes the file, so the player
+# memory-maps the log and decompresses only the chunk holding the time it seeks to.
+#
+# File layout (little-endian):
+#   header  'TREC', version, ticks per second, ticks per chunk
+#   chunks  'CHNK', first tick, ticks, vehicles, events, compressed size, then the zlib-compressed
+#           tick records, vehicle records and event records of the chunk
+#   index   one (first tick, ticks, file offset) per chunk, then its offset, the chunk count and 'TIDX'
+# A log whose run died before the index was written is read by walking the chunk headers.
+
+VERSION = 1
+fileHeader = struct.Struct('<4sHHii')
+chunkHeader = struct.Struct('<4sqiiii')
+indexFooter = struct.Struct('<qi4s')
+
+tickType = np.dtype([('tick', np.int64), ('timeElapsed', np.int32), ('count', np.int32),
+                     ('signalColours', np.int8, sim.noOfSignals), ('signalTexts', np.int16, sim.noOfSignals),
+                     ('crossed', np.int32, sim.noOfSignals)])
+vehicleType = np.dtype([('x', np.float32), ('y', np.float32), ('angle', np.int16), ('direction', np.int8),
+                        ('vehicleClass', np.int8)])
+eventType = np.dtype([('tick', np.int64), ('kind', np.int8), ('a', np.int8), ('b', np.int8), ('c', np.int8),
+                      ('d', np.int8)])
+indexType = np.dtype([('tick', np.int64), ('ticks', np.int32), ('offset', np.int64)])
+
+# Event kinds. A spawn records (direction, lane, vehicle class, will turn), a phase change (signal, phase).
+SPAWN = 0
+PHASE = 1
+phaseEvents = {GREEN: 0, YELLOW: 1, ALL_RED: 2}
+phaseEventNames = {code: phase for phase, code in phaseEvents.items()}
+
+
+class Recorder:
+    def __init__(self, path, simulation, ticksPerSecond, chunkTicks=600, level=6):
+        self.file = open(path, 'wb')
+        self.file.write(fileHeader.pack(b'TREC', VERSION, 0, ticksPerSecond, chunkTicks))
+        self.chunkTicks = chunkTicks
+        self.level = level
+        self.ticks = []
+        self.vehicles = []
+        self.events = []
+        self.index = []
+        self.tick = 0  # events belong to the frame of the tick they lead to
+        simulation.spawnHooks.append(self.spawned)
+        simulation.signalController.hooks.append(self.phaseChanged)
+        self.simulation = simulation
+        atexit.register(self.close)
+
+    def spawned(self, vehicle):
+        self.events.append((self.tick + 1, SPAWN, vehicle.direction_number, vehicle.lane,
+                            sim.vehicleClassIndexes[vehicle.vehicleClass], vehicle.willTurn))
+
+    def phaseChanged(self, signal, phase):
+        self.events.append((self.tick + 1, PHASE, signal, phaseEvents[phase], 0, 0))
+
+    # Record the state at the end of a tick
+    def publish(self, simulation, tick):
+        store = simulation.vehicleStore
+        n = store.count
+        colours, texts = simulation.signalDisplay()
+        self.ticks.append((tick, simulation.timeElapsed, n, [phaseCodes[colour] for colour in colours],
+                           [-1 if text == "---" else text for text in texts],
+                           [simulation.vehicles[direction]['crossed'] for direction in sim.directionNumbers.values()]))
+        vehicles = np.empty(n, dtype=vehicleType)
+        vehicles['x'] = store.x[:n]
+        vehicles['y'] = store.y[:n]
+        steps = store.rotateStep[:n] * sim.rotationAngle
+        vehicles['angle'] = np.where(store.lane[:n] == 1, steps, -steps)
+        vehicles['direction'] = store.direction[:n]
+        vehicles['vehicleClass'] = store.vehicleClass[:n]
+        self.vehicles.append(vehicles)
+        self.tick = tick
+        if len(self.ticks) >= self.chunkTicks:
+            self.writeChunk()
+
+    def writeChunk(self):
+        if not self.ticks:
+            return
+        ticks = np.array(self.ticks, dtype=tickType)
+        vehicles = np.concatenate(self.vehicles)
+        # Events of the frames in this chunk; the ones that lead to the next frame wait for its chunk
+        events = [event for event in self.events if event[0] <= self.tick]
+        self.events = [event for event in self.events if event[0] > self.tick]
+        events = np.array(events, dtype=eventType)
+        blob = zlib.compress(ticks.tobytes() + vehicles.tobytes() + events.tobytes(), self.level)
+
+        self.index.append((int(ticks['tick'][0]), len(ticks), self.file.tell()))
+        self.file.write(chunkHeader.pack(b'CHNK', int(ticks['tick'][0]), len(ticks), len(vehicles), len(events),
+                                         len(blob)))
+        self.file.write(blob)
+        self.ticks = []
+        self.vehicles = []
+
+    def close(self):
+        if self.file is None:
+            return
+        self.writeChunk()
+        offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=indexType).tobytes())
+        self.file.write(indexFooter.pack(offset, len(self.index), b'TIDX'))
+        self.file.close()
+        self.file = None
+        self.simulation.spawnHooks.remove(self.spawned)
+        self.simulation.signalController.hooks.remove(self.phaseChanged)
+        atexit.unregister(self.close)
+
+
+# One recorded tick, with the attributes the front end draws from (see main.drawJunction)
+class RecordedFrame:
+    def __init__(self, record, vehicles):
+        self.tick = int(record['tick'])
+        self.timeElapsed = int(record['timeElapsed'])
+        self.signalColours = [phaseNames[int(code)] for code in record['signalColours']]
+        self.signalTexts = ["---" if text < 0 else int(text) for text in record['signalTexts']]
+        self.crossed = {direction: int(record['crossed'][number]) for number, direction in sim.directionNumbers.items()}
+        self.x = vehicles['x']
+        self.y = vehicles['y']
+        self.angle = vehicles['angle']
+        self.direction = vehicles['direction']
+        self.vehicleClass = vehicles['vehicleClass']
+
+    # (image path, rotation angle, x, y) of every vehicle
+    def vehicles(self):
+        paths = Frame.imagePaths
+        return ((paths[direction, vehicleClass], angle, x, y) for direction, vehicleClass, angle, x, y in
+                zip(self.direction.tolist(), self.vehicleClass.tolist(), self.angle.tolist(), self.x.tolist(),
+                    self.y.tolist()))
+
+
+# Random access to a trajectory log. The file is memory-mapped and a chunk is decompressed only when
+# a tick in it is asked for; the last chunk read is kept.
+class Replay:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.ticksPerSecond, self.chunkTicks = fileHeader.unpack_from(self.map, 0)
+        if magic != b'TREC' or version != VERSION:
+            raise ValueError(f"{path} is not a trajectory log")
+        self.index = self.readIndex()
+        if not len(self.index):
+            raise ValueError(f"{path} holds no recorded ticks")
+        self.cached = None
+        self.firstTick = int(self.index['tick'][0])
+        self.lastTick = int(self.index['tick'][-1] + self.index['ticks'][-1] - 1)
+
+    def readIndex(self):
+        if len(self.map) >= fileHeader.size + indexFooter.size:
+            offset, count, magic = indexFooter.unpack_from(self.map, len(self.map) - indexFooter.size)
+            if magic == b'TIDX':
+                return np.frombuffer(self.map, dtype=indexType, count=count, offset=offset).copy()
+
+        # No index: the recording was cut short, walk the chunks that were written completely
+        index = []
+        offset = fileHeader.size
+        while offset + chunkHeader.size <= len(self.map):
+            magic, tick, ticks, _, _, size = chunkHeader.unpack_from(self.map, offset)
+            if magic != b'CHNK' or offset + chunkHeader.size + size > len(self.map):
+                break
+            index.append((tick, ticks, offset))
+            offset += chunkHeader.size + size
+        return np.array(index, dtype=indexType)
+
+    def chunk(self, number):
+        if self.cached is None or self.cached[0] != number:
+            offset = int(self.index['offset'][number])
+            _, _, ticks, vehicles, events, size = chunkHeader.unpack_from(self.map, offset)
+            start = offset + chunkHeader.size
+            data = zlib.decompress(self.map[start:start + size])
+            tickRecords = np.frombuffer(data, dtype=tickType, count=ticks)
+            vehicleRecords = np.frombuffer(data, dtype=vehicleType, count=vehicles, offset=tickRecords.nbytes)
+            eventRecords = np.frombuffer(data, dtype=eventType, count=events,
+                                         offset=tickRecords.nbytes + vehicleRecords.nbytes)
+            starts = np.concatenate([[0], np.cumsum(tickRecords['count'])])
+            self.cached = (number, tickRecords, vehicleRecords, eventRecords, starts)
+        return self.cached
+
+    def chunkOf(self, tick):
+        return max(int(np.searchsorted(self.index['tick'], tick, side='right')) - 1, 0)
+
+    # The recorded frame of a tick, clamped to the recorded range
+    def frame(self, tick):
+        tick = min(max(tick, self.firstTick), self.lastTick)
+        _, ticks, vehicles, _, starts = self.chunk(self.chunkOf(tick))
+        row = int(np.searchsorted(ticks['tick'], tick))
+        return RecordedFrame(ticks[row], vehicles[starts[row]:starts[row + 1]])
+
+    # The frame at a simulated time in seconds
+    def seek(self, seconds):
+        return self.frame(round(seconds * self.ticksPerSecond))
+
+    # Spawns and phase changes with first <= tick <= last, as dicts in the order they happened
+    def events(self, first, last):
+        found = []
+        for number in range(self.chunkOf(first), self.chunkOf(last) + 1):
+            for event in self.chunk(number)[3].tolist():
+                tick, kind, a, b, c, d = event
+                if first <= tick <= last:
+                    if kind == SPAWN:
+                        found.append({'tick': tick, 'event': 'spawn', 'direction': sim.directionNumbers[a],
+                                      'lane': b, 'vehicle_class': sim.vehicleTypes[c], 'will_turn': d})
+                    else:
+                        found.append({'tick': tick, 'event': 'phase', 'signal': a, 'phase': phaseEventNames[b]})
+        return found
+
+    def close(self):
+        self.cached = None
+        self.map.close()
+        self.file.close()
+
+
+# Play a log back in a window from a given time. Space pauses, the arrow keys jump 10 s back or ahead.
+def play(replay, start=0.0, speed=1.0):
+    import pygame
+
+    import assets
+    from main import drawJunction
+    from renderer import Renderer
+
+    pygame.init()
+    screenWidth = 1400
+    screenHeight = 800
+    screen = pygame.display.set_mode((screenWidth, screenHeight))
+    pygame.display.set_caption("REPLAY")
+    signalImages = {'green': assets.image('images/signals/green.png'),
+                    'yellow': assets.image('images/signals/yellow.png'),
+                    'red': assets.image('images/signals/red.png')}
+    assets.preload()
+    font = pygame.font.Font(None, 30)
+    renderer = Renderer(screen, assets.image('images/intersection.png'), (0, 0, screenWidth, screenHeight))
+    clock = pygame.time.Clock()
+
+    position = start * replay.ticksPerSecond
+    paused = False
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return
+                elif event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_LEFT:
+                    position -= 10 * replay.ticksPerSecond
+                elif event.key == pygame.K_RIGHT:
+                    position += 10 * replay.ticksPerSecond
+        position = min(max(position, replay.firstTick), replay.lastTick)
+
+        renderer.begin()
+        drawJunction(renderer, replay.frame(int(position)), signalImages, font)
+        renderer.flip()
+        elapsed = clock.tick(60)
+        if not paused:
+            position += elapsed / 1000 * replay.ticksPerSecond * speed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play back a trajectory log written with --record.")
+    parser.add_argument('log', help="trajectory log")
+    parser.add_argument('--start', type=float, default=0.0, help="simulated second to start playing from")
+    parser.add_argument('--speed', type=float, default=1.0, help="simulated seconds per second of playback")
+    parser.add_argument('--events', action='store_true',
+                        help="print the spawns and phase changes from --start on instead of playing")
+    args = parser.parse_args(argv)
+    try:
+        replay = Replay(args.log)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if args.events:
+        for event in replay.events(round(args.start * replay.ticksPerSecond), replay.lastTick):
+            print(event)
+    else:
+        play(replay, args.start, args.speed)
+    replay.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
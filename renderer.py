@@ -0,0 +1,99 @@
+import pygame
+
+# Dirty-rectangle renderer for the pygame front end. The intersection background is kept as a
+# static layer; every frame only the areas that changed are restored from it, redrawn and sent
+# to the display, instead of repainting and updating the whole window.
+#
+# A frame is drawn in layers:
+#   begin()        erase last frame's sprites (returns True when the whole window is repainted)
+#   place(...)     items at fixed positions (signals, labels), redrawn only when their surface
+#                  changes or something on top of them was erased
+#   drawSprites()  moving items (vehicles), redrawn every frame and clipped to the canvas
+#   markDirty()    areas the caller drew itself (control panel, overlays)
+#   flip()         update the dirty areas of the display
+class Renderer:
+    def __init__(self, screen, background, canvas):
+        self.screen = screen
+        self.canvas = pygame.Rect(canvas)
+        self.static = pygame.Surface(screen.get_size())
+        self.static.blit(background, (0, 0))
+        if pygame.display.get_surface() is not None:
+            self.static = self.static.convert()
+        self.slots = {}  # key -> (surface, rect) on screen
+        self.pending = []
+        self.sprites = []  # rects of the sprites drawn last frame
+        self.texts = {}  # key -> (value, rendered surface)
+        self.dirty = []
+        self.erased = []
+        self.full = True
+
+    # Repaint everything on the next frame, e.g. after an overlay was closed
+    def invalidate(self):
+        self.full = True
+
+    # Text surface for a slot, rendered again only when the value changed
+    def text(self, key, value, font, color, background):
+        cached = self.texts.get(key)
+        if cached is None or cached[0] != value:
+            cached = (value, font.render(str(value), True, color, background))
+            self.texts[key] = cached
+        return cached[1]
+
+    def restore(self, rect):
+        self.screen.blit(self.static, rect, rect)
+        self.erased.append(rect)
+        self.dirty.append(rect)
+
+    def begin(self):
+        self.dirty = []
+        self.erased = []
+        self.pending = []
+        full = self.full
+        if full:
+            self.screen.blit(self.static, (0, 0))
+            self.slots.clear()
+        else:
+            for rect in self.sprites:
+                self.restore(rect)
+        self.sprites = []
+        return full
+
+    def place(self, key, surface, position):
+        self.pending.append((key, surface, surface.get_rect(topleft=position)))
+
+    # Draw the placed items, in the order they were placed
+    def drawSlots(self):
+        changed = set()
+        for key, surface, rect in self.pending:
+            previous = self.slots.get(key)
+            if previous is None or previous[0] is not surface or previous[1] != rect:
+                changed.add(key)
+                if previous is not None:
+                    self.restore(previous[1])
+        for key, surface, rect in self.pending:
+            if key in changed or rect.collidelist(self.erased) != -1:
+                self.screen.blit(surface, rect)
+                self.dirty.append(rect)
+            self.slots[key] = (surface, rect)
+
+    # Draw (surface, (x, y)) pairs on top of everything placed, clipped to the canvas
+    def drawSprites(self, sprites):
+        self.drawSlots()
+        self.screen.set_clip(self.canvas)
+        for surface, (x, y) in sprites:
+            rect = pygame.Rect(int(x), int(y), surface.get_width(), surface.get_height()).clip(self.canvas)
+            if rect.width and rect.height:
+                self.screen.blit(surface, (int(x), int(y)))
+                self.sprites.append(rect)
+        self.screen.set_clip(None)
+        self.dirty.extend(self.sprites)
+
+    def markDirty(self, rect):
+        self.dirty.append(pygame.Rect(rect))
+
+    def flip(self):
+        if self.full:
+            pygame.display.update()
+            self.full = False
+        elif self.dirty:
+            pygame.display.update(self.dirty)
@@ -0,0 +1,179 @@
+import atexit
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import simulation as sim
+
+# Shared-memory ring buffer of the state of a run, one frame per tick: signal colours and timers,
+# crossing counters, and the position, rotation, direction and class of every vehicle. The engine
+# writes frames into a named block of shared memory (see engine.py --share-state); a viewer or an
+# analysis process in another process attaches by name at any time and reads the frames in place,
+# without copying or pickling. Nothing is sent to a reader, so a run with nobody watching only
+# pays for writing the frame.
+#
+# Every slot carries the sequence number of the frame in it, set to -1 while the slot is being
+# written. A reader takes the latest complete frame and can check afterwards that the writer has
+# not come round the ring and reused the slot in the meantime.
+
+MAGIC = int.from_bytes(b'TRAF', 'little')  # marks a block written by StateRing
+RUNNING = 1
+FINISHED = 2
+
+phaseCodes = {'red': 0, 'yellow': 1, 'green': 2}
+phaseNames = {code: name for name, code in phaseCodes.items()}
+
+ownedRings = set()  # names of the rings written by this process
+
+headerType = np.dtype([('magic', np.int64), ('slots', np.int64), ('capacity', np.int64), ('latest', np.int64),
+                       ('state', np.int64)])
+
+
+# Layout of one frame holding at most `capacity` vehicles
+def frameType(capacity):
+    return np.dtype([
+        ('sequence', np.int64),
+        ('tick', np.int64),
+        ('timeElapsed', np.int64),
+        ('count', np.int64),
+        ('signalColours', np.int8, sim.noOfSignals),
+        ('signalTexts', np.int16, sim.noOfSignals),  # -1 when the timer is not shown
+        ('crossed', np.int32, sim.noOfSignals),
+        ('x', np.float64, capacity),
+        ('y', np.float64, capacity),
+        ('angle', np.int16, capacity),
+        ('direction', np.int8, capacity),
+        ('vehicleClass', np.int8, capacity),
+    ])
+
+
+# Writer side, owned by the engine. The block is removed when the ring is closed.
+class StateRing:
+    def __init__(self, name=None, slots=64, capacity=2048):
+        self.frameType = frameType(capacity)
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=headerType.itemsize + slots * self.frameType.itemsize)
+        self.name = self.shm.name
+        ownedRings.add(self.shm._name)
+        self.header = np.ndarray((), dtype=headerType, buffer=self.shm.buf)
+        self.frames = np.ndarray((slots,), dtype=self.frameType, buffer=self.shm.buf, offset=headerType.itemsize)
+        self.header['magic'] = MAGIC
+        self.header['slots'] = slots
+        self.header['capacity'] = capacity
+        self.header['latest'] = -1
+        self.header['state'] = RUNNING
+        self.slots = slots
+        self.capacity = capacity
+        self.sequence = 0
+        atexit.register(self.close)
+
+    # Write the state of a simulation at the end of a tick. Vehicles beyond the capacity are left out.
+    def publish(self, simulation, tick):
+        frames = self.frames
+        slot = self.sequence % self.slots
+        frames['sequence'][slot] = -1
+        store = simulation.vehicleStore
+        n = min(store.count, self.capacity)
+
+        frames['tick'][slot] = tick
+        frames['timeElapsed'][slot] = simulation.timeElapsed
+        frames['count'][slot] = n
+        colours, texts = simulation.signalDisplay()
+        frames['signalColours'][slot] = [phaseCodes[colour] for colour in colours]
+        frames['signalTexts'][slot] = [-1 if text == "---" else text for text in texts]
+        frames['crossed'][slot] = [simulation.vehicles[direction]['crossed']
+                                   for direction in sim.directionNumbers.values()]
+        frames['x'][slot, :n] = store.x[:n]
+        frames['y'][slot, :n] = store.y[:n]
+        steps = store.rotateStep[:n] * sim.rotationAngle
+        frames['angle'][slot, :n] = np.where(store.lane[:n] == 1, steps, -steps)
+        frames['direction'][slot, :n] = store.direction[:n]
+        frames['vehicleClass'][slot, :n] = store.vehicleClass[:n]
+
+        frames['sequence'][slot] = self.sequence
+        self.header['latest'] = self.sequence
+        self.sequence += 1
+
+    def close(self):
+        if self.shm is not None:
+            self.header['state'] = FINISHED
+            del self.header, self.frames
+            self.shm.close()
+            self.shm.unlink()
+            ownedRings.discard(self.shm._name)
+            self.shm = None
+            atexit.unregister(self.close)
+
+
+# Reader side: attaches to the ring of a running engine. The frames are read-only views.
+class StateView:
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Only the writer removes the block; on Python < 3.13 an attached block would otherwise be
+        # unlinked by the resource tracker when the reader exits
+        if self.shm._name not in ownedRings:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.header = np.ndarray((), dtype=headerType, buffer=self.shm.buf)
+        if self.header['magic'] != MAGIC:
+            self.shm.close()
+            raise ValueError(f"Shared memory {name} does not hold a simulation state ring")
+        self.slots = int(self.header['slots'])
+        self.frames = np.ndarray((self.slots,), dtype=frameType(int(self.header['capacity'])), buffer=self.shm.buf,
+                                 offset=headerType.itemsize)
+        self.header.flags.writeable = False
+        self.frames.flags.writeable = False
+
+    # False once the engine has finished and closed the ring; the last frames stay readable
+    def running(self):
+        return self.header['state'] == RUNNING
+
+    # The most recent complete frame, None before the first one
+    def latest(self):
+        while True:
+            sequence = int(self.header['latest'])
+            if sequence < 0:
+                return None
+            slot = sequence % self.slots
+            if self.frames['sequence'][slot] == sequence:
+                return Frame(self.frames, slot, sequence)
+
+    # Frames still referenced keep the mapping alive until they are dropped
+    def close(self):
+        del self.header, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+# One frame of the ring, with the attributes of a sim.Snapshot the front end draws from.
+# The vehicle arrays are views into shared memory; valid() tells whether they still hold this frame.
+class Frame:
+    imagePaths = {(direction, vehicleClass): "images/" + sim.directionNumbers[direction] + "/" + name + ".png"
+                  for direction in sim.directionNumbers for vehicleClass, name in sim.vehicleTypes.items()}
+
+    def __init__(self, frames, slot, sequence):
+        self.frames = frames
+        self.slot = slot
+        self.sequence = sequence
+        frame = frames[slot]
+        n = int(frame['count'])
+        self.tick = int(frame['tick'])
+        self.timeElapsed = int(frame['timeElapsed'])
+        self.signalColours = [phaseNames[int(code)] for code in frame['signalColours']]
+        self.signalTexts = ["---" if text < 0 else int(text) for text in frame['signalTexts']]
+        self.crossed = {direction: int(frame['crossed'][number]) for number, direction in sim.directionNumbers.items()}
+        self.x = frames['x'][slot, :n]
+        self.y = frames['y'][slot, :n]
+        self.angle = frames['angle'][slot, :n]
+        self.direction = frames['direction'][slot, :n]
+        self.vehicleClass = frames['vehicleClass'][slot, :n]
+
+    def valid(self):
+        return self.frames['sequence'][self.slot] == self.sequence
+
+    # (image path, rotation angle, x, y) of every vehicle
+    def vehicles(self):
+        paths = self.imagePaths
+        return ((paths[direction, vehicleClass], angle, x, y) for direction, vehicleClass, angle, x, y in
+                zip(self.direction.tolist(), self.vehicleClass.tolist(), self.angle.tolist(), self.x, self.y))
@@ -0,0 +1,119 @@
+import math
+
+# Signal phases of the controlled direction; every other direction is red
+GREEN = 'green'
+YELLOW = 'yellow'
+ALL_RED = 'allRed'
+
+
+# Event-driven signal controller: an explicit green -> yellow -> all-red -> next green state machine.
+# Every phase end is scheduled on the simulation clock (in ticks), so between events update() is a
+# single comparison and nothing is counted down second by second.
+class SignalController:
+    def __init__(self, signals, ticksPerSecond, allRed=0):
+        self.signals = signals
+        self.ticksPerSecond = ticksPerSecond
+        self.allRed = allRed  # seconds of all-red clearance between phases
+        self.current = 0
+        self.next = 1 % len(signals)
+        self.phase = None
+        self.now = 0
+        self.phaseEnd = 0
+        self.nextCheck = math.inf
+
+        # Policy callbacks. gapOut(signal) ends a green early when it returns True and is asked once
+        # per simulated second of green; extendGreen(signal) is asked when a green runs out and keeps
+        # it for that many more seconds when it returns more than 0; chooseNext(signal) picks the
+        # signal that gets green next.
+        self.gapOut = lambda signal: False
+        self.extendGreen = lambda signal: 0
+        self.chooseNext = lambda signal: (signal + 1) % len(self.signals)
+        # Set when chooseNext always picks the following signal, so the greens ahead are known
+        self.fixedOrder = False
+
+        # Phase-change hooks, called as hook(signal, phase) whenever a signal enters a phase
+        self.hooks = []
+
+    def start(self, tick, signal=0):
+        self.now = tick
+        self.startGreen(signal)
+
+    # Process every event that is due by this tick, each at the time it was scheduled for
+    def update(self, tick):
+        while min(self.phaseEnd, self.nextCheck) <= tick:
+            if self.nextCheck <= self.phaseEnd:
+                self.now = self.nextCheck
+                self.checkGap()
+            else:
+                self.now = self.phaseEnd
+                self.endPhase()
+        self.now = tick
+
+    def enter(self, phase, seconds):
+        self.phase = phase
+        self.phaseEnd = self.now + self.ticks(seconds)
+        for hook in self.hooks:
+            hook(self.current, phase)
+
+    def startGreen(self, signal):
+        self.current = signal
+        self.enter(GREEN, self.signals[signal].green)
+        self.nextCheck = self.now if self.phaseEnd > self.now else math.inf
+
+    # Once per second of green the policy may cut the green short
+    def checkGap(self):
+        if self.gapOut(self.current):
+            self.endPhase()
+        else:
+            self.nextCheck += self.ticksPerSecond
+            if self.nextCheck >= self.phaseEnd:
+                self.nextCheck = math.inf
+
+    def endPhase(self):
+        self.nextCheck = math.inf
+        if self.phase == GREEN:
+            extension = self.extendGreen(self.current) if self.phaseEnd <= self.now else 0
+            if extension > 0:
+                self.phaseEnd = self.now + max(int(extension * self.ticksPerSecond), 1)
+                self.nextCheck = self.now + self.ticksPerSecond
+                if self.nextCheck >= self.phaseEnd:
+                    self.nextCheck = math.inf
+                return
+            self.enter(YELLOW, self.signals[self.current].yellow)
+        elif self.phase == YELLOW:
+            self.enter(ALL_RED, self.allRed)
+            self.next = self.chooseNext(self.current)
+        else:
+            self.startGreen(self.next)
+
+    # Signal that may drive through the junction right now, or -1 during yellow and all-red
+    def greenSignal(self):
+        return self.current if self.phase == GREEN else -1
+
+    # Whole seconds left in the current phase
+    def timeLeft(self):
+        return math.ceil(max(self.phaseEnd - self.now, 0) / self.ticksPerSecond)
+
+    # Seconds until the given signal turns green, if that is already decided: the rest of the current
+    # phase, then the phases still ahead of the current signal and the whole cycle of every signal
+    # that goes before it
+    def timeUntilGreen(self, signal):
+        if self.phase == ALL_RED and signal == self.next:
+            return self.timeLeft()
+        if not self.fixedOrder or (signal == self.current and self.phase != ALL_RED):
+            return None
+        ticks = max(self.phaseEnd - self.now, 0)
+        if self.phase == GREEN:
+            ticks += self.ticks(self.signals[self.current].yellow) + self.ticks(self.allRed)
+        elif self.phase == YELLOW:
+            ticks += self.ticks(self.allRed)
+        other = self.next if self.phase == ALL_RED else (self.current + 1) % len(self.signals)
+        while other != signal:
+            ticks += self.ticks(self.signals[other].green) + self.ticks(self.signals[other].yellow)
+            ticks += self.ticks(self.allRed)
+            other = (other + 1) % len(self.signals)
+        return math.ceil(ticks / self.ticksPerSecond)
+
+    # Length of a phase of the given seconds, in ticks, as enter() schedules it
+    def ticks(self, seconds):
+        return int(seconds * self.ticksPerSecond)
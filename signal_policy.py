@@ -0,0 +1,316 @@
+import collections
+import importlib
+import logging
+
+import numpy as np
+
+import simulation as sim
+from signal_controller import GREEN, YELLOW
+
+log = logging.getLogger('traffic.signal_policy')
+
+# Signal policies: the decisions the signal controller leaves open. gapOut(signal) is asked once per
+# second of green whether to end it early, chooseNext(signal) picks the signal that gets green after
+# `signal` and may set how long that green lasts (signals[next].green). A policy is built for one
+# simulation; traditional mode always uses the fixed cycle, intelligent mode the policy named by
+# the signal_policy parameter.
+
+
+# Traditional mode: every signal in turn, each with its own fixed or random green time
+class FixedCyclePolicy:
+    fixedOrder = True
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+    def gapOut(self, signal):
+        return False
+
+    def chooseNext(self, signal):
+        return (signal + 1) % sim.noOfSignals
+
+
+# The original intelligent mode: a green ends when its direction is empty, and the direction with the
+# most stopped plus approaching vehicles goes next
+class GreedyPolicy:
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+    def gapOut(self, signal):
+        current_direction = sim.directionNumbers[signal]
+        if self.simulation.approachingVehicles(current_direction) == 0:
+            log.info("No vehicles detected in direction %s, switching signal...", current_direction)
+            return True
+        return False
+
+    def chooseNext(self, signal):
+        simulation = self.simulation
+        # Get current stopped vehicle counts
+        stopped_counts = simulation.countStoppedVehicles()
+
+        # Create a list of directions excluding the current green
+        available_directions = []
+        for i in range(sim.noOfSignals):
+            if i != signal:
+                direction = sim.directionNumbers[i]
+                # Check both stopped vehicles and approaching vehicles
+                count = stopped_counts[direction] + simulation.approachingVehicles(direction)
+                available_directions.append((i, count))
+
+        # Sort by number of vehicles (highest to lowest)
+        available_directions.sort(key=lambda x: x[1], reverse=True)
+
+        # Select the direction with the most vehicles
+        if available_directions[0][1] > 0:  # Only switch if there are actually vehicles waiting
+            log.info("Intelligent mode: Switching to direction %s with %s vehicles", available_directions[0][0],
+                     available_directions[0][1])
+            return available_directions[0][0]
+        # If no vehicles in any direction, move to next signal
+        log.info("No vehicles detected in any direction, cycling signals normally")
+        return (signal + 1) % sim.noOfSignals
+
+
+# Queue-prediction policy. It estimates the arrival rate of every approach over the last
+# `window` seconds and the rate a green discharges its queue (from greens that ended with vehicles
+# still waiting), and predicts each queue at the moment it could next turn green, after the yellow
+# and all-red of the current signal. The next green goes to the approach whose waiting vehicles
+# are accumulating the most delay (predicted queue times the time since its last green), so a
+# quiet approach is not passed over for ever, and any approach left red for maxRed seconds with
+# vehicles waiting goes first. The green is long enough to clear the predicted queue against the
+# arrivals during the green, within greenRange; short greens keep the queues on the other approaches
+# short, which at this junction gains more than the yellow time lost in switching more often. A green
+# ends early once the vehicles queued at its stop line are through and another approach has a queue.
+class PredictivePolicy:
+    window = 60
+    greenRange = (6, 12)
+    maxRed = 90
+    initialDischargeRate = 1.5  # vehicles per second of green, until a saturated green is measured
+    smoothing = 0.3
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.arrivals = {direction: collections.deque() for direction in sim.directionNumbers.values()}
+        self.dischargeRate = {direction: self.initialDischargeRate for direction in sim.directionNumbers.values()}
+        self.lastGreen = {signal: 0 for signal in range(sim.noOfSignals)}
+        self.greenStart = None  # (time, crossed) when the current green started
+        signalController = simulation.signalController
+        if signalController.phase == GREEN:
+            # Built in the middle of a green (the mode switched): count it from now
+            direction = sim.directionNumbers[signalController.current]
+            self.greenStart = (self.now(), simulation.vehicles[direction]['crossed'])
+        simulation.spawnHooks.append(self.arrived)
+        simulation.signalController.hooks.append(self.phaseChanged)
+
+    def arrived(self, vehicle):
+        self.arrivals[vehicle.direction].append(self.simulation.timeElapsed)
+
+    # Vehicles per second arriving on an approach, over the last `window` seconds
+    def arrivalRate(self, direction):
+        now = self.simulation.timeElapsed
+        arrivals = self.arrivals[direction]
+        while arrivals and arrivals[0] <= now - self.window:
+            arrivals.popleft()
+        return len(arrivals) / max(min(now, self.window), 1)
+
+    def phaseChanged(self, signal, phase):
+        simulation = self.simulation
+        direction = sim.directionNumbers[signal]
+        if phase == GREEN:
+            self.greenStart = (self.now(), simulation.vehicles[direction]['crossed'])
+        elif phase == YELLOW:
+            self.lastGreen[signal] = self.now()
+            if self.greenStart is not None and simulation.approachingVehicles(direction) > 0:
+                start, crossed = self.greenStart
+                seconds = self.now() - start
+                if seconds >= 1:
+                    measured = (simulation.vehicles[direction]['crossed'] - crossed) / seconds
+                    self.dischargeRate[direction] += self.smoothing * (measured - self.dischargeRate[direction])
+            self.greenStart = None
+
+    # Simulated seconds on the controller clock, which runs ahead of timeElapsed with a signal offset
+    def now(self):
+        signalController = self.simulation.signalController
+        return signalController.now / signalController.ticksPerSecond
+
+    def predictedQueue(self, direction, seconds):
+        return self.simulation.approachingVehicles(direction) + self.arrivalRate(direction) * seconds
+
+    def gapOut(self, signal):
+        simulation = self.simulation
+        queueLength = simulation.vehicleStore.queueLength
+        if simulation.approachingVehicles(sim.directionNumbers[signal]) == 0:
+            return True
+        if queueLength[signal] > 0 or self.greenStart is None or self.now() - self.greenStart[0] < self.greenRange[0]:
+            return False
+        return any(queueLength[other] > 0 for other in range(sim.noOfSignals) if other != signal)
+
+    def chooseNext(self, signal):
+        simulation = self.simulation
+        signals = simulation.signals
+        now = self.now()
+        lost = signals[signal].yellow + simulation.signalController.allRed
+
+        best = None
+        for other in range(sim.noOfSignals):
+            if other == signal:
+                continue
+            direction = sim.directionNumbers[other]
+            queue = self.predictedQueue(direction, lost)
+            red = now - self.lastGreen[other] + lost
+            overdue = simulation.approachingVehicles(direction) > 0 and red >= self.maxRed
+            key = (overdue, queue * red if queue >= 1 else 0, red)
+            if best is None or key > best[0]:
+                best = (key, other, queue)
+        key, chosen, queue = best
+        if key[1] == 0:
+            log.info("No vehicles predicted in any direction, cycling signals normally")
+            return (signal + 1) % sim.noOfSignals
+
+        direction = sim.directionNumbers[chosen]
+        netRate = max(self.dischargeRate[direction] - self.arrivalRate(direction), 0.1)
+        green = min(max(round(queue / netRate), self.greenRange[0]), self.greenRange[1])
+        signals[chosen].green = green
+        log.info("Predictive mode: switching to direction %s, %.1f vehicles predicted, %s s green",
+                 chosen, queue, green)
+        return chosen
+
+
+policies = {'fixed': FixedCyclePolicy, 'greedy': GreedyPolicy, 'predictive': PredictivePolicy}
+
+
+# Observation policies see a junction only through a compact observation and answer with a decision,
+# which makes them easy to swap, to learn, and to evaluate on many junctions at once. A policy is
+# any object with decide(observations) -> (signals, durations): observations is an array of
+# observationType, one per junction, and the answer gives for each the signal that gets green next
+# and for how many seconds. It is asked whenever a green runs out; answering with the signal that
+# has green keeps it green for the given duration, anything else ends it with the yellow.
+# PolicyControl runs a Simulation's signals from such a policy.
+observationType = np.dtype([
+    ('queue', np.int32, sim.noOfSignals),  # vehicles queued at the stop line of each approach
+    ('approaching', np.int32, sim.noOfSignals),  # vehicles on each approach that have not crossed yet
+    ('waiting', np.float32, sim.noOfSignals),  # seconds each approach has been red, 0 for the green one
+    ('signal', np.int8),  # signal that has green
+    ('elapsed', np.float32),  # seconds it has had green
+])
+
+
+# Fixed-time control: every signal in turn with a fixed green
+class FixedTime:
+    def __init__(self, greens=(10, 10, 10, 10)):
+        self.greens = np.asarray(greens, dtype=np.float32)
+
+    def decide(self, observations):
+        signals = (observations['signal'].astype(np.int64) + 1) % sim.noOfSignals
+        return signals, self.greens[signals]
+
+
+# Actuated control: a green is extended `extension` seconds at a time while vehicles still approach,
+# up to maxGreen, then the signals are served in turn, skipping approaches without vehicles
+class Actuated:
+    def __init__(self, minGreen=6, maxGreen=30, extension=2):
+        self.minGreen = minGreen
+        self.maxGreen = maxGreen
+        self.extension = extension
+
+    def decide(self, observations):
+        current = observations['signal'].astype(np.int64)
+        rows = np.arange(len(observations))
+        approaching = observations['approaching']
+        extend = (approaching[rows, current] > 0) & (observations['elapsed'] < self.maxGreen)
+
+        order = (current[:, None] + np.arange(1, sim.noOfSignals + 1)) % sim.noOfSignals
+        demand = approaching[rows[:, None], order] > 0
+        following = np.where(demand.any(axis=1), order[rows, demand.argmax(axis=1)], order[:, 0])
+        signals = np.where(extend, current, following)
+        durations = np.where(extend, self.extension, self.minGreen)
+        return signals, durations
+
+
+observationPolicies = {'fixed_time': FixedTime, 'actuated': Actuated}
+
+
+# An observation policy by name, or a class or object given as module:name (e.g. a learned controller)
+def loadPolicy(spec):
+    if spec in observationPolicies:
+        return observationPolicies[spec]()
+    module, _, name = spec.partition(':')
+    if not name:
+        raise ValueError(f"Unknown policy {spec}; give a built-in name or module:name")
+    policy = getattr(importlib.import_module(module), name)
+    return policy() if isinstance(policy, type) else policy
+
+
+# Runs the signals of a Simulation from an observation policy. Install it with
+# simulation.setPolicy(PolicyControl(simulation, policy)). A decision can be handed in ahead of the
+# tick it is needed in (see policy_bench.py, which decides for many junctions in one call);
+# otherwise the policy is asked for this junction alone when the green runs out.
+class PolicyControl:
+    minimumGreen = 1  # seconds; shorter answers are rounded up
+
+    def __init__(self, simulation, policy):
+        self.simulation = simulation
+        self.policy = policy
+        signalController = simulation.signalController
+        self.greenStart = signalController.now
+        self.lastGreen = [signalController.now] * sim.noOfSignals  # tick each approach last had green
+        self.pending = None  # decision handed in for the coming green end
+        self.chosen = None  # signal chosen to follow the yellow
+        signalController.hooks.append(self.phaseChanged)
+
+    def phaseChanged(self, signal, phase):
+        if phase == GREEN:
+            self.greenStart = self.simulation.signalController.now
+        elif phase == YELLOW:
+            self.lastGreen[signal] = self.simulation.signalController.now
+
+    # True when the current green runs out in the given tick, so a decision is needed then
+    def due(self, tick):
+        signalController = self.simulation.signalController
+        return signalController.phase == GREEN and signalController.phaseEnd <= tick
+
+    # True when the current green runs out within `window` ticks of the given tick and no decision
+    # has been handed in for it yet
+    def dueWithin(self, tick, window):
+        signalController = self.simulation.signalController
+        return self.pending is None and signalController.phase == GREEN and signalController.phaseEnd <= tick + window
+
+    # Fill `observation` (one element of an observationType array) with the state of the junction
+    # for a decision at the given tick
+    def observe(self, observation, now):
+        simulation = self.simulation
+        signalController = simulation.signalController
+        tps = signalController.ticksPerSecond
+        current = signalController.current
+        observation['queue'] = simulation.vehicleStore.queueLength
+        observation['approaching'] = simulation.vehicleStore.approachingCount
+        waiting = [(now - lastGreen) / tps for lastGreen in self.lastGreen]
+        if signalController.phase == GREEN:
+            waiting[current] = 0
+        observation['waiting'] = waiting
+        observation['signal'] = current
+        observation['elapsed'] = (now - self.greenStart) / tps
+
+    def decide(self):
+        if self.pending is not None:
+            decision, self.pending = self.pending, None
+            return decision
+        observations = np.zeros(1, dtype=observationType)
+        self.observe(observations[0], self.simulation.signalController.now)
+        signals, durations = self.policy.decide(observations)
+        return int(signals[0]), float(durations[0])
+
+    def gapOut(self, signal):
+        return False
+
+    def extendGreen(self, signal):
+        chosen, duration = self.decide()
+        duration = max(duration, self.minimumGreen)
+        if chosen == signal:
+            return duration
+        self.chosen = chosen
+        self.simulation.signals[chosen].green = duration
+        return 0
+
+    def chooseNext(self, signal):
+        chosen, self.chosen = self.chosen, None
+        return (signal + 1) % sim.noOfSignals if chosen is None else chosen
@@ -0,0 +1,662 @@
+import atexit
+import logging
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+from signal_controller import ALL_RED, GREEN, YELLOW, SignalController
+from stats_sink import StatsSink
+from vehicle_store import VehicleStore
+
+# Simulation model shared by the pygame front end (main.py) and the headless engine (engine.py).
+# Nothing in here touches pygame, so the model can run on machines without a display.
+# The layout of the junction is fixed and lives at module level; everything a run changes lives
+# in a Simulation, so one process can hold any number of independent runs.
+
+log = logging.getLogger('traffic.simulation')
+
+
+# Default values of the setup dialog
+def defaultParameters():
+    return {
+        'simulation_time': 300,
+        'write_period': 30,
+        'intelligent_mode': True,
+        'random_timer': True,
+        'green_timers': [10, 10, 10, 10],
+        'vehicle_types': {'car': True, 'bus': True, 'truck': True, 'bike': True},
+        'arrival_rate': 1.0,
+        'signal_offset': 0,
+        'signal_policy': 'greedy',
+        'arrival_model': 'uniform',  # or a model of demand.py, with the demand keys below
+        'approach_rates': None,
+        'od_matrix': None,
+        'demand_profile': None,
+        'platoon_size': 3,
+        'platoon_headway': 1,
+        'demand_file': None,  # CSV or Parquet file of the 'file' model
+        'demand_start': 0,
+    }
+
+
+# Default values of signal timers
+defaultRed = 150
+defaultAllRed = 0  # all-red clearance after each yellow, off by default to keep the original cycle
+noOfSignals = 4
+speeds = {'car': 2.25, 'bus': 1.8, 'truck': 1.8, 'bike': 2.5}  # average speeds of vehicles
+
+# Coordinates of vehicles' start
+spawnX = {'right': [0, 0, 0], 'down': [755, 727, 697], 'left': [1400, 1400, 1400], 'up': [602, 627, 657]}
+spawnY = {'right': [348, 370, 398], 'down': [0, 0, 0], 'left': [498, 466, 436], 'up': [800, 800, 800]}
+
+vehicleTypes = {0: 'car', 1: 'bus', 2: 'truck', 3: 'bike'}
+vehicleClassIndexes = {'car': 0, 'bus': 1, 'truck': 2, 'bike': 3}
+directionNumbers = {0: 'right', 1: 'down', 2: 'left', 3: 'up'}
+directionIndexes = {'right': 0, 'down': 1, 'left': 2, 'up': 3}
+
+# Coordinates of stop lines
+stopLines = {'right': 590, 'down': 330, 'left': 800, 'up': 535}
+defaultStop = {'right': 580, 'down': 320, 'left': 810, 'up': 545}
+
+# Gap between vehicles
+stoppingGap = 25  # stopping gap
+movingGap = 25  # moving gap
+
+rotationAngle = 3
+mid = {'right': {'x': 705, 'y': 445}, 'down': {'x': 695, 'y': 450}, 'left': {'x': 695, 'y': 425},
+       'up': {'x': 695, 'y': 400}}
+
+# set random green signal time range
+randomGreenSignalTimerRange = [10, 20]
+
+turnMessages = {('right', 1): 'turn right to up', ('right', 2): 'turn right to down',
+                ('down', 1): 'turn down to right', ('down', 2): 'down to left',
+                ('left', 1): 'left to down', ('left', 2): 'left to up'}
+
+# Size of the intersection canvas; vehicles that have crossed and left it are retired
+canvasWidth = 1400
+canvasHeight = 800
+
+# Width and height of each vehicle image driving right or left (images/<direction>/<class>.png);
+# up and down images are the same rotated. Kept here so headless runs need no image files.
+vehicleSizes = {'car': (54, 22), 'bus': (76, 26), 'truck': (62, 26), 'bike': (38, 17)}
+
+
+def vehicleSize(direction, vehicleClass):
+    width, height = vehicleSizes[vehicleClass]
+    return (height, width) if direction in ('up', 'down') else (width, height)
+
+
+# Bounding box of an image rotated by angle degrees, computed the same way pygame.transform.rotate does
+def rotatedSize(width, height, angle):
+    if angle % 90 == 0:
+        return (width, height) if (angle // 90) % 2 == 0 else (height, width)
+    radAngle = math.radians(angle)
+    cx = math.cos(radAngle) * width
+    cy = math.cos(radAngle) * height
+    sx = math.sin(radAngle) * width
+    sy = math.sin(radAngle) * height
+    newWidth = int(max(abs(cx + sy), abs(cx - sy), abs(-cx + sy), abs(-cx - sy)))
+    newHeight = int(max(abs(sx + cy), abs(sx - cy), abs(-sx + cy), abs(-sx - cy)))
+    return newWidth, newHeight
+
+
+class TrafficSignal:
+    def __init__(self, red, yellow, green):
+        self.red = red
+        self.yellow = yellow
+        self.green = green
+        self.signalText = ""
+
+
+# Attribute of a Vehicle that lives in the vehicle store of its simulation
+def storeField(name):
+    def get(self):
+        return getattr(self.sim.vehicleStore, name)[self.id]
+
+    def set(self, value):
+        getattr(self.sim.vehicleStore, name)[self.id] = value
+
+    return property(get, set)
+
+
+# Thin view onto one row of the vehicle store. Movement happens in VehicleStore.advance;
+# the view carries the identity of the vehicle and its place in the lane lists.
+class Vehicle:
+    x = storeField('x')
+    y = storeField('y')
+    width = storeField('width')
+    height = storeField('height')
+    stop = storeField('stop')
+    crossed = storeField('crossed')
+    turned = storeField('turned')
+
+    def __init__(self, sim, lane, vehicleClass, direction_number, direction, will_turn):
+        self.sim = sim
+        self.lane = lane
+        self.vehicleClass = vehicleClass
+        self.speed = speeds[vehicleClass]
+        self.direction_number = direction_number
+        self.direction = direction
+        self.willTurn = will_turn
+        sim.vehicles[direction][lane].append(self)
+        self.index = len(sim.vehicles[direction][lane]) - 1
+        self.crossedIndex = 0
+        self.imagePath = "images/" + direction + "/" + vehicleClass + ".png"
+        width, height = vehicleSize(direction, vehicleClass)
+        vehicleStore = sim.vehicleStore
+        x = spawnX[direction][lane]
+        y = spawnY[direction][lane]
+
+        leaderId = vehicleStore.laneTail[direction_number, lane]
+        leader = sim.spawned[leaderId] if leaderId >= 0 else None
+
+        # Start at the edge of the canvas, or just behind the last vehicle of the lane while it
+        # has not cleared the edge yet
+        if leader is not None:
+            if direction == 'right':
+                x = min(x, leader.x - stoppingGap - width)
+            elif direction == 'left':
+                x = max(x, leader.x + leader.width + stoppingGap)
+            elif direction == 'down':
+                y = min(y, leader.y - stoppingGap - height)
+            elif direction == 'up':
+                y = max(y, leader.y + leader.height + stoppingGap)
+
+        if leader is not None and leader.crossed == 0:
+            if direction == 'right':
+                stop = leader.stop - leader.width - stoppingGap
+            elif direction == 'left':
+                stop = leader.stop + leader.width + stoppingGap
+            elif direction == 'down':
+                stop = leader.stop - leader.height - stoppingGap
+            elif direction == 'up':
+                stop = leader.stop + leader.height + stoppingGap
+            sim.stoppedVehicles[direction] += 1  # increment stopped vehicles count
+        else:
+            stop = defaultStop[direction]
+
+        shape = vehicleStore.shapeId(self.imagePath, width, height, rotatedSize)
+        self.id = vehicleStore.add(direction_number, lane, shape, x, y, width, height, self.speed, stop, will_turn,
+                                   leader.id if leader is not None else -1, vehicleClassIndexes[vehicleClass])
+
+        sim.spawned.append(self)
+        for hook in sim.spawnHooks:
+            hook(self)
+
+    # Side of the junction the vehicle leaves by: its direction, or where it turned to
+    @property
+    def exitDirection(self):
+        return directionNumbers[int(self.sim.vehicleStore.heading[self.id])]
+
+    # Signed rotation of the image while turning, used by the front end
+    @property
+    def angle(self):
+        rotateAngle = int(self.sim.vehicleStore.rotateStep[self.id]) * rotationAngle
+        return rotateAngle if self.lane == 1 else -rotateAngle
+
+
+# Consistent copy of everything a reader of the simulation shows, taken at the end of a tick.
+# The engine publishes a new snapshot after each advance by replacing a single reference and never
+# changes a published one, so readers (the front end, a monitoring thread) never see a
+# half-applied tick, and do not hold the model while they draw.
+class Snapshot:
+    def __init__(self, sim, tick):
+        vehicleStore = sim.vehicleStore
+        n = vehicleStore.count
+        self.tick = tick
+        self.timeElapsed = sim.timeElapsed
+        self.signalColours, self.signalTexts = sim.signalDisplay()
+        self.crossed = {direction: sim.vehicles[direction]['crossed'] for direction in directionNumbers.values()}
+        self.turns = {direction: dict(stats) for direction, stats in sim.directionStats.items()}
+        self.avgDelay = dict(sim.avgDelay)
+        self.stoppedVehicles = dict(sim.stoppedVehicles)
+        self.queueLength = {direction: int(vehicleStore.queueLength[number])
+                            for number, direction in directionNumbers.items()}
+
+        # Vehicles in draw order
+        self.imagePaths = [vehicle.imagePath for vehicle in sim.spawned]
+        self.x = vehicleStore.x[:n].copy()
+        self.y = vehicleStore.y[:n].copy()
+        steps = vehicleStore.rotateStep[:n].astype(int) * rotationAngle
+        self.angles = np.where(vehicleStore.lane[:n] == 1, steps, -steps).tolist()
+
+    # (image path, rotation angle, x, y) of every vehicle
+    def vehicles(self):
+        return zip(self.imagePaths, self.angles, self.x, self.y)
+
+
+# One run of the junction: configuration, signals, vehicles and the stats collected so far.
+# Instances share nothing, so several can be stepped side by side in one process.
+#
+# Random draws come from the global random module, or, when a seed is given, from one stream per
+# concern, each seeded from the seed and the name of the concern: arrival approaches, vehicle
+# classes, lanes and turns, the random green timers, and the lanes and turns of the vehicles that
+# arrive over a road link into each approach (see network.py). A vehicle takes the same number of draws
+# from each stream whatever the signals do, so two runs with the same seed get exactly the same
+# vehicles in the same order; only the signal control differs (common random numbers).
+class Simulation:
+    def __init__(self, seed=None):
+        if seed is None:
+            self.arrivalRandom = self.classRandom = self.routeRandom = self.timerRandom = random
+            self.linkRandom = {direction: random for direction in directionNumbers.values()}
+        else:
+            self.arrivalRandom = random.Random(f"{seed}:arrivals")
+            self.classRandom = random.Random(f"{seed}:vehicle_class")
+            self.routeRandom = random.Random(f"{seed}:routing")
+            self.timerRandom = random.Random(f"{seed}:signal_timer")
+            self.linkRandom = {direction: random.Random(f"{seed}:link:{direction}")
+                               for direction in directionNumbers.values()}
+
+        self.simulationTime = 300
+        self.timePeriod = 30
+        self.intelligentMode = True
+        self.randomGreenSignalTimer = True
+        self.allowedVehicleTypes = {'car': True, 'bus': True, 'truck': True, 'bike': True}
+        self.allowedVehicleTypesList = []
+        self.arrivalRate = 1.0  # vehicles generated per simulated second
+        self.arrivalCredit = 0.0
+        self.demandParameters = None  # parameters of a demand.py model; None for the original generator
+        self.demand = None  # the demand.ArrivalModel or DemandFile, built by initialize()
+        self.signalOffset = 0  # seconds the signal cycle is ahead at the start, to coordinate junctions
+        self.signalPolicy = 'greedy'  # intelligent mode policy, a name in signal_policy.policies
+        self.policy = None
+        self.namedPolicies = {}  # the policies of signal_policy.policies built for this run, by name
+
+        # Approaches fed by a road link from another junction (see network.py); arrivals drawn for
+        # them are dropped, their traffic comes from upstream
+        self.linkedApproaches = set()
+        # Called as hook(vehicle) for every new vehicle, and for every vehicle in the tick it leaves
+        # the canvas
+        self.spawnHooks = []
+        self.departureHooks = []
+
+        self.defaultGreen = {0: 10, 1: 10, 2: 10, 3: 10}
+        self.defaultYellow = 5
+        self.signals = []
+        self.signalController = None
+
+        self.currentGreen = 0  # Indicates which signal is green currently
+        self.nextGreen = (self.currentGreen + 1) % noOfSignals  # Indicates which signal will turn green next
+        self.currentYellow = 0  # Indicates whether yellow signal is on or off
+
+        self.vehicles = {direction: {0: [], 1: [], 2: [], 'crossed': 0} for direction in directionNumbers.values()}
+        self.vehiclesTurned = {direction: {1: [], 2: []} for direction in directionNumbers.values()}
+        self.vehiclesNotTurned = {direction: {1: [], 2: []} for direction in directionNumbers.values()}
+
+        self.timeElapsed = 0
+        self.lastWriteTime = 0
+
+        # for vehicle stats
+        self.directionLeft = {'straight': 0, 'left': 0, 'right': 0}
+        self.directionRight = {'straight': 0, 'left': 0, 'right': 0}
+        self.directionUp = {'straight': 0, 'left': 0, 'right': 0}
+        self.directionDown = {'straight': 0, 'left': 0, 'right': 0}
+        self.directionStats = {'right': self.directionRight, 'down': self.directionDown, 'left': self.directionLeft,
+                               'up': self.directionUp}
+
+        # Stopped vehicles count
+        self.avgDelay = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
+        self.stoppedVehiclesInJunction = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
+        self.stoppedVehicles = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
+        self.delayTimeForStoppedVehicles = {'right': 0, 'down': 0, 'left': 0, 'up': 0}
+        self.isVehicleStopped = {0: True, 1: True, 2: True, 3: True}
+
+        # All vehicles in spawn order, drawn by the front end; spawned[i] is the view of store row i
+        self.spawned = []
+        self.vehicleStore = VehicleStore(stopLines, mid, rotationAngle)
+        self.retiredVehicles = 0
+
+        # Speed multiplier in percent, changed from the control panel
+        self.speed_multiplier = 100
+
+        # Periodic stats. statsFile may contain {run} and {pid} for per-run files; None disables the stats.
+        self.statsFile = "simulation_stats.txt"
+        self.statsFormat = None  # text, csv, jsonl or parquet; None picks it from the file extension
+        self.statsFlushEvery = 1  # write periods between flushes, 0 flushes only when the run ends
+        self.statsRun = None  # name of the run in the records and in {run}, a timestamp by default
+        self.statsSink = None
+
+    # Apply the parameters collected by the setup dialog (or the command line)
+    def configure(self, params):
+        self.simulationTime = params['simulation_time']
+        self.timePeriod = params['write_period']
+        self.intelligentMode = params['intelligent_mode']
+        self.randomGreenSignalTimer = params['random_timer']
+        self.allowedVehicleTypes = params['vehicle_types']
+        self.arrivalRate = params.get('arrival_rate', 1.0)
+        if params.get('arrival_model', 'uniform') != 'uniform':
+            self.demandParameters = params
+        self.signalOffset = params.get('signal_offset', 0)
+        self.signalPolicy = params.get('signal_policy', 'greedy')
+        defaultGreenQ = params['green_timers']
+        for i in range(noOfSignals):
+            self.defaultGreen[i] = defaultGreenQ[i]
+
+        self.allowedVehicleTypesList.clear()
+        for vehicleType in vehicleClassIndexes:
+            if self.allowedVehicleTypes.get(vehicleType):
+                self.allowedVehicleTypesList.append(vehicleClassIndexes[vehicleType])
+
+    # Colour and timer text of every signal as the front end shows them
+    def signalDisplay(self):
+        signalController = self.signalController
+        colours = []
+        texts = []
+        for i in range(noOfSignals):
+            if i == signalController.current and signalController.phase != ALL_RED:
+                colours.append(signalController.phase)
+                texts.append(signalController.timeLeft())
+            else:
+                red = signalController.timeUntilGreen(i)
+                colours.append('red')
+                texts.append(red if red is not None and red <= 10 else "---")
+        return colours, texts
+
+    # Initialization of signals with default values
+    def initialize(self, ticksPerSecond):
+        signals = self.signals
+        defaultGreen = self.defaultGreen
+        defaultYellow = self.defaultYellow
+        minTime = randomGreenSignalTimerRange[0]
+        maxTime = randomGreenSignalTimerRange[1]
+        if self.randomGreenSignalTimer:
+            ts1 = TrafficSignal(0, defaultYellow, self.timerRandom.randint(minTime, maxTime))
+            signals.append(ts1)
+            ts2 = TrafficSignal(ts1.red + ts1.yellow + ts1.green, defaultYellow, self.timerRandom.randint(minTime, maxTime))
+            signals.append(ts2)
+            ts3 = TrafficSignal(defaultRed, defaultYellow, self.timerRandom.randint(minTime, maxTime))
+            signals.append(ts3)
+            ts4 = TrafficSignal(defaultRed, defaultYellow, self.timerRandom.randint(minTime, maxTime))
+            signals.append(ts4)
+        else:
+            ts1 = TrafficSignal(0, defaultYellow, defaultGreen[0])
+            signals.append(ts1)
+            ts2 = TrafficSignal(ts1.yellow + ts1.green, defaultYellow, defaultGreen[1])
+            signals.append(ts2)
+            ts3 = TrafficSignal(defaultRed, defaultYellow, defaultGreen[2])
+            signals.append(ts3)
+            ts4 = TrafficSignal(defaultRed, defaultYellow, defaultGreen[3])
+            signals.append(ts4)
+
+        self.signalController = SignalController(signals, ticksPerSecond, defaultAllRed)
+        self.signalController.hooks.append(self.onPhaseChange)
+        self.setIntelligentMode(self.intelligentMode)
+        self.signalController.chooseNext = self.chooseNextGreen
+        self.signalController.start(-int(self.signalOffset * ticksPerSecond))
+
+        if self.demandParameters is not None:
+            import demand  # demand builds on this module
+            if self.demandParameters['arrival_model'] == 'file':
+                self.demand = demand.DemandFile(self.demandParameters, ticksPerSecond, self.allowedVehicleTypesList)
+            else:
+                arrivalRng, routeRng, classRng = (np.random.default_rng(stream.getrandbits(64)) for stream in
+                                                  (self.arrivalRandom, self.routeRandom, self.classRandom))
+                self.demand = demand.ArrivalModel(self.demandParameters, self.simulationTime, ticksPerSecond,
+                                                  self.allowedVehicleTypesList, arrivalRng, routeRng, classRng)
+
+    # Log the queue lengths at the junction
+    def printStatus(self):
+        stoppedVehiclesInJunction = self.countStoppedVehicles()
+        log.debug('Stopped Vehicles in Junction: %s', stoppedVehiclesInJunction)
+
+    # Keep the signal state seen by vehicles, the front end and the delay accounting in step
+    # with the signal controller
+    def onPhaseChange(self, signal, phase):
+        direction = directionNumbers[signal]
+        if phase == GREEN:
+            self.currentGreen = signal
+            self.currentYellow = 0
+            self.isVehicleStopped[signal] = False
+        elif phase == YELLOW:
+            self.currentYellow = 1  # set yellow signal on
+            # reset stop coordinates of lanes and vehicles
+            self.vehicleStore.resetStops(signal, defaultStop[direction])
+        elif phase == ALL_RED:
+            self.currentYellow = 0
+            self.isVehicleStopped[signal] = True
+
+            # Reset signal times
+            if self.randomGreenSignalTimer:
+                self.signals[signal].green = self.timerRandom.randint(randomGreenSignalTimerRange[0],
+                                                                      randomGreenSignalTimerRange[1])
+            else:
+                self.signals[signal].green = self.defaultGreen[signal]
+            self.signals[signal].yellow = self.defaultYellow
+
+    # Vehicles that haven't crossed yet and are approaching the signal of a direction
+    def approachingVehicles(self, direction):
+        return int(self.vehicleStore.approachingCount[directionIndexes[direction]])
+
+    # Hand the signal decisions to a policy: one of signal_policy.policies, or a
+    # signal_policy.PolicyControl running an observation policy
+    def setPolicy(self, policy):
+        self.policy = policy
+        self.signalController.gapOut = policy.gapOut
+        self.signalController.extendGreen = getattr(policy, 'extendGreen', lambda signal: 0)
+        self.signalController.fixedOrder = getattr(policy, 'fixedOrder', False)
+
+    # Switch between the intelligent mode policy and the fixed cycle, also while running
+    def setIntelligentMode(self, intelligent):
+        from signal_policy import policies  # signal_policy builds on this module
+        self.intelligentMode = intelligent
+        name = self.signalPolicy if intelligent else 'fixed'
+        if name not in self.namedPolicies:
+            self.namedPolicies[name] = policies[name](self)
+        self.setPolicy(self.namedPolicies[name])
+
+    # Pick the signal that turns green after the current one
+    def chooseNextGreen(self, signal):
+        self.nextGreen = self.policy.chooseNext(signal)
+        return self.nextGreen
+
+    # For Update the time for Stopped Vehicles
+    def updateStoppedVehiclesTime(self):
+        isVehicleStopped = self.isVehicleStopped
+        delayTimeForStoppedVehicles = self.delayTimeForStoppedVehicles
+        if isVehicleStopped[0]:
+            delayTimeForStoppedVehicles['right'] += 1
+        if isVehicleStopped[1]:
+            delayTimeForStoppedVehicles['down'] += 1
+        if isVehicleStopped[2]:
+            delayTimeForStoppedVehicles['left'] += 1
+        if isVehicleStopped[3]:
+            delayTimeForStoppedVehicles['up'] += 1
+
+    # Lane and turn decision of a vehicle arriving at the junction, drawn from the given stream
+    def routeVehicle(self, random):
+        lane_number = random.randint(1, 2)
+        will_turn = 0
+        if lane_number == 1:
+            temp = random.randint(0, 99)
+            if temp < 40:
+                will_turn = 1
+        elif lane_number == 2:
+            temp = random.randint(0, 99)
+            if temp < 40:
+                will_turn = 1
+        return lane_number, will_turn
+
+    # Generating one vehicle in the simulation, called once per simulated second.
+    # Returns None when the vehicle was drawn for an approach fed by a road link.
+    def generateVehicle(self):
+        vehicle_type = self.classRandom.choice(self.allowedVehicleTypesList)
+        lane_number, will_turn = self.routeVehicle(self.routeRandom)
+        temp = self.arrivalRandom.randint(0, 99)
+        direction_number = 0
+        dist = [25, 50, 75, 100]
+        if temp < dist[0]:
+            direction_number = 0
+        elif temp < dist[1]:
+            direction_number = 1
+        elif temp < dist[2]:
+            direction_number = 2
+        elif temp < dist[3]:
+            direction_number = 3
+        if directionNumbers[direction_number] in self.linkedApproaches:
+            return None
+        return Vehicle(self, lane_number, vehicleTypes[vehicle_type], direction_number,
+                       directionNumbers[direction_number], will_turn)
+
+    # A vehicle of the given class arriving on an approach from a neighbouring junction
+    def enterVehicle(self, vehicleClass, direction):
+        lane_number, will_turn = self.routeVehicle(self.linkRandom[direction])
+        return Vehicle(self, lane_number, vehicleClass, directionIndexes[direction], direction, will_turn)
+
+    # Generate the vehicles due this simulated second. Fractional arrival rates carry over,
+    # so a rate of 1.5 alternates between one and two vehicles per second. With a demand model
+    # the vehicles arrive tick by tick instead (see spawnArrivals).
+    def generateVehicles(self):
+        if self.demand is not None:
+            return []
+        self.arrivalCredit += self.arrivalRate
+        generated = []
+        while self.arrivalCredit >= 1:
+            self.arrivalCredit -= 1
+            vehicle = self.generateVehicle()
+            if vehicle is not None:
+                generated.append(vehicle)
+        return generated
+
+    # Spawn the vehicles the demand model has arriving in this tick
+    def spawnArrivals(self, tick):
+        generated = []
+        for direction_number, lane, will_turn, vehicleClass in self.demand.arrivals(tick):
+            direction = directionNumbers[direction_number]
+            if direction not in self.linkedApproaches:
+                generated.append(Vehicle(self, lane, vehicleTypes[vehicleClass], direction_number, direction,
+                                         will_turn))
+        return generated
+
+    # Move every vehicle by one tick. The store moves all vehicles in one vectorized pass;
+    # vehicles that cross the stop line or finish a turn are then filed into the crossed lists.
+    def moveVehicles(self):
+        vehicleStore = self.vehicleStore
+        spawned = self.spawned
+        for vehicleId in vehicleStore.detectCrossings():
+            vehicle = spawned[vehicleId]
+            self.vehicles[vehicle.direction]['crossed'] += 1
+            if vehicle.willTurn == 0:
+                self.fileCrossedVehicle(vehicle, self.vehiclesNotTurned[vehicle.direction][vehicle.lane])
+                self.directionStats[vehicle.direction]['straight'] += 1
+                if vehicle.direction != 'up':
+                    log.debug('no turn %s', vehicle.direction)
+
+        for vehicleId in vehicleStore.advance(self.signalController.greenSignal(), self.speed_multiplier, movingGap):
+            vehicle = spawned[vehicleId]
+            self.fileCrossedVehicle(vehicle, self.vehiclesTurned[vehicle.direction][vehicle.lane])
+            log.debug(turnMessages[vehicle.direction, vehicle.lane])
+            self.directionStats[vehicle.direction]['left' if vehicle.lane == 1 else 'right'] += 1
+
+        if self.departureHooks:
+            for vehicleId in vehicleStore.departures(canvasWidth, canvasHeight):
+                for hook in self.departureHooks:
+                    hook(spawned[vehicleId])
+
+    # Append a vehicle to a crossed list and follow the vehicle in front of it
+    def fileCrossedVehicle(self, vehicle, crossedList):
+        self.vehicleStore.setCrossedLeader(vehicle.id, crossedList[-1].id if crossedList else -1)
+        crossedList.append(vehicle)
+        vehicle.crossedIndex = len(crossedList) - 1
+
+    # Retire vehicles that crossed the junction and drove off the canvas. They are dropped from the
+    # vehicle store and from every list, and the remaining vehicles are renumbered so that lane and
+    # crossed-list indices still point at the vehicle in front. Aggregate counters are left untouched.
+    def retireVehicles(self):
+        exited = self.vehicleStore.exited(canvasWidth, canvasHeight)
+        if not exited.any():
+            return 0
+        newIds = self.vehicleStore.compact(~exited)
+        for vehicle in self.spawned:
+            vehicle.id = int(newIds[vehicle.id])
+        self.spawned[:] = [vehicle for vehicle in self.spawned if vehicle.id >= 0]
+
+        for direction in directionNumbers.values():
+            lanes = self.vehicles[direction]
+            for lane in [0, 1, 2]:
+                lanes[lane][:] = [vehicle for vehicle in lanes[lane] if vehicle.id >= 0]
+                for index, vehicle in enumerate(lanes[lane]):
+                    vehicle.index = index
+            for crossedLists in (self.vehiclesTurned, self.vehiclesNotTurned):
+                for lane in crossedLists[direction]:
+                    crossedList = crossedLists[direction][lane]
+                    crossedList[:] = [vehicle for vehicle in crossedList if vehicle.id >= 0]
+                    for index, vehicle in enumerate(crossedList):
+                        vehicle.crossedIndex = index
+
+        retired = int(np.count_nonzero(exited))
+        self.retiredVehicles += retired
+        return retired
+
+    # Queue lengths are maintained by the vehicle store as vehicles stop and start, so this is O(1)
+    def countStoppedVehicles(self):
+        for number, direction in directionNumbers.items():
+            self.stoppedVehiclesInJunction[direction] = int(self.vehicleStore.queueLength[number])
+        return self.stoppedVehiclesInJunction
+
+    # One record per direction with the stats collected so far
+    def statsRecords(self):
+        records = []
+        for number, direction in directionNumbers.items():
+            record = {'run': self.statsRun, 'time': self.timeElapsed, 'direction': direction,
+                      'crossed': self.vehicles[direction]['crossed'], 'average_delay': self.avgDelay[direction],
+                      'stopped': self.stoppedVehicles[direction],
+                      'queued': int(self.vehicleStore.queueLength[number])}
+            record.update(self.directionStats[direction])
+            records.append(record)
+        return records
+
+    # Write the stats to the stats sink, opening it on the first write of a run
+    def writeStatsToFile(self):
+        if self.statsFile is None:
+            return
+        try:
+            if self.statsSink is None:
+                if self.statsRun is None:
+                    self.statsRun = time.strftime('%Y%m%d-%H%M%S')
+                self.statsSink = StatsSink(self.statsFile.format(run=self.statsRun, pid=os.getpid()),
+                                           self.statsFormat, self.statsFlushEvery)
+                atexit.register(self.closeStats)
+            self.statsSink.write(self.statsRecords())
+
+        except OSError as e:
+            log.error("Error writing to file: %s", e)
+
+    # Flush and close the stats sink at the end of a run
+    def closeStats(self):
+        if self.statsSink is not None:
+            self.statsSink.close()
+            self.statsSink = None
+            atexit.unregister(self.closeStats)
+
+    # Advance the simulated clock by one second: delay accounting and periodic stats
+    def simTick(self):
+        self.printStatus()
+        self.updateStoppedVehiclesTime()
+        self.avgDelayCal()
+        self.timeElapsed += 1
+
+        # Write stats every 'timePeriod' seconds
+        if self.timeElapsed - self.lastWriteTime >= self.timePeriod:
+            self.writeStatsToFile()
+            self.lastWriteTime = self.timeElapsed
+
+    # calculate avg delay
+    def avgDelayCal(self):
+        directions = ['right', 'down', 'left', 'up']
+
+        for direction in directions:
+            total_vehicles = self.vehicles[direction]['crossed'] + self.stoppedVehicles[direction]
+            if total_vehicles > 0:  # Prevent division by zero
+                # Average delay = Total delay time / Total number of vehicles
+                # This includes both stopped and non-stopped vehicles
+                self.avgDelay[direction] = self.delayTimeForStoppedVehicles[direction] / total_vehicles
+            else:
+                self.avgDelay[direction] = 0
+
+            log.debug('Direction: %s, total vehicles: %s, stopped vehicles: %s, total delay time: %s, '
+                      'average delay: %.2f seconds', direction, total_vehicles, self.stoppedVehicles[direction],
+                      self.delayTimeForStoppedVehicles[direction], self.avgDelay[direction])
@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+
+# Structured sink for the periodic statistics. Every write period produces one typed record per
+# direction, written through a single buffered file handle that stays open for the whole run.
+# Formats: the original text log (appended to), CSV, JSON Lines and Parquet (needs pyarrow).
+
+# Record fields and their types
+fields = (
+    ('run', str),
+    ('time', int),
+    ('direction', str),
+    ('crossed', int),
+    ('straight', int),
+    ('left', int),
+    ('right', int),
+    ('average_delay', float),
+    ('stopped', int),
+    ('queued', int),
+)
+fieldNames = [name for name, _ in fields]
+
+formats = {'.txt': 'text', '.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+
+# Format used for a file when none is given, from its extension
+def formatFor(path):
+    return formats.get(os.path.splitext(path)[1].lower(), 'text')
+
+
+# The block the stats log has always contained, built from the records of one period
+def textBlock(records):
+    byDirection = {record['direction']: record for record in records}
+    lines = ["", f"Time: {records[0]['time']}s", "Direction-wise Vehicle Counts:"]
+    for direction in ('right', 'down', 'left', 'up'):
+        record = byDirection[direction]
+        label = (direction.capitalize() + ':').ljust(6)
+        lines.append(f"{label} Total={record['crossed']} (Straight={record['straight']}, Left={record['left']}, "
+                     f"Right={record['right']})")
+    lines += ["", "Average Delays:"]
+    for direction in ('right', 'down', 'left', 'up'):
+        lines.append(f"{(direction.capitalize() + ':').ljust(6)} {byDirection[direction]['average_delay']:.2f}")
+    lines += ["", "Stopped Vehicles:"]
+    for direction in ('right', 'down', 'left', 'up'):
+        lines.append(f"{(direction.capitalize() + ':').ljust(6)} {byDirection[direction]['stopped']}")
+    lines.append("-" * 40)
+    return "\n".join(lines) + "\n"
+
+
+def importPyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Writing Parquet stats needs the pyarrow package.")
+    return pyarrow
+
+
+# Raise ValueError when stats cannot be written in the given format (from the extension of `path`
+# when None), so a run finds out before it starts rather than losing its stats
+def checkStatsFile(path, format=None):
+    format = format or formatFor(path)
+    if format not in formats.values():
+        raise ValueError(f"Unknown stats format {format}")
+    if format == 'parquet':
+        importPyarrow()
+
+
+class StatsSink:
+    # flushEvery is the number of write periods between flushes; 0 flushes only on close
+    def __init__(self, path, format=None, flushEvery=1):
+        self.path = path
+        self.format = format or formatFor(path)
+        self.flushEvery = flushEvery
+        self.pending = 0
+        if self.format not in formats.values():
+            raise ValueError(f"Unknown stats format {self.format}")
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = None
+        if self.format == 'parquet':
+            pyarrow = importPyarrow()
+            types = {str: pyarrow.string(), int: pyarrow.int64(), float: pyarrow.float64()}
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema([(name, types[kind]) for name, kind in fields])
+            self.rows = []
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        elif self.format == 'text':
+            self.file = open(path, 'a')  # the text log keeps growing across runs, as it always has
+        else:
+            self.file = open(path, 'w', newline='' if self.format == 'csv' else None)
+            if self.format == 'csv':
+                self.csvWriter = csv.writer(self.file)
+                self.csvWriter.writerow(fieldNames)
+
+    # Write the records of one period
+    def write(self, records):
+        records = [{name: kind(record[name]) for name, kind in fields} for record in records]
+        if self.format == 'text':
+            self.file.write(textBlock(records))
+        elif self.format == 'csv':
+            self.csvWriter.writerows([record[name] for name in fieldNames] for record in records)
+        elif self.format == 'jsonl':
+            self.file.writelines(json.dumps(record) + "\n" for record in records)
+        else:
+            self.rows.extend(records)
+
+        self.pending += 1
+        if self.flushEvery and self.pending >= self.flushEvery:
+            self.flush()
+
+    def flush(self):
+        if self.format == 'parquet':
+            if self.rows:
+                self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+                self.rows = []
+        else:
+            self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.format == 'parquet':
+            self.writer.close()
+        else:
+            self.file.close()
@@ -0,0 +1,214 @@
+import multiprocessing
+import traceback
+
+import numpy as np
+
+import simulation as sim
+from engine import Engine
+from signal_policy import PolicyControl, observationType
+
+# Reinforcement-learning environments on the headless simulation, with the reset/step interface of
+# Gymnasium (without depending on it). An agent drives the signals one decision at a time: whenever
+# the green runs out it picks the signal that gets green next, for greenSeconds. Picking the signal
+# that has green extends it; picking another one ends it with the yellow first. A step runs the
+# junction up to the next decision, so it lasts greenSeconds, plus the yellow after a switch.
+#
+#   observation  float32 vector of observationSize: per approach the vehicles queued at the stop line,
+#                the vehicles not yet across it and the seconds of red, then the green signal one-hot
+#                and the seconds it has had green (see signal_policy.observationType)
+#   action       signal number 0-3
+#   reward       minus the vehicle-seconds spent queued during the step
+#   truncated    the simulation time is over; episodes never terminate otherwise
+#
+# VectorEnv steps many junctions in one call, in this process or spread across worker processes.
+
+observationSize = 4 * sim.noOfSignals + 1
+actionCount = sim.noOfSignals
+
+
+# Flat float32 rows of an array of signal_policy.observationType, as the environments return them
+def flatten(observations):
+    rows = np.empty((len(observations), observationSize), dtype=np.float32)
+    n = sim.noOfSignals
+    rows[:, 0:n] = observations['queue']
+    rows[:, n:2 * n] = observations['approaching']
+    rows[:, 2 * n:3 * n] = observations['waiting']
+    rows[:, 3 * n:4 * n] = np.arange(n) == observations['signal'][:, None]
+    rows[:, 4 * n] = observations['elapsed']
+    return rows
+
+
+class TrafficEnv:
+    # params are simulation parameters (defaults when None). Episode k of an environment with a
+    # seed runs with the seed "{seed}:{k}"; reset(seed=...) runs one episode with the given seed.
+    def __init__(self, params=None, greenSeconds=5, ticksPerSecond=60, seed=None):
+        self.params = sim.defaultParameters() if params is None else params
+        self.greenSeconds = greenSeconds
+        self.ticksPerSecond = ticksPerSecond
+        self.seed = seed
+        self.episodes = 0
+        self.engine = None
+        self.control = None
+        self.observation = np.zeros(1, dtype=observationType)
+
+    def reset(self, seed=None):
+        if seed is None and self.seed is not None:
+            seed = f"{self.seed}:{self.episodes}"
+        self.episodes += 1
+        self.engine = Engine(self.params, self.ticksPerSecond, seed=seed)
+        self.engine.sim.statsFile = None
+        # Every decision is handed in by step(), so the control never asks a policy of its own
+        self.control = PolicyControl(self.engine.sim, None)
+        self.engine.sim.setPolicy(self.control)
+        self.advance()
+        return self.observe(), self.info()
+
+    def step(self, action):
+        if self.engine is None or self.engine.finished():
+            raise RuntimeError("The episode is over; call reset() first")
+        action = int(action)
+        if not 0 <= action < actionCount:
+            raise ValueError(f"Action {action} is not a signal number")
+        self.control.pending = (action, self.greenSeconds)
+        self.engine.tick()
+        queued = int(self.engine.sim.vehicleStore.queueLength.sum()) + self.advance()
+        return self.observe(), -queued / self.ticksPerSecond, False, self.engine.finished(), self.info()
+
+    # Run up to the next decision or the end of the episode; returns the vehicle-ticks queued on the way
+    def advance(self):
+        engine = self.engine
+        control = self.control
+        queueLength = engine.sim.vehicleStore.queueLength
+        queued = 0
+        while not engine.finished() and not control.due(engine.ticks):
+            engine.tick()
+            queued += int(queueLength.sum())
+        return queued
+
+    def observe(self):
+        self.control.observe(self.observation[0], self.engine.ticks)
+        return flatten(self.observation)[0]
+
+    def info(self):
+        simulation = self.engine.sim
+        return {'time': self.engine.simulatedTime(), 'signal': simulation.signalController.current,
+                'crossed': sum(simulation.vehicles[direction]['crossed']
+                               for direction in sim.directionNumbers.values())}
+
+    def close(self):
+        self.engine = None
+        self.control = None
+
+
+# Steps envs of its own, in order; VectorEnv runs one of these per worker process
+class EnvGroup:
+    def __init__(self, envs):
+        self.envs = envs
+
+    def reset(self):
+        observations = []
+        infos = []
+        for env in self.envs:
+            observation, info = env.reset()
+            observations.append(observation)
+            infos.append(info)
+        return np.array(observations), infos
+
+    # An env whose episode ends is reset at once; the observation it ended with goes to
+    # info['final_observation'] and the one it starts the next episode with is returned
+    def step(self, actions):
+        observations = np.empty((len(self.envs), observationSize), dtype=np.float32)
+        rewards = np.empty(len(self.envs), dtype=np.float64)
+        truncated = np.zeros(len(self.envs), dtype=bool)
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[i], _, truncated[i], info = env.step(action)
+            if truncated[i]:
+                info['final_observation'] = observation
+                observation, _ = env.reset()
+            observations[i] = observation
+            infos.append(info)
+        return observations, rewards, np.zeros(len(self.envs), dtype=bool), truncated, infos
+
+
+def runWorker(connection, envs):
+    group = EnvGroup(envs)
+    try:
+        while True:
+            command, argument = connection.recv()
+            if command == 'reset':
+                connection.send((group.reset(), None))
+            elif command == 'step':
+                connection.send((group.step(argument), None))
+            else:
+                break
+    except Exception:
+        connection.send((None, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+# n independent junctions stepped together: step(actions) takes one action per junction and returns
+# arrays of observations (n x observationSize), rewards, terminated and truncated flags, and a list
+# of infos. Ended episodes are reset automatically (see EnvGroup.step). With workers > 0 the
+# junctions are split across that many processes, which step their share in parallel.
+class VectorEnv:
+    def __init__(self, n, params=None, greenSeconds=5, ticksPerSecond=60, seed=None, workers=0):
+        envs = [TrafficEnv(params, greenSeconds, ticksPerSecond, None if seed is None else f"{seed}:{i}")
+                for i in range(n)]
+        self.n = n
+        self.connections = []
+        self.processes = []
+        if workers <= 0:
+            self.group = EnvGroup(envs)
+            return
+        self.group = None
+        workers = min(workers, n)
+        self.slices = [slice(round(i * n / workers), round((i + 1) * n / workers)) for i in range(workers)]
+        for part in self.slices:
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=runWorker, args=(child, envs[part]), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def call(self, command, arguments):
+        for connection, argument in zip(self.connections, arguments):
+            connection.send((command, argument))
+        results = []
+        for connection in self.connections:
+            result, error = connection.recv()
+            if error is not None:
+                raise RuntimeError("Environment worker failed:\n" + error)
+            results.append(result)
+        return results
+
+    def reset(self):
+        if self.group is not None:
+            return self.group.reset()
+        results = self.call('reset', [None] * len(self.connections))
+        return np.concatenate([result[0] for result in results]), [info for result in results for info in result[1]]
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if len(actions) != self.n:
+            raise ValueError(f"Need {self.n} actions, got {len(actions)}")
+        if self.group is not None:
+            return self.group.step(actions)
+        results = self.call('step', [actions[part] for part in self.slices])
+        return (np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results]),
+                np.concatenate([result[2] for result in results]), np.concatenate([result[3] for result in results]),
+                [info for result in results for info in result[4]])
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(('close', None))
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,376 @@
+import numpy as np
+
+# Structure-of-arrays storage for vehicle state and the batched movement kernel.
+# Every vehicle is a row; Vehicle objects in simulation.py are thin views onto a row.
+
+RIGHT, DOWN, LEFT, UP = 0, 1, 2, 3
+
+# Travel axis (0 = x, 1 = y) and sign (+1 towards larger coordinates) of each direction
+AXIS = np.array([0, 1, 0, 1])
+SIGN = np.array([1.0, 1.0, -1.0, -1.0])
+
+# Direction a turning vehicle leaves the junction in, by [direction, lane]
+TURN_HEADING = np.array([[RIGHT, UP, DOWN], [DOWN, RIGHT, LEFT], [LEFT, DOWN, UP], [UP, UP, UP]])
+
+# Position change per tick while a vehicle is turning, by [direction, lane]
+TURN_DX = np.array([[0, 2.4, 2], [0, 1.2, -2.5], [0, -1, -1.8], [0, 0, 0]])
+TURN_DY = np.array([[0, -2.8, 1.8], [0, 1.8, 2], [0, 1.2, -2.5], [0, 0, 0]])
+
+
+# Front and rear edge of each vehicle measured along the given directions, in coordinates that
+# grow in the direction of travel, so "ahead" is always "larger" whichever way the vehicle drives
+def extents(direction, x, y, width, height):
+    alongX = AXIS[direction] == 0
+    forward = SIGN[direction] > 0
+    position = np.where(alongX, x, y)
+    size = np.where(alongX, width, height)
+    front = np.where(forward, position + size, -position)
+    rear = np.where(forward, position, -(position + size))
+    return front, rear
+
+
+class VehicleStore:
+    fields = ('x', 'y', 'width', 'height', 'speed', 'stop', 'direction', 'heading', 'lane', 'shape', 'vehicleClass',
+              'willTurn', 'crossed', 'turned', 'departed', 'rotateStep', 'approaching', 'queued', 'stale',
+              'leader', 'crossedLeader', 'cells')
+    links = ('leader', 'crossedLeader')
+
+    def __init__(self, stopLines, mid, rotationAngle, capacity=256, cellSize=10):
+        self.count = 0
+        self.rotationSteps = 90 // rotationAngle
+
+        # Stop line of each direction, and the point where turning vehicles start to turn
+        # by [direction, lane], both in travel coordinates
+        self.crossLine = np.array([stopLines['right'], stopLines['down'], -stopLines['left'], -stopLines['up']],
+                                  dtype=float)
+        self.turnPoint = np.array([
+            [np.inf, stopLines['right'] + 40, mid['right']['x']],
+            [np.inf, stopLines['down'] + 50, mid['down']['y']],
+            [np.inf, -(stopLines['left'] - 70), -mid['left']['x']],
+            [np.inf, np.inf, np.inf],
+        ])
+
+        # Per-direction counts, updated as vehicles arrive, stop, start and cross, so they can be read in O(1):
+        # vehicles still approaching the stop line, and vehicles queued in front of it
+        self.approachingCount = np.zeros(4, dtype=np.int64)
+        self.queueLength = np.zeros(4, dtype=np.int64)
+
+        # Footprint of every vehicle image at every rotation step, by [shape, step, negative angle]
+        self.shapes = {}
+        self.rotatedSizes = np.zeros((0, self.rotationSteps + 1, 2, 2))
+
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.width = np.zeros(capacity)
+        self.height = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.stop = np.zeros(capacity)
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self.heading = np.zeros(capacity, dtype=np.int8)
+        self.lane = np.zeros(capacity, dtype=np.int8)
+        self.shape = np.zeros(capacity, dtype=np.int16)
+        self.vehicleClass = np.zeros(capacity, dtype=np.int8)  # key of simulation.vehicleTypes
+        self.willTurn = np.zeros(capacity, dtype=np.int8)
+        self.crossed = np.zeros(capacity, dtype=np.int8)
+        self.turned = np.zeros(capacity, dtype=np.int8)
+        self.departed = np.zeros(capacity, dtype=np.int8)  # left the canvas and reported by departures()
+        self.rotateStep = np.zeros(capacity, dtype=np.int16)
+        self.approaching = np.zeros(capacity, dtype=np.int8)  # not crossed and still before the stop line
+        self.queued = np.zeros(capacity, dtype=np.int8)  # waiting at the signal or behind a waiting vehicle
+        self.stale = np.zeros(capacity, dtype=np.int8)  # approaching and queued need a recheck next tick
+
+        # Each lane is a linked list in spawn order, and so is every crossed list once vehicles leave the
+        # junction; the tail of each lane gives a spawning vehicle its leader in one lookup
+        self.leader = np.full(capacity, -1, dtype=np.int64)  # vehicle ahead in the same lane
+        self.crossedLeader = np.full(capacity, -1, dtype=np.int64)  # vehicle ahead after the stop line
+        self.laneTail = np.full((4, 3), -1, dtype=np.int64)  # last vehicle of each lane, by [direction, lane]
+
+        # Occupancy grid over the junction box between the stop lines, in cells of cellSize pixels:
+        # the vehicles covering each cell in the order they moved in, and the last of them in grid
+        # (-1 when free). Every vehicle keeps the cells it covers as (left, top, right, bottom),
+        # half-open, all 0 outside the box, and the grid is updated only where those change.
+        self.cellSize = cellSize
+        self.junction = (stopLines['right'], stopLines['down'])
+        columns = -(-(stopLines['left'] - stopLines['right']) // cellSize)
+        rows = -(-(stopLines['up'] - stopLines['down']) // cellSize)
+        self.gridLimits = np.array([columns, rows, columns, rows], dtype=float)
+        self.grid = np.full((rows, columns), -1, dtype=np.int64)
+        self.occupants = [[] for _ in range(rows * columns)]
+        self.cells = np.zeros((capacity, 4), dtype=np.int16)
+
+    def grow(self):
+        for name in self.fields:
+            array = getattr(self, name)
+            fill = -1 if name in self.links else 0
+            grown = np.full((len(array) * 2,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    # Shape id of an image, computing its rotated footprints the first time it is seen
+    def shapeId(self, key, width, height, rotatedSize):
+        if key not in self.shapes:
+            sizes = np.zeros((1, self.rotationSteps + 1, 2, 2))
+            for step in range(self.rotationSteps + 1):
+                angle = step * 90 // self.rotationSteps
+                sizes[0, step, 0] = rotatedSize(width, height, angle)
+                sizes[0, step, 1] = rotatedSize(width, height, -angle)
+            self.shapes[key] = len(self.shapes)
+            self.rotatedSizes = np.concatenate([self.rotatedSizes, sizes])
+        return self.shapes[key]
+
+    def add(self, direction, lane, shape, x, y, width, height, speed, stop, willTurn, leader, vehicleClass=0):
+        if self.count == len(self.x):
+            self.grow()
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.width[i] = width
+        self.height[i] = height
+        self.speed[i] = speed
+        self.stop[i] = stop
+        self.direction[i] = direction
+        self.heading[i] = direction
+        self.lane[i] = lane
+        self.shape[i] = shape
+        self.vehicleClass[i] = vehicleClass
+        self.willTurn[i] = willTurn
+        self.crossed[i] = 0
+        self.turned[i] = 0
+        self.departed[i] = 0
+        self.rotateStep[i] = 0
+        self.approaching[i] = 0
+        self.queued[i] = 0
+        self.stale[i] = 1
+        self.leader[i] = leader
+        self.crossedLeader[i] = -1
+        self.cells[i] = 0
+        self.laneTail[direction, lane] = i
+        self.count += 1
+        self.updateGrid()
+        return i
+
+    # Link a vehicle behind the last vehicle of the crossed list it joined (-1 when it is the first)
+    def setCrossedLeader(self, i, leader):
+        self.crossedLeader[i] = leader
+
+    # Vehicle occupying the junction at canvas point (x, y), or -1: a single grid lookup
+    def occupant(self, x, y):
+        row = int((y - self.junction[1]) // self.cellSize)
+        column = int((x - self.junction[0]) // self.cellSize)
+        if 0 <= row < self.grid.shape[0] and 0 <= column < self.grid.shape[1]:
+            return int(self.grid[row, column])
+        return -1
+
+    # Cells of the junction box covered by every vehicle, one (left, top, right, bottom) row each
+    def footprints(self):
+        n = self.count
+        scale = 1 / self.cellSize
+        x = (self.x[:n] - self.junction[0]) * scale
+        y = (self.y[:n] - self.junction[1]) * scale
+        cells = np.empty((n, 4))
+        np.floor(x, out=cells[:, 0])
+        np.floor(y, out=cells[:, 1])
+        np.ceil(x + self.width[:n] * scale, out=cells[:, 2])
+        np.ceil(y + self.height[:n] * scale, out=cells[:, 3])
+        np.minimum(np.maximum(cells, 0, out=cells), self.gridLimits, out=cells)
+        cells[(cells[:, 2] <= cells[:, 0]) | (cells[:, 3] <= cells[:, 1])] = 0
+        return cells.astype(np.int16)
+
+    # Bring the grid up to date with the vehicles whose cells changed since the last update
+    def updateGrid(self):
+        cells = self.footprints()
+        changed = np.flatnonzero(np.logical_or.reduce(cells != self.cells[:self.count], axis=1))
+        if len(changed):
+            self.moveCells(changed, cells[changed])
+
+    # Flat grid indices of the cells in a (left, top, right, bottom) rectangle
+    def cellRange(self, left, top, right, bottom):
+        columns = self.grid.shape[1]
+        return [row * columns + column for row in range(top, bottom) for column in range(left, right)]
+
+    # Move the given vehicles from the cells they cover to the given cells. Only a few vehicles
+    # change cells per tick and each covers a handful of cells, so this walks them one by one
+    def moveCells(self, ids, cells):
+        grid = self.grid.reshape(-1)
+        occupants = self.occupants
+        for i, new, old in zip(ids.tolist(), cells.tolist(), self.cells[ids].tolist()):
+            for cell in self.cellRange(*old):
+                here = occupants[cell]
+                here.remove(i)
+                grid[cell] = here[-1] if here else -1
+            for cell in self.cellRange(*new):
+                occupants[cell].append(i)
+                grid[cell] = i
+        self.cells[ids] = cells
+
+    # Vehicles that crossed the junction and are now completely outside the canvas
+    def exited(self, canvasWidth, canvasHeight):
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        outside = ((x + self.width[:n] < 0) | (x > canvasWidth) |
+                   (y + self.height[:n] < 0) | (y > canvasHeight))
+        return (self.crossed[:n] == 1) & outside
+
+    # Vehicles that left the canvas since the last call, in spawn order
+    def departures(self, canvasWidth, canvasHeight):
+        leaving = np.flatnonzero(self.exited(canvasWidth, canvasHeight) & (self.departed[:self.count] == 0))
+        self.departed[leaving] = 1
+        return leaving
+
+    # Keep only the rows selected by the mask, packed to the front in the same order.
+    # Leader references are renumbered; a retired leader becomes -1 (nothing ahead).
+    # Returns the new id of every old row, -1 for retired rows.
+    def compact(self, keep):
+        n = self.count
+        retired = np.flatnonzero(~keep)
+        self.moveCells(retired, np.zeros((len(retired), 4), dtype=np.int16))
+        kept = int(np.count_nonzero(keep))
+        newIds = np.full(n, -1, dtype=np.int64)
+        newIds[keep] = np.arange(kept)
+        for name in self.fields:
+            array = getattr(self, name)
+            array[:kept] = array[:n][keep]
+        for name in self.links:
+            array = getattr(self, name)[:kept]
+            array[:] = np.where(array >= 0, newIds[array], -1)
+        self.count = kept
+        self.grid[:] = np.where(self.grid >= 0, newIds[self.grid], -1)
+        renumber = newIds.tolist()
+        self.occupants = [[renumber[i] for i in here] for here in self.occupants]
+
+        # The last remaining vehicle of a lane is its new tail; ids are in spawn order
+        self.laneTail.fill(-1)
+        np.maximum.at(self.laneTail, (self.direction[:kept], self.lane[:kept]), np.arange(kept))
+        return newIds
+
+    # Put every vehicle of a direction back to the default stop coordinate
+    def resetStops(self, direction, stop):
+        n = self.count
+        inDirection = self.direction[:n] == direction
+        self.stop[:n][inDirection] = stop
+        self.stale[:n][inDirection] = 1
+
+    # Mark vehicles whose front passed the stop line and return their ids in spawn order
+    def detectCrossings(self):
+        n = self.count
+        direction = self.direction[:n]
+        front, _ = extents(direction, self.x[:n], self.y[:n], self.width[:n], self.height[:n])
+        crossedIds = np.flatnonzero((self.crossed[:n] == 0) & (front > self.crossLine[direction]))
+        if len(crossedIds):
+            self.crossed[crossedIds] = 1
+            # They stop approaching, and their followers stop queueing behind a waiting vehicle
+            self.stale[crossedIds] = 1
+            self.stale[:n][np.isin(self.leader[:n], crossedIds)] = 1
+        return crossedIds
+
+    # Move every vehicle by one tick in a single vectorized pass. greenDirection is the direction
+    # with a green (not yellow) signal, or -1. Returns the ids of vehicles that finished turning.
+    def advance(self, greenDirection, speedMultiplier, movingGap):
+        n = self.count
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        x = self.x[:n]
+        y = self.y[:n]
+        width = self.width[:n]
+        height = self.height[:n]
+        direction = self.direction[:n]
+        heading = self.heading[:n]
+        lane = self.lane[:n]
+        crossed = self.crossed[:n] == 1
+        turned = self.turned[:n] == 1
+        willTurn = self.willTurn[:n] == 1
+
+        front, rear = extents(direction, x, y, width, height)
+        stopOk = (front <= SIGN[direction] * self.stop[:n]) | (direction == greenDirection)
+
+        # Gap to the vehicle ahead in the same lane, measured along this vehicle's approach
+        # (the leader drives in the same direction, so its rear is in the same coordinates)
+        leader = self.leader[:n]
+        hasLeader = leader >= 0
+        leaderId = np.where(hasLeader, leader, 0)
+        followOk = ~hasLeader | (front < rear[leaderId] - movingGap)
+        leaderTurned = hasLeader & (self.turned[leaderId] == 1)
+
+        # Gap to the vehicle that crossed ahead of this one, measured along its current heading
+        # (vehicles in the same crossed list leave the junction with the same heading)
+        crossedLeader = self.crossedLeader[:n]
+        hasCrossedLeader = crossedLeader >= 0
+        crossedLeaderId = np.where(hasCrossedLeader, crossedLeader, 0)
+        headFront, headRear = extents(heading, x, y, width, height)
+        crossedFollowOk = ~hasCrossedLeader | (headFront < headRear[crossedLeaderId] - movingGap)
+
+        up = direction == UP
+        turning = willTurn & ~up
+        straight = ~willTurn & ~up
+        approaching = turning & (~crossed | (front < self.turnPoint[direction, lane]))
+
+        moving = ((approaching & (stopOk | crossed) & (followOk | leaderTurned)) |
+                  (straight & ~crossed & stopOk & followOk) |
+                  (straight & crossed & crossedFollowOk) |
+                  (up & ((~crossed & stopOk) | crossed) & followOk) |
+                  (turning & ~approaching & turned & crossedFollowOk))
+        rotating = np.flatnonzero(turning & ~approaching & ~turned)
+
+        distance = np.where(moving, self.speed[:n] * (speedMultiplier / 100) * SIGN[heading], 0.0)
+        alongX = AXIS[heading] == 0
+        x += np.where(alongX, distance, 0.0)
+        y += np.where(alongX, 0.0, distance)
+
+        # Turning vehicles swing round the junction one rotation step per tick
+        rotatingDirection = direction[rotating]
+        rotatingLane = lane[rotating]
+        self.rotateStep[rotating] += 1
+        x[rotating] += TURN_DX[rotatingDirection, rotatingLane]
+        y[rotating] += TURN_DY[rotatingDirection, rotatingLane]
+        sizes = self.rotatedSizes[self.shape[rotating], self.rotateStep[rotating], (rotatingLane == 2).astype(int)]
+        width[rotating] = sizes[:, 0]
+        height[rotating] = sizes[:, 1]
+
+        completed = rotating[self.rotateStep[rotating] == self.rotationSteps]
+        self.turned[completed] = 1
+        heading[completed] = TURN_HEADING[direction[completed], lane[completed]]
+
+        # Approaching and queued can only flip for a vehicle that moved before the stop line, one whose
+        # waiting leader did, and the ones marked stale by add(), resetStops() and detectCrossings()
+        movedWaiting = moving & ~crossed
+        recheck = movedWaiting | (self.stale[:n] == 1) | (hasLeader & movedWaiting[leaderId])
+        self.updateQueues(np.flatnonzero(recheck), movingGap)
+        self.stale[:n] = 0
+        self.updateGrid()
+        return completed
+
+    # Refresh the approaching and queued state of the given vehicles. A vehicle is queued while it is
+    # approaching and has reached either its stop coordinate or the vehicle in front of it.
+    # Only vehicles whose state flipped change the per-direction counts.
+    def updateQueues(self, ids, movingGap):
+        if len(ids) == 0:
+            return
+        count = len(ids)
+        leader = self.leader[ids]
+        leaderId = np.where(leader >= 0, leader, 0)
+
+        # The vehicles and their leaders in one pass: the first `count` rows are the vehicles
+        rows = np.concatenate([ids, leaderId])
+        x = self.x[rows]
+        y = self.y[rows]
+        direction = self.direction[rows]
+        crossed = self.crossed[rows]
+        front, rear = extents(direction, x, y, self.width[rows], self.height[rows])
+        front = front[:count]
+        leaderRear = rear[count:]
+        direction = direction[:count]
+
+        position = np.where(AXIS[direction] == 0, x[:count], y[:count])
+        approaching = (crossed[:count] == 0) & (SIGN[direction] * position < self.crossLine[direction])
+        leaderWaiting = (leader >= 0) & (crossed[count:] == 0)
+        queued = approaching & ((front >= SIGN[direction] * self.stop[ids]) |
+                                (leaderWaiting & (front >= leaderRear - movingGap)))
+        self.updateCounts(self.approaching, self.approachingCount, ids, approaching)
+        self.updateCounts(self.queued, self.queueLength, ids, queued)
+
+    def updateCounts(self, flags, counts, ids, state):
+        flipped = state != (flags[ids] == 1)
+        changed = ids[flipped]
+        np.add.at(counts, self.direction[changed], np.where(state[flipped], 1, -1))
+        flags[changed] = state[flipped]
@@ -0,0 +1,64 @@
+import argparse
+import sys
+
+import pygame
+
+import assets
+from main import drawJunction
+from renderer import Renderer
+from shared_state import StateView
+
+# Read-only window onto a run in another process. The engine publishes every tick into shared memory
+# (python engine.py --realtime --share-state NAME); the viewer attaches to it by name, draws the
+# latest frame at up to 60 frames per second and can be closed and opened again while the run goes
+# on. It never slows the engine down.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a running simulation that shares its state.")
+    parser.add_argument('name', help="name given to --share-state")
+    args = parser.parse_args(argv)
+    try:
+        view = StateView(args.name)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    pygame.init()
+    screenWidth = 1400
+    screenHeight = 800
+    screen = pygame.display.set_mode((screenWidth, screenHeight))
+    pygame.display.set_caption("SIMULATION - " + args.name)
+    signalImages = {'green': assets.image('images/signals/green.png'),
+                    'yellow': assets.image('images/signals/yellow.png'),
+                    'red': assets.image('images/signals/red.png')}
+    assets.preload()
+    font = pygame.font.Font(None, 30)
+    renderer = Renderer(screen, assets.image('images/intersection.png'), (0, 0, screenWidth, screenHeight))
+    clock = pygame.time.Clock()
+
+    shown = None
+    finished = False
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                view.close()
+                return 0
+
+        frame = view.latest()
+        if frame is not None and frame.sequence != shown:
+            renderer.begin()
+            drawJunction(renderer, frame, signalImages, font)
+            if frame.valid():
+                renderer.flip()
+                shown = frame.sequence
+            else:
+                renderer.invalidate()  # the engine overwrote the frame while it was drawn
+        if not finished and not view.running():
+            finished = True
+            pygame.display.set_caption("SIMULATION - " + args.name + " (finished)")
+        clock.tick(60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())